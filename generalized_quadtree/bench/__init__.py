@@ -0,0 +1,65 @@
+
+"""
+Benchmarks for the quadtree package.
+
+Each module is runnable, e.g.
+    python -m generalized_quadtree.bench.linear
+and suite runs a grid of them with JSON results (see bench/suite.py).
+"""
+
+import gc
+import sys
+import time
+import types
+import numpy as np
+
+# Objects shared by every tree which should not be charged to any of them.
+_UNCOUNTED = (type, types.ClassType, types.ModuleType, types.FunctionType,
+              types.BuiltinFunctionType, types.MethodType)
+
+def best_time(fn, repeat=3, number=1):
+    "Best wall clock seconds for number calls of fn over repeat trials."
+    best = None
+    for trial in range(repeat):
+        start = time.time()
+        for i in range(number):
+            fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def deep_sizeof(obj):
+    "Approximate bytes reachable from obj, counting shared objects once."
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _UNCOUNTED):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        stack.extend(gc.get_referents(item))
+    return total
+
+def uniform_points(npoints, dimensions=2, seed=0):
+    "npoints uniform positions in the unit cube, with names."
+    rng = np.random.RandomState(seed)
+    positions = rng.uniform(0.0, 1.0, size=(npoints, dimensions))
+    return (positions, ["n%s" % i for i in range(npoints)])
+
+def report(title, rows):
+    "Print rows of (label, value) under title."
+    print(title)
+    for (label, value) in rows:
+        print("  %-40s %s" % (label, value))
+
+def clustered_points(npoints, dimensions=2, seed=0, nclusters=10, spread=0.02):
+    "npoints positions in nclusters gaussian clusters clipped to the unit cube, with names."
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0.1, 0.9, size=(nclusters, dimensions))
+    which = rng.randint(0, nclusters, size=npoints)
+    positions = centers[which] + rng.normal(0.0, spread, size=(npoints, dimensions))
+    positions = np.clip(positions, 0.0, np.nextafter(1.0, 0.0))
+    return (positions, ["n%s" % i for i in range(npoints)])
@@ -0,0 +1,52 @@
+"""
+Read heavy workload with and without the query cache: rounds of repeated
+adjacency walks, box queries and quadrant_names lookups at a fixed set of
+positions, with one insert per round.
+
+    python -m generalized_quadtree.bench.cache [npoints] [dimensions] [nqueries]
+"""
+
+from __future__ import print_function
+import sys
+from .. import gqtree
+from . import best_time, uniform_points, report
+
+def run(npoints=20000, dimensions=2, nqueries=50, rounds=20):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    inserts = uniform_points(rounds, dimensions, seed=2)[0]
+    def count(position, node, tree, data):
+        pass
+    def workload(cache):
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dimensions, 1.0, 16,
+                                                      positions, names)
+        if cache:
+            tree.enable_query_cache()
+        def rounds_of_queries():
+            for (i, insert) in enumerate(inserts):
+                for repeat in range(5):
+                    for query in queries:
+                        tree.adjacency_walk(query, count)
+                        tree.query_box(query - 0.02, query + 0.02)
+                        tree.quadrant_names(query, 6)
+                tree.add(insert, "inserted%s" % i)
+            for i in range(len(inserts)):
+                tree.remove("inserted%s" % i)
+        return (tree, rounds_of_queries)
+    nops = rounds * 5 * nqueries * 3
+    rows = []
+    for cache in (False, True):
+        (tree, fn) = workload(cache)
+        rows.append(("queries, " + ("cached" if cache else "uncached"),
+                     "%.0f" % (nops / best_time(fn))))
+    stats = tree.query_cache.stats()
+    rows.extend([
+        ("hit rate", "%.3f" % (stats["hits"] / float(stats["hits"] + stats["misses"]))),
+        ("invalidations", stats["invalidations"]),
+        ("entries", stats["entries"]),
+    ])
+    report("%s points, %sd, %s positions (per second)" % (npoints, dimensions, nqueries), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
@@ -0,0 +1,41 @@
+"""
+Dual tree joins and all nearest neighbours against per point queries.
+
+    python -m generalized_quadtree.bench.dual [npoints] [dimensions] [k]
+"""
+
+from __future__ import print_function
+import sys
+from .. import gqtree
+from . import best_time, uniform_points, report
+
+def run(npoints=100000, dimensions=2, k=4, metric="l2"):
+    (positions1, names1) = uniform_points(npoints, dimensions)
+    (positions2, names2) = uniform_points(npoints, dimensions, seed=1)
+    origin = [0.0] * dimensions
+    tree1 = gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions1, names1)
+    tree2 = gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions2, names2)
+    # radius expected to hold about k points of tree2
+    radius = (k / float(npoints)) ** (1.0 / dimensions)
+    # per point queries are timed on a sample and scaled up
+    sample = max(1, npoints // 100)
+    per_point = [
+        ("per point within_many", lambda: tree2.within_many(positions1[:sample], radius, metric)),
+        ("per point nearest_many", lambda: tree2.nearest_many(positions1[:sample], k, metric)),
+    ]
+    dual = [
+        ("dual tree spatial_join", lambda: tree1.spatial_join(tree2, radius, metric)),
+        ("dual tree all_nearest", lambda: tree1.all_nearest(k, tree2, metric)),
+        ("dual tree self within_pairs", lambda: tree1.within_pairs(radius, None, metric)),
+    ]
+    rows = []
+    for (label, fn) in per_point:
+        rows.append((label + ", seconds (scaled)", "%.2f" % (best_time(fn, repeat=1) * npoints / sample)))
+    for (label, fn) in dual:
+        rows.append((label + ", seconds", "%.2f" % best_time(fn, repeat=1)))
+    report("%s x %s points, %sd, k=%s, radius=%.4f, %s" % (
+        npoints, npoints, dimensions, k, radius, metric), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
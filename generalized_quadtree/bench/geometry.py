@@ -0,0 +1,67 @@
+"""
+Distance heuristics and node boxes: per call numpy corners against the
+level side table, the vectorized heuristics and the node geometry cache.
+
+    python -m generalized_quadtree.bench.geometry [npoints] [dimensions]
+"""
+
+from __future__ import print_function
+import sys
+import numpy as np
+from .. import gqtree
+from .. import gqquery
+from . import best_time, uniform_points, report
+
+def numpy_dist_to_quadrant_point(tree, index, level, location):
+    "avg_dist_to_quadrant_point before the geometry tables."
+    side = tree.sidelength / float(2 ** level)
+    corner = tree.index_corner(index)
+    ur_corner = corner + side
+    location = np.array(location)
+    offset = max(0, max(corner - location), max(location - ur_corner))
+    return offset + side/2.0
+
+def decoded_box(tree, node):
+    "node_box before node_geometry: decode and allocate per call."
+    level = node.level
+    if level is None:
+        level = tree.levels
+    ipos = tree.index_to_index_position(node.prefix)
+    lower = ipos * tree.min_side + tree.origin
+    return (lower, lower + tree.sidelength / float(2 ** level))
+
+def run(npoints=20000, dimensions=2, nqueries=200):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dimensions, 1.0, 16, positions, names)
+    nodes = [node for node in tree.iter_nodes() if node.level is not None]
+    prefixes = [node.prefix for node in nodes]
+    levels = [node.level for node in nodes]
+    locations = np.resize(queries, (len(nodes), dimensions))
+    others = prefixes[1:] + prefixes[:1]
+    other_levels = levels[1:] + levels[:1]
+    count = len(nodes)
+    def rate(fn, n=count):
+        return "%.0f" % (n / best_time(fn))
+    rows = [
+        ("interior nodes", count),
+        ("dist to point, numpy per call", rate(lambda: [
+            numpy_dist_to_quadrant_point(tree, *args) for args in zip(prefixes, levels, locations)])),
+        ("avg_dist_to_quadrant_point", rate(lambda: [
+            tree.avg_dist_to_quadrant_point(*args) for args in zip(prefixes, levels, locations)])),
+        ("avg_dists_to_quadrant_points", rate(lambda: tree.avg_dists_to_quadrant_points(
+            prefixes, levels, locations))),
+        ("avg_dist_between_quadrants", rate(lambda: [
+            tree.avg_dist_between_quadrants(*args)
+            for args in zip(prefixes, levels, others, other_levels)])),
+        ("avg_dists_between_quadrants", rate(lambda: tree.avg_dists_between_quadrants(
+            prefixes, levels, others, other_levels))),
+        ("node boxes, decoded", rate(lambda: [decoded_box(tree, node) for node in nodes])),
+        ("node boxes, node_geometry", rate(lambda: [gqquery.node_box(tree, node) for node in nodes])),
+        ("nearest queries", rate(lambda: [tree.nearest(query, 5) for query in queries], nqueries)),
+    ]
+    report("%s points, %sd (per second)" % (npoints, dimensions), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
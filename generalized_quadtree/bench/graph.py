@@ -0,0 +1,85 @@
+"""
+Graph layout throughput of GraphQuadTree on synthetic graphs.
+
+    python -m generalized_quadtree.bench.graph [nnodes] [levels] [penalty_nodes]
+
+penalty_nodes names are also placed with add_at_min_penalty and the
+frontier based graph_penalty, for comparison.
+"""
+
+from __future__ import print_function
+import sys
+import time
+import numpy as np
+from .. import gqgraph
+from . import report
+
+def grid_edges(nnodes):
+    "Edges of a square grid graph with about nnodes nodes."
+    side = int(np.sqrt(nnodes))
+    edges = []
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side:
+                edges.append(((i, j), (i + 1, j)))
+            if j + 1 < side:
+                edges.append(((i, j), (i, j + 1)))
+    return edges
+
+def random_edges(nnodes, degree=4, seed=0):
+    "Edges of a random graph with a spanning path and about degree edges per node."
+    rng = np.random.RandomState(seed)
+    edges = [(i, i + 1) for i in range(nnodes - 1)]
+    extra = rng.randint(0, nnodes, size=(nnodes * (degree - 2) // 2, 2))
+    edges.extend((int(a), int(b)) for (a, b) in extra if a != b)
+    return edges
+
+def edge_quality(tree, edges):
+    "(mean edge length over mean distance of random pairs, fraction of names sharing a voxel)."
+    placed = tree.placed
+    names = list(placed)
+    positions = np.array([placed[name] for name in names])
+    first = np.array([placed[a] for (a, b) in edges])
+    second = np.array([placed[b] for (a, b) in edges])
+    edge_length = np.sqrt(((first - second) ** 2).sum(axis=1)).mean()
+    rng = np.random.RandomState(1)
+    pairs = rng.randint(0, len(names), size=(10000, 2))
+    offsets = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+    random_length = np.sqrt((offsets ** 2).sum(axis=1)).mean()
+    voxels = set(tree.index(position) for position in positions)
+    return (edge_length / random_length, 1.0 - len(voxels) / float(len(names)))
+
+def measure(label, edges, nnodes, levels, penalty_nodes):
+    rows = []
+    tree = gqgraph.GraphQuadTree([0.0, 0.0], 1.0, levels)
+    tree.add_edges(edges)
+    start = time.time()
+    (order, positions) = tree.layout()
+    elapsed = time.time() - start
+    (ratio, shared) = edge_quality(tree, edges)
+    rows.append(("layout names per second", "%.0f" % (len(order) / elapsed)))
+    rows.append(("layout seconds", "%.1f" % elapsed))
+    rows.append(("edge length / random pair distance", "%.4f" % ratio))
+    rows.append(("fraction of names sharing a voxel", "%.4f" % shared))
+    if penalty_nodes:
+        subset = gqgraph.breadth_first_order(tree.adjacency)[:penalty_nodes]
+        wanted = set(subset)
+        sub_edges = [(a, b) for (a, b) in edges if a in wanted and b in wanted]
+        small = gqgraph.GraphQuadTree([0.0, 0.0], 1.0, levels)
+        small.add_edges(sub_edges)
+        start = time.time()
+        for name in subset:
+            small.add_at_min_penalty(None, name, vector_penalty_fn=small.graph_penalty(name))
+        elapsed = time.time() - start
+        rows.append(("add_at_min_penalty names per second", "%.0f" % (len(subset) / elapsed)))
+        rows.append(("add_at_min_penalty edge length ratio",
+                     "%.4f" % edge_quality(small, sub_edges)[0]))
+    report("%s graph, %s nodes, %s edges, %s levels" % (label, nnodes, len(edges), levels), rows)
+
+def run(nnodes=100000, levels=12, penalty_nodes=1000):
+    measure("grid", grid_edges(nnodes), nnodes, levels, penalty_nodes)
+    measure("random", random_edges(nnodes), nnodes, levels, penalty_nodes)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
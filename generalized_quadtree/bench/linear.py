@@ -0,0 +1,45 @@
+
+"""
+Memory use and walk throughput of LinearQuadtree against the object tree.
+
+    python -m generalized_quadtree.bench.linear [npoints] [levels]
+"""
+
+from __future__ import print_function
+import sys
+from .. import gqtree
+from .. import gqlinear
+from . import best_time, deep_sizeof, uniform_points, report
+
+def measure(label, tree, positions):
+    npoints = len(positions)
+    counter = [0]
+    def count(node, tree, data):
+        counter[0] += 1
+    # the first walk of a linear tree also derives its node table
+    first_time = best_time(lambda: tree.walk(count), repeat=1)
+    nodes = counter[0]
+    walk_time = best_time(lambda: tree.walk(count))
+    rows = [
+        ("bytes per point", "%.1f" % (deep_sizeof(tree) / float(npoints))),
+        ("first walk visits per second", "%.0f" % (nodes / first_time)),
+        ("walk visits per second", "%.0f" % (nodes / walk_time)),
+        ("nodes visited", nodes),
+    ]
+    if isinstance(tree, gqlinear.LinearQuadtree):
+        lookups = positions[:1000]
+        lookup_time = best_time(lambda: [tree.lookup(p) for p in lookups])
+        rows.append(("point lookups per second", "%.0f" % (len(lookups) / lookup_time)))
+    report("%s tree, %s points, %s levels" % (label, npoints, tree.levels), rows)
+
+def run(npoints=100000, levels=16, dimensions=2):
+    (positions, names) = uniform_points(npoints, dimensions)
+    origin = [0.0] * dimensions
+    # build one tree at a time so neither pays for garbage collecting the other.
+    for (label, tree_class) in [("object", gqtree.GeneralizedQuadtree),
+                                ("linear", gqlinear.LinearQuadtree)]:
+        measure(label, tree_class.from_points(origin, 1.0, levels, positions, names), positions)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
@@ -0,0 +1,40 @@
+
+"""
+Memory footprint per point of the standard and compact node representations.
+
+    python -m generalized_quadtree.bench.memory [npoints] [levels]
+"""
+
+from __future__ import print_function
+import sys
+from .. import gqtree
+from . import deep_sizeof, uniform_points, report
+
+def footprint(npoints, levels, dimensions, compact, with_info=False):
+    "Bytes per point of a tree built from npoints uniform points."
+    (positions, names) = uniform_points(npoints, dimensions)
+    infos = None
+    if with_info:
+        infos = [{"weight": 1.0}] * npoints
+    origin = [0.0] * dimensions
+    tree = gqtree.GeneralizedQuadtree.from_points(
+        origin, 1.0, levels, positions, names, infos, compact=compact)
+    # the positions and names belong to the caller, not the tree.
+    shared = deep_sizeof(positions) + deep_sizeof(names)
+    return (deep_sizeof(tree) - shared) / float(npoints)
+
+def run(npoints=100000, levels=16):
+    for dimensions in (2, 3):
+        for with_info in (False, True):
+            before = footprint(npoints, levels, dimensions, False, with_info)
+            after = footprint(npoints, levels, dimensions, True, with_info)
+            report("%sd, %s points, %s levels%s" % (
+                dimensions, npoints, levels, ", with info" if with_info else ""), [
+                ("standard nodes, bytes per point", "%.1f" % before),
+                ("compact nodes, bytes per point", "%.1f" % after),
+                ("ratio", "%.2f" % (before / after)),
+            ])
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
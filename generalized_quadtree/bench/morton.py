@@ -0,0 +1,73 @@
+"""
+Microbenchmarks of the Morton index primitives against decoding to int
+positions, offsetting and encoding again.
+
+    python -m generalized_quadtree.bench.morton [nindices] [dimensions] [levels]
+"""
+
+from __future__ import print_function
+import sys
+import numpy as np
+from .. import gqtree
+from .. import gqmorton
+from . import best_time, report
+
+def decoded_neighbor(index, offsets, levels, dimensions, level):
+    "The decode/encode path to the neighbouring quadrant at level."
+    shift = levels - level
+    ipos = (gqtree.int_index_inverse(index, levels, dimensions) >> shift) + offsets
+    if ipos.min() < 0 or ipos.max() >= 2 ** level:
+        return None
+    return gqtree.int_index(ipos << shift, levels)
+
+def decoded_adjacent(tree, index1, index2, level):
+    "adjacent before gqmorton: compare the decoded int positions."
+    shift = tree.levels - level
+    pos1 = tree.index_to_index_position(index1)
+    pos2 = tree.index_to_index_position(index2)
+    return np.max(np.abs((pos1 >> shift) - (pos2 >> shift))) <= 1
+
+def decoded_corner(tree, index):
+    "index_corner before gqmorton."
+    voxels = gqtree.int_index_inverse(index, tree.levels, tree.dimensions)
+    return np.array(voxels) * tree.min_side + tree.origin
+
+def run(nindices=20000, dimensions=2, levels=16):
+    rng = np.random.RandomState(0)
+    ipositions = rng.randint(0, 2 ** levels, size=(nindices, dimensions))
+    indices = [gqtree.int_index(ipos, levels) for ipos in ipositions]
+    array = np.array(indices, dtype=gqtree.index_dtype(levels, dimensions))
+    tree = gqtree.GeneralizedQuadtree([0.0] * dimensions, 1.0, levels)
+    level = levels - 2
+    offsets = [1] + [-1] * (dimensions - 1)
+    others = indices[1:] + indices[:1]
+    def rate(fn):
+        return "%.0f" % (nindices / best_time(fn))
+    rows = [
+        ("neighbor, decode/encode", rate(lambda: [
+            decoded_neighbor(index, offsets, levels, dimensions, level) for index in indices])),
+        ("neighbor", rate(lambda: [
+            gqmorton.neighbor(index, offsets, levels, dimensions, level) for index in indices])),
+        ("neighbor_array", rate(lambda: gqmorton.neighbor_array(
+            array, offsets, levels, dimensions, level))),
+        ("step", rate(lambda: [
+            gqmorton.step(index, 0, 1, levels, dimensions, level) for index in indices])),
+        ("adjacent, decoded", rate(lambda: [
+            decoded_adjacent(tree, index, other, level) for (index, other) in zip(indices, others)])),
+        ("adjacent", rate(lambda: [
+            tree.adjacent(index, other, level) for (index, other) in zip(indices, others)])),
+        ("adjacent_array", rate(lambda: gqmorton.adjacent_array(
+            array, np.roll(array, -1), levels, dimensions, level))),
+        ("index_corner, decoded", rate(lambda: [decoded_corner(tree, index) for index in indices])),
+        ("index_corner", rate(lambda: [tree.index_corner(index) for index in indices])),
+        ("parent", rate(lambda: [
+            gqmorton.parent(index, levels, dimensions, level) for index in indices])),
+        ("ancestor_array", rate(lambda: gqmorton.ancestor_array(
+            array, levels, dimensions, level))),
+    ]
+    report("%s indices, %sd, %s levels (operations per second)" % (nindices, dimensions, levels),
+           rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
@@ -0,0 +1,58 @@
+"""
+Per tick updates with move against rebuilding the tree with from_points.
+
+    python -m generalized_quadtree.bench.moves [npoints] [ticks] [levels]
+"""
+
+from __future__ import print_function
+import sys
+import time
+import numpy as np
+from .. import gqtree
+from . import uniform_points, report
+
+def steps(npoints, dimensions, ticks, step, seed=2):
+    "Random walk displacements for each tick, as a (ticks, npoints, dimensions) array."
+    rng = np.random.RandomState(seed)
+    return rng.uniform(-step, step, size=(ticks, npoints, dimensions))
+
+def tick_seconds(update, start, displacements, moving):
+    "Mean seconds per tick of update(positions) after moving the rows in moving."
+    positions = start.copy()
+    elapsed = 0.0
+    for tick in range(len(displacements)):
+        positions[moving] = (positions[moving] + displacements[tick, moving]).clip(0, 1 - 1e-9)
+        began = time.time()
+        update(positions)
+        elapsed += time.time() - began
+    return elapsed / len(displacements)
+
+def run(npoints=100000, ticks=3, levels=12, dimensions=2):
+    (start, names) = uniform_points(npoints, dimensions)
+    origin = [0.0] * dimensions
+    rows = []
+    # step sizes in voxels: most entities stay in their voxel for the smallest.
+    for voxels in (0.1, 10.0):
+        displacements = steps(npoints, dimensions, ticks, voxels / 2 ** levels)
+        for fraction in (0.01, 0.1, 1.0):
+            moving = np.arange(0, npoints, int(round(1 / fraction)))
+            moving_names = [names[i] for i in moving]
+            tree = gqtree.GeneralizedQuadtree.from_points(origin, 1.0, levels, start, names)
+            def moves(positions):
+                for i in moving:
+                    tree.move(names[i], positions[i])
+            per_name = tick_seconds(moves, start, displacements, moving)
+            tree = gqtree.GeneralizedQuadtree.from_points(origin, 1.0, levels, start, names)
+            batched = tick_seconds(lambda positions: tree.move_many(moving_names, positions[moving]),
+                                   start, displacements, moving)
+            rebuilt = tick_seconds(lambda positions: gqtree.GeneralizedQuadtree.from_points(
+                origin, 1.0, levels, positions, names), start, displacements, moving)
+            label = "step %s voxels, %s%% moving" % (voxels, int(fraction * 100))
+            rows.append((label + ", move per tick (s)", "%.3f" % per_name))
+            rows.append((label + ", move_many per tick (s)", "%.3f" % batched))
+            rows.append((label + ", rebuild per tick (s)", "%.3f" % rebuilt))
+    report("%s points, %s ticks, %s levels, %sd" % (npoints, ticks, levels, dimensions), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
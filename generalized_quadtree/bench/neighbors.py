@@ -0,0 +1,58 @@
+"""
+The neighbour index: its cost to build and maintain, and the lookups and
+adjacency walks it speeds up.
+
+    python -m generalized_quadtree.bench.neighbors [npoints] [dimensions]
+"""
+
+from __future__ import print_function
+import sys
+from .. import gqtree
+from . import best_time, uniform_points, report
+
+def run(npoints=20000, dimensions=2, nqueries=200, nadds=2000):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    added = uniform_points(nadds, dimensions, seed=2)[0]
+    origin = [0.0] * dimensions
+    def build():
+        return gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions, names)
+    tree = build()
+    nodes = list(tree.iter_nodes())
+    sample = nodes[::max(1, len(nodes) // 500)]
+    pairs = [(node.prefix, other.prefix, node.level) for (node, other)
+             in zip(sample, sample[1:] + sample[:1]) if node.level is not None]
+    def walks():
+        return sum(sum(1 for node in tree.iter_adjacent(query)) for query in queries)
+    def adds(indexed):
+        added_tree = build()
+        if indexed:
+            added_tree.enable_neighbor_index()
+        return best_time(lambda: [added_tree.add(position, "a%s" % i)
+                                  for (i, position) in enumerate(added)], repeat=1)
+    rows = [("nodes", len(nodes))]
+    visits = walks()
+    unindexed = [
+        best_time(lambda: [tree.neighbors(node) for node in sample], repeat=1),
+        best_time(walks, repeat=1),
+        best_time(lambda: [tree.adjacent(*pair) for pair in pairs]),
+    ]
+    rows.append(("enable_neighbor_index (s)", "%.2f" % best_time(tree.enable_neighbor_index, repeat=1)))
+    indexed = [
+        best_time(lambda: [tree.neighbors(node) for node in sample], repeat=1),
+        best_time(walks, repeat=1),
+        best_time(lambda: [tree.adjacent(*pair) for pair in pairs]),
+    ]
+    for (label, count, before, after) in [
+            ("neighbors lookups", len(sample), unindexed[0], indexed[0]),
+            ("adjacency walk visits", visits, unindexed[1], indexed[1]),
+            ("adjacent tests", len(pairs), unindexed[2], indexed[2])]:
+        rows.append((label + " per second", "%.0f searched, %.0f indexed" % (
+            count / before, count / after)))
+    rows.append(("adds per second", "%.0f without index, %.0f with" % (
+        nadds / adds(False), nadds / adds(True))))
+    report("%s points, %sd" % (npoints, dimensions), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
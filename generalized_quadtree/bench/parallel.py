@@ -0,0 +1,39 @@
+"""
+Parallel construction and sharded batched queries for 1, 2, 4 and 8 workers.
+
+    python -m generalized_quadtree.bench.parallel [npoints] [nqueries] [dimensions]
+
+Speedups are bounded by the processors available, reported in the title.
+"""
+
+from __future__ import print_function
+import multiprocessing
+import sys
+from .. import gqtree
+from . import best_time, uniform_points, report
+
+def run(npoints=300000, nqueries=5000, dimensions=2, k=10):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    origin = [0.0] * dimensions
+    tree = gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions, names)
+    rows = [
+        ("from_points (s)", best_time(lambda: gqtree.GeneralizedQuadtree.from_points(
+            origin, 1.0, 16, positions, names), repeat=1)),
+        ("nearest_many (s)", best_time(lambda: tree.nearest_many(queries, k), repeat=1)),
+    ]
+    for workers in (1, 2, 4, 8):
+        rows.append(("from_points, %s workers (s)" % workers, best_time(
+            lambda: gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions, names,
+                                                           workers=workers), repeat=1)))
+        for share in ("fork", "file"):
+            with tree.query_pool(workers, share) as pool:
+                rows.append(("nearest_many, %s workers, %s (s)" % (workers, share), best_time(
+                    lambda: pool.nearest_many(queries, k), repeat=1)))
+    rows = [(label, "%.2f" % seconds) for (label, seconds) in rows]
+    report("%s points, %s queries, %sd, k=%s, %s processors" % (
+        npoints, nqueries, dimensions, k, multiprocessing.cpu_count()), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
@@ -0,0 +1,53 @@
+"""
+Names placed per second by add_many_at_min_penalty against repeated
+add_at_min_penalty calls.
+
+    python -m generalized_quadtree.bench.placement [nnames] [levels] [dimensions]
+"""
+
+from __future__ import print_function
+import sys
+import numpy as np
+from .. import gqtree
+from . import best_time, report
+
+def crowding_penalty(tree):
+    "Penalty of names in a node, falling off with voxel distance at the node's level."
+    def node_penalty_fn(node, qindex, voxels, corner):
+        ipos = tree.node_int_position(node)
+        distance = int(np.abs(ipos - voxels).max())
+        return len(node.get_names()) / (1.0 + distance)
+    def vector_penalty_fn(nodes, node_positions, qindices, voxels, corners):
+        counts = np.array([len(node.get_names()) for node in nodes], dtype=float)
+        distances = np.abs(voxels[:, None, :] - node_positions[None, :, :]).max(axis=2)
+        return counts / (1.0 + distances)
+    return (node_penalty_fn, vector_penalty_fn)
+
+def run(nnames=1000, levels=8, dimensions=2):
+    names = range(nnames)
+    origin = [0.0] * dimensions
+    trees = {}
+    def single():
+        tree = trees["single"] = gqtree.GeneralizedQuadtree(origin, 1.0, levels)
+        node_penalty_fn = crowding_penalty(tree)[0]
+        for name in names:
+            tree.add_at_min_penalty(node_penalty_fn, name)
+    def many():
+        tree = trees["many"] = gqtree.GeneralizedQuadtree(origin, 1.0, levels)
+        tree.add_many_at_min_penalty(crowding_penalty(tree)[0], names)
+    def many_vector():
+        tree = trees["vector"] = gqtree.GeneralizedQuadtree(origin, 1.0, levels)
+        tree.add_many_at_min_penalty(None, names, vector_penalty_fn=crowding_penalty(tree)[1])
+    rows = []
+    for (label, fn) in [("add_at_min_penalty", single),
+                        ("add_many_at_min_penalty", many),
+                        ("add_many_at_min_penalty, vectorized", many_vector)]:
+        elapsed = best_time(fn, repeat=1)
+        rows.append((label + " names per second", "%.0f" % (nnames / elapsed)))
+    same = trees["many"].list_dump() == trees["single"].list_dump()
+    rows.append(("same placements", same))
+    report("%s names, %s levels, %s dimensions" % (nnames, levels, dimensions), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
@@ -0,0 +1,60 @@
+
+"""
+Nearest neighbour and radius queries against brute force scans.
+
+    python -m generalized_quadtree.bench.queries [npoints] [nqueries] [dimensions]
+"""
+
+from __future__ import print_function
+import sys
+import numpy as np
+from .. import gqtree
+from .. import gqquery
+from . import best_time, uniform_points, report
+
+def walk_entries(tree):
+    "(names, positions) of every leaf entry, collected with walk."
+    entries = []
+    def collect(node, tree, data):
+        if node.level is None:
+            entries.extend(node.entries())
+    tree.walk(collect)
+    return ([name for (name, position) in entries],
+            np.array([position for (name, position) in entries], dtype=float))
+
+def brute_nearest(names, positions, query, k, order):
+    distances = gqquery.norms(positions - query, order)
+    best = np.argsort(distances, kind="mergesort")[:k]
+    return ([names[i] for i in best], positions[best], distances[best])
+
+def brute_within(names, positions, query, radius, order):
+    distances = gqquery.norms(positions - query, order)
+    inside = np.flatnonzero(distances <= radius)
+    inside = inside[np.argsort(distances[inside], kind="mergesort")]
+    return ([names[i] for i in inside], positions[inside], distances[inside])
+
+def run(npoints=100000, nqueries=200, dimensions=2, k=10, metric="l2"):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dimensions, 1.0, 16, positions, names)
+    order = gqquery.metric_order(metric)
+    # radius expected to hold about k points
+    radius = (k / float(npoints)) ** (1.0 / dimensions)
+    (all_names, all_positions) = walk_entries(tree)
+    timings = [
+        ("tree nearest_many", lambda: tree.nearest_many(queries, k, metric)),
+        ("brute force nearest", lambda: [brute_nearest(all_names, all_positions, q, k, order)
+                                         for q in queries]),
+        ("tree within_many", lambda: tree.within_many(queries, radius, metric)),
+        ("brute force within", lambda: [brute_within(all_names, all_positions, q, radius, order)
+                                        for q in queries]),
+    ]
+    rows = []
+    for (label, fn) in timings:
+        rows.append((label + ", queries per second", "%.0f" % (nqueries / best_time(fn))))
+    report("%s points, %s queries, %sd, k=%s, radius=%.4f, %s" % (
+        npoints, nqueries, dimensions, k, radius, metric), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
@@ -0,0 +1,57 @@
+"""
+Latency and throughput of the query server under the load generator, one
+request in flight per client: unbatched (max_batch 1) against batch windows.
+The server runs in a forked process on a Unix socket.
+
+    python -m generalized_quadtree.bench.server [npoints] [clients] [nrequests]
+"""
+
+from __future__ import print_function
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from .. import gqtree
+from .. import gqserver
+from . import uniform_points, report
+
+def serve(path, npoints, window, max_batch):
+    "Run in the server process."
+    (positions, names) = uniform_points(npoints, 2)
+    tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 1.0, 16, positions, names)
+    gqserver.serve(tree, path, window, max_batch).serve_forever()
+
+def run(npoints=20000, clients=16, nrequests=4000):
+    directory = tempfile.mkdtemp()
+    settings = [("unbatched", 0.0, 1), ("window 0", 0.0, 256), ("window 0.3 ms", 0.0003, 256),
+                ("window 1 ms", 0.001, 256)]
+    rows = []
+    try:
+        for (i, (label, window, max_batch)) in enumerate(settings):
+            path = os.path.join(directory, "socket%s" % i)
+            process = multiprocessing.Process(target=serve, args=(path, npoints, window, max_batch))
+            process.start()
+            try:
+                while not os.path.exists(path):
+                    time.sleep(0.05)
+                client = gqserver.QueryClient(path)
+                info = client.info()
+                client.close()
+                for op in ("nearest", "box", "adjacent"):
+                    summary = gqserver.load(path, gqserver.random_requests(info, op, nrequests),
+                                            clients)
+                    rows.append(("%s, %s" % (op, label), "%6.0f per second, p50 %.2f ms, p99 %.2f ms"
+                                 % (summary["per_second"], summary["p50"] * 1e3,
+                                    summary["p99"] * 1e3)))
+            finally:
+                process.terminate()
+                process.join()
+    finally:
+        shutil.rmtree(directory)
+    report("%s points, %s clients, %s requests per op" % (npoints, clients, nrequests), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
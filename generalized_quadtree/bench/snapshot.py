@@ -0,0 +1,84 @@
+"""
+Read throughput while a writer thread inserts: readers querying the tree
+under a global lock shared with the writer, against readers querying
+snapshots of a tree updated by path copying, without locks.  Also the cost
+of path copying to single threaded add and remove.
+
+    python -m generalized_quadtree.bench.snapshot [npoints] [nreaders] [ninserts]
+"""
+
+from __future__ import print_function
+import sys
+import threading
+import time
+from .. import gqtree
+from . import best_time, uniform_points, report
+
+def concurrent(tree, read, write, nreaders, inserts):
+    "(reads, writes) per second while one thread adds inserts and nreaders call read(query)."
+    (positions, names) = inserts
+    queries = uniform_points(100, tree.dimensions, seed=3)[0]
+    done = []
+    reads = [0] * nreaders
+    def writer():
+        for (position, name) in zip(positions, names):
+            write(position, name)
+        done.append(True)
+    def reader(i):
+        count = 0
+        while not done:
+            read(queries[count % len(queries)])
+            count += 1
+        reads[i] = count
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(nreaders)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    writer()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return (sum(reads) / elapsed, len(names) / elapsed)
+
+def run(npoints=20000, nreaders=4, ninserts=5000, dimensions=2):
+    (positions, names) = uniform_points(npoints, dimensions)
+    inserts = uniform_points(ninserts, dimensions, seed=1)
+    inserts = (inserts[0], ["inserted%s" % i for i in range(ninserts)])
+    rows = []
+    # single threaded update costs
+    def updates(persistent):
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dimensions, 1.0, 16,
+                                                      positions, names)
+        if persistent:
+            tree.enable_snapshots()
+        def fn():
+            for (position, name) in zip(*inserts):
+                tree.add(position, name)
+            for name in inserts[1]:
+                tree.remove(name)
+        return fn
+    for persistent in (False, True):
+        rows.append(("add + remove, " + ("path copying" if persistent else "in place"),
+                     "%.0f" % (ninserts / best_time(updates(persistent)))))
+    side = 0.02
+    lock = threading.Lock()
+    tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dimensions, 1.0, 16, positions, names)
+    def locked_read(query):
+        with lock:
+            tree.query_box(query - side, query + side)
+    def locked_write(position, name):
+        with lock:
+            tree.add(position, name)
+    (reads, writes) = concurrent(tree, locked_read, locked_write, nreaders, inserts)
+    rows.extend([("reads, global lock", "%.0f" % reads), ("writes, global lock", "%.0f" % writes)])
+    tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dimensions, 1.0, 16, positions, names)
+    tree.enable_snapshots()
+    def snapshot_read(query):
+        tree.snapshot().query_box(query - side, query + side)
+    (reads, writes) = concurrent(tree, snapshot_read, tree.add, nreaders, inserts)
+    rows.extend([("reads, snapshots", "%.0f" % reads), ("writes, snapshots", "%.0f" % writes)])
+    report("%s points, %s readers, %s inserts (per second)" % (npoints, nreaders, ninserts), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
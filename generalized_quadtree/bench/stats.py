@@ -0,0 +1,54 @@
+"""
+Cost of the stats instrumentation: add, walk and add_at_min_penalty on a
+tree without a recorder (the default), with one and with one and a hook.
+
+    python -m generalized_quadtree.bench.stats [npoints] [dimensions]
+"""
+
+from __future__ import print_function
+import sys
+from .. import gqtree
+from . import best_time, uniform_points, report
+
+def node_penalty_fn(node, qindex, voxels, corner):
+    if qindex == node.prefix:
+        return len(node.get_names())
+    return 0
+
+def run(npoints=20000, dimensions=2, nplacements=50):
+    (positions, names) = uniform_points(npoints, dimensions)
+    origin = [0.0] * dimensions
+    def add(setup):
+        tree = gqtree.GeneralizedQuadtree(origin, 1.0, 16)
+        setup(tree)
+        for (position, name) in zip(positions, names):
+            tree.add(position, name)
+        return tree
+    def place(tree):
+        for i in range(nplacements):
+            tree.add_at_min_penalty(node_penalty_fn, "placed%s" % i)
+        for i in range(nplacements):
+            tree.remove("placed%s" % i)
+    events = []
+    setups = [
+        ("disabled", lambda tree: None),
+        ("recorder", lambda tree: tree.enable_stats()),
+        ("recorder and hook", lambda tree: tree.enable_stats(
+            lambda operation, event: events.append(operation))),
+    ]
+    rows = []
+    for (label, setup) in setups:
+        tree = add(setup)
+        del events[:]
+        rows.extend([
+            ("add, " + label, "%.0f" % (npoints / best_time(lambda: add(setup)))),
+            ("walk, " + label, "%.2f" % (1.0 / best_time(
+                lambda: tree.walk(lambda node, tree, data: None)))),
+            ("add_at_min_penalty, " + label, "%.0f" % (nplacements / best_time(
+                lambda: place(tree)))),
+        ])
+    report("%s points, %sd (per second)" % (npoints, dimensions), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
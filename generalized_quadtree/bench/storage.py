@@ -0,0 +1,43 @@
+"""
+Startup from saved files against rebuilding from raw points.
+
+    python -m generalized_quadtree.bench.storage [npoints] [dimensions]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+from .. import gqtree
+from .. import gqfile
+from . import best_time, uniform_points, report
+
+def run(npoints=1000000, dimensions=2, nqueries=100):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    origin = [0.0] * dimensions
+    tree = gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions, names)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "tree.gqt")
+        rows = [
+            ("from_points (s)", best_time(lambda: gqtree.GeneralizedQuadtree.from_points(
+                origin, 1.0, 16, positions, names), repeat=1)),
+            ("save (s)", best_time(lambda: tree.save(path), repeat=1)),
+            ("load (s)", best_time(lambda: gqfile.load(path), repeat=1)),
+            ("load mmap (s)", best_time(lambda: gqfile.load(path, mmap=True), repeat=1)),
+            ("load mmap and %s nearest queries (s)" % nqueries, best_time(
+                lambda: gqfile.load(path, mmap=True).nearest_many(queries, 10), repeat=1)),
+            ("%s nearest queries in memory (s)" % nqueries, best_time(
+                lambda: tree.nearest_many(queries, 10), repeat=1)),
+        ]
+        rows = [(label, "%.3f" % seconds) for (label, seconds) in rows]
+        rows.append(("file size (MB)", "%.1f" % (os.path.getsize(path) / 1e6)))
+    finally:
+        shutil.rmtree(directory)
+    report("%s points, %sd" % (npoints, dimensions), rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
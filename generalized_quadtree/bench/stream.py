@@ -0,0 +1,52 @@
+"""
+Streaming construction of a saved tree from .npy chunks under a memory budget.
+
+    python -m generalized_quadtree.bench.stream [npoints] [budget_mb] [chunk_rows]
+"""
+
+from __future__ import print_function
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from .. import gqfile
+from .. import gqstream
+from . import report
+
+def run(npoints=1000000, budget_mb=32, chunk_rows=100000, dimensions=2):
+    directory = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(0)
+        paths = []
+        for (i, start) in enumerate(range(0, npoints, chunk_rows)):
+            path = os.path.join(directory, "chunk%s.npy" % i)
+            np.save(path, rng.uniform(0.0, 1.0, size=(min(chunk_rows, npoints - start), dimensions)))
+            paths.append(path)
+        output = os.path.join(directory, "tree.gqt")
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.time()
+        rows = gqstream.build_file(gqstream.npy_chunks(paths, chunk_rows), output, [0.0] * dimensions,
+                                   1.0, 16, budget=budget_mb << 20, directory=directory,
+                                   progress=gqstream.print_progress)
+        elapsed = time.time() - started
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        mapped = gqfile.load(output, mmap=True)
+        assert len(mapped.names) == rows
+        rows = [
+            ("rows", rows),
+            ("seconds", "%.1f" % elapsed),
+            ("rows per second", "%.0f" % (rows / elapsed)),
+            ("peak resident growth (MB)", "%.0f" % ((after - before) / 1024.0)),
+            ("file size (MB)", "%.1f" % (os.path.getsize(output) / 1e6)),
+        ]
+    finally:
+        shutil.rmtree(directory)
+    report("%s points in chunks of %s, budget %s MB, %sd" % (npoints, chunk_rows, budget_mb, dimensions),
+           rows)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
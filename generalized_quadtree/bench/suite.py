@@ -0,0 +1,277 @@
+"""
+Benchmark suite with JSON results, and a comparison of two result files
+flagging slowdowns.
+
+    python -m generalized_quadtree.bench.suite [--profile quick] [--output results.json]
+    python -m generalized_quadtree.bench.suite --compare old.json new.json [--threshold 0.1]
+
+Each case is an operation timed on one configuration of dimensions,
+levels, point count and distribution (uniform or clustered), with fixed
+seeds.  The inputs (points, indices and a tree built by from_points) are
+prepared once per configuration, and each operation then runs in a
+process forked from there, so the peak resident memory it reports
+(peak_mb, over the resident size at fork) is its own.  Operations with a
+per item cost run on at most the profile's sample of items; "count" in
+the results is the number timed per call and "seconds" the best time of
+a call.  A case that raises is recorded with its "error".  --compare
+exits with status 1 when any case is slower (or uses more memory) than
+the threshold allows, or fails.
+"""
+
+from __future__ import print_function
+import argparse
+import gc
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import numpy as np
+from .. import gqtree
+from . import best_time, uniform_points, clustered_points
+
+PROFILES = {
+    "quick": {"dimensions": (2, 3, 6), "levels": (4, 12, 20), "points": (1000,),
+              "sample": 10000, "placements": 10, "queries": 10, "repeat": 3,
+              "min_seconds": 0.05},
+    "standard": {"dimensions": (2, 3, 6), "levels": (4, 12, 20), "points": (1000, 10000, 100000),
+                 "sample": 100000, "placements": 50, "queries": 20, "repeat": 3,
+                 "min_seconds": 0.2},
+    "full": {"dimensions": (2, 3, 6), "levels": (4, 8, 12, 16, 20),
+             "points": (1000, 10000, 100000, 1000000),
+             "sample": 1000000, "placements": 200, "queries": 50, "repeat": 3,
+             "min_seconds": 0.2},
+}
+
+DISTRIBUTIONS = {"uniform": uniform_points, "clustered": clustered_points}
+
+# fields identifying a case in result files
+KEY = ("operation", "dimensions", "levels", "points", "distribution")
+
+def node_penalty_fn(node, qindex, voxels, corner):
+    "The penalty of test_add_min2: the names of a node in the candidate quadrant."
+    if qindex == node.prefix:
+        return len(node.get_names())
+    return 0
+
+class Config(object):
+    "Inputs shared by the operations timed on one configuration."
+
+    def __init__(self, dimensions, levels, npoints, distribution, profile):
+        self.dimensions = dimensions
+        self.levels = levels
+        self.npoints = npoints
+        self.distribution = distribution
+        self.profile = profile
+        (self.positions, self.names) = DISTRIBUTIONS[distribution](npoints, dimensions)
+        self.origin = [0.0] * dimensions
+        self.tree = gqtree.GeneralizedQuadtree.from_points(self.origin, 1.0, levels,
+                                                          self.positions, self.names)
+        sample = self.positions[:profile["sample"]]
+        self.int_positions = [list(ipos) for ipos in self.tree.int_positions(sample)]
+        self.indices = sorted(gqtree.int_index(ipos, levels) for ipos in self.int_positions)
+        self.queries = self.positions[:profile["queries"]]
+
+    def new_tree(self):
+        return gqtree.GeneralizedQuadtree(self.origin, 1.0, self.levels)
+
+def time_int_index(config):
+    levels = config.levels
+    return (len(config.int_positions), lambda: [
+        gqtree.int_index(ipos, levels) for ipos in config.int_positions])
+
+def time_int_index_inverse(config):
+    (levels, dimensions) = (config.levels, config.dimensions)
+    return (len(config.indices), lambda: [
+        gqtree.int_index_inverse(index, levels, dimensions) for index in config.indices])
+
+def time_common_prefix_level(config):
+    tree = config.tree
+    pairs = zip(config.indices, config.indices[1:])
+    return (len(pairs), lambda: [tree.common_prefix_level(index1, index2)
+                                 for (index1, index2) in pairs])
+
+def time_add(config):
+    def add():
+        tree = config.new_tree()
+        for (position, name) in zip(config.positions, config.names):
+            tree.add(position, name)
+    return (config.npoints, add)
+
+def time_add_at_min_penalty(config):
+    count = config.profile["placements"]
+    tree = config.tree
+    def place():
+        for i in range(count):
+            tree.add_at_min_penalty(node_penalty_fn, "placed%s" % i)
+        for i in range(count):
+            tree.remove("placed%s" % i)
+    return (count, place)
+
+def time_walk(config):
+    tree = config.tree
+    counter = [0]
+    def count(node, tree, data):
+        counter[0] += 1
+    tree.walk(count)
+    return (counter[0], lambda: tree.walk(count))
+
+def time_adjacency_walk(config):
+    tree = config.tree
+    def count(position, node, tree, data):
+        pass
+    return (len(config.queries), lambda: [tree.adjacency_walk(query, count)
+                                          for query in config.queries])
+
+OPERATIONS = [
+    ("int_index", time_int_index),
+    ("int_index_inverse", time_int_index_inverse),
+    ("common_prefix_level", time_common_prefix_level),
+    ("add", time_add),
+    ("add_at_min_penalty", time_add_at_min_penalty),
+    ("walk", time_walk),
+    ("adjacency_walk", time_adjacency_walk),
+]
+
+def peak_mb():
+    "Peak resident memory of this process in MB."
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def call_time(fn, repeat, min_seconds):
+    """
+    Best seconds per call of fn over repeat trials, each of enough calls
+    to take min_seconds, with the garbage collector off as in timeit.
+    """
+    gc.disable()
+    try:
+        once = best_time(fn, repeat=1)
+        number = max(1, int(min_seconds / max(once, 1e-9)))
+        return min(once, best_time(fn, repeat, number) / number)
+    finally:
+        gc.enable()
+
+def measure(config, timer, connection):
+    "Run in a forked process: send (count, seconds, peak_mb, error) for timer on config."
+    start = peak_mb()
+    try:
+        (count, fn) = timer(config)
+        seconds = call_time(fn, config.profile["repeat"], config.profile["min_seconds"])
+    except Exception as e:
+        connection.send((None, None, None, "%s: %s" % (type(e).__name__, e)))
+    else:
+        connection.send((count, seconds, peak_mb() - start, None))
+    connection.close()
+
+def run_case(config, timer):
+    "(count, seconds, peak_mb, error) of timer on config, measured in a forked process."
+    (receiver, sender) = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=measure, args=(config, timer, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = (None, None, None, "process exited")
+    process.join()
+    return result
+
+def run(profile="quick", operations=None, output=None):
+    "Run the suite, print a line per case and return the results."
+    settings = PROFILES[profile]
+    results = []
+    for (dimensions, levels, npoints, distribution) in itertools.product(
+            settings["dimensions"], settings["levels"], settings["points"], sorted(DISTRIBUTIONS)):
+        config = Config(dimensions, levels, npoints, distribution, settings)
+        for (operation, timer) in OPERATIONS:
+            if operations and operation not in operations:
+                continue
+            (count, seconds, peak, error) = run_case(config, timer)
+            case = {"operation": operation, "dimensions": dimensions, "levels": levels,
+                    "points": npoints, "distribution": distribution, "count": count,
+                    "seconds": seconds, "per_second": count / seconds if seconds else None,
+                    "peak_mb": peak}
+            label = "%-20s %sd %2s levels %7s %-9s" % (
+                operation, dimensions, levels, npoints, distribution)
+            if error is not None:
+                case["error"] = error
+                print(label, "failed:", error)
+            else:
+                print("%s %10.0f per second %8.1f MB" % (label, case["per_second"] or 0, peak))
+            results.append(case)
+    document = {"meta": {"profile": profile, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                         "python": platform.python_version(), "numpy": np.__version__,
+                         "platform": platform.platform()},
+                "results": results}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(document, f, indent=1, sort_keys=True)
+    return document
+
+# peak memory differences below this many MB are page granularity noise
+MEMORY_NOISE = 1.0
+
+def compare(old, new, threshold=0.1):
+    """
+    List of (key, time ratio, memory ratio, flagged) for the cases of two
+    result documents, ratios new / old of the time per item and peak memory
+    (both None for cases failing only in new, which are flagged).
+    """
+    before = dict((tuple(case[field] for field in KEY), case) for case in old["results"])
+    rows = []
+    for case in new["results"]:
+        key = tuple(case[field] for field in KEY)
+        previous = before.get(key)
+        if previous is None or "error" in previous:
+            continue
+        if "error" in case:
+            rows.append((key, None, None, True))
+            continue
+        time_ratio = ((case["seconds"] / case["count"]) /
+                      (previous["seconds"] / previous["count"]))
+        memory_ratio = None
+        if previous["peak_mb"] > 0:
+            memory_ratio = case["peak_mb"] / previous["peak_mb"]
+        grown = case["peak_mb"] - previous["peak_mb"] > max(
+            MEMORY_NOISE, threshold * previous["peak_mb"])
+        flagged = time_ratio > 1 + threshold or grown
+        rows.append((key, time_ratio, memory_ratio, flagged))
+    return rows
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="quadtree benchmark suite")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--only", help="comma separated operations to run")
+    parser.add_argument("--output", help="file for the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="flag ratios above 1 + threshold (default 0.1)")
+    args = parser.parse_args(argv)
+    if args.compare:
+        documents = []
+        for path in args.compare:
+            with open(path) as f:
+                documents.append(json.load(f))
+        rows = compare(documents[0], documents[1], args.threshold)
+        for (key, time_ratio, memory_ratio, flagged) in rows:
+            label = "%-20s %sd %2s levels %7s %-9s" % key
+            if time_ratio is None:
+                print(label, "FAILED")
+                continue
+            print("%s time x%.2f memory %s%s" % (
+                label, time_ratio, "-" if memory_ratio is None else "x%.2f" % memory_ratio,
+                "  SLOWER" if flagged else ""))
+        return 1 if any(row[3] for row in rows) else 0
+    operations = None
+    if args.only:
+        operations = args.only.split(",")
+        unknown = set(operations) - set(name for (name, timer) in OPERATIONS)
+        if unknown:
+            parser.error("unknown operations " + ", ".join(sorted(unknown)))
+    run(args.profile, operations, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""
+Node visits per second of the traversal iterators against the recursive
+callback walks they replaced.
+
+    python -m generalized_quadtree.bench.traversal [npoints] [dimensions]
+"""
+
+from __future__ import print_function
+import itertools
+import sys
+import numpy as np
+from .. import gqtree
+from .. import gqlinear
+from . import best_time, uniform_points, report
+
+def recursive_walk(node, tree, callback, data):
+    "The walk before iter_nodes: a Python frame per level, children first."
+    for child in node.child_nodes():
+        recursive_walk(child, tree, callback, data)
+    callback(node, tree, data)
+
+def recursive_adjacency_walk(node, tree, callback, data, position, iposition):
+    "The adjacency_walk before iter_adjacent."
+    level = node.level
+    if level is not None:
+        shift = tree.levels - level
+        offset = (tree.node_int_position(node) >> shift) - (iposition >> shift)
+        if np.max(np.abs(offset)) <= 1:
+            for child in node.child_nodes():
+                recursive_adjacency_walk(child, tree, callback, data, position, iposition)
+            return
+    callback(position, node, tree, data)
+
+def rate(fn):
+    "Visits per second of fn, which returns its number of visits."
+    counts = []
+    seconds = best_time(lambda: counts.append(fn()))
+    return "%.0f" % (counts[-1] / seconds)
+
+def measure(label, tree, queries):
+    def count_walk(walk):
+        counter = [0]
+        def count(*args):
+            counter[0] += 1
+        walk(count)
+        return counter[0]
+    def count(nodes):
+        return sum(1 for node in nodes)
+    def adjacent(walk):
+        return sum(count_walk(lambda callback: walk(query, callback)) for query in queries)
+    root = tree.root
+    rows = [
+        ("recursive callback walk", rate(lambda: count_walk(
+            lambda callback: recursive_walk(root, tree, callback, None)))),
+        ("walk", rate(lambda: count_walk(tree.walk))),
+        ("iter_nodes post", rate(lambda: count(tree.iter_nodes("post")))),
+        ("iter_nodes pre", rate(lambda: count(tree.iter_nodes("pre")))),
+        ("iter_nodes bfs", rate(lambda: count(tree.iter_nodes("bfs")))),
+        ("iter_leaves", rate(lambda: count(tree.iter_leaves()))),
+        ("recursive adjacency walk", rate(lambda: adjacent(
+            lambda query, callback: recursive_adjacency_walk(
+                root, tree, callback, None, query, tree.int_position(query))))),
+        ("adjacency_walk", rate(lambda: adjacent(tree.adjacency_walk))),
+        ("iter_adjacent", rate(lambda: sum(count(tree.iter_adjacent(query)) for query in queries))),
+    ]
+    rows = [(name + ", visits per second", value) for (name, value) in rows]
+    # stopping early costs only the nodes visited
+    rows.append(("first 10 leaves (ms)", "%.3f" % (1000 * best_time(
+        lambda: list(itertools.islice(tree.iter_leaves(), 10))))))
+    report(label, rows)
+
+def run(npoints=100000, dimensions=2, nqueries=100):
+    (positions, names) = uniform_points(npoints, dimensions)
+    queries = uniform_points(nqueries, dimensions, seed=1)[0]
+    origin = [0.0] * dimensions
+    for (label, tree) in [
+            ("object", gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions, names)),
+            ("compact", gqtree.GeneralizedQuadtree.from_points(origin, 1.0, 16, positions, names,
+                                                               compact=True)),
+            ("linear", gqlinear.LinearQuadtree.from_points(origin, 1.0, 16, positions, names))]:
+        measure("%s tree, %s points, %sd" % (label, npoints, dimensions), tree, queries)
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*args)
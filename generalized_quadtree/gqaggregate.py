@@ -0,0 +1,180 @@
+"""
+Aggregate summaries of the entries below quadtree nodes, and Barnes-Hut
+style field evaluation on top of them.
+
+A Reducer computes a value for the entries of a leaf and merges the values
+of two disjoint sets of entries.  Reducers registered on a tree with
+add_reducer are evaluated lazily by node.get_aggregate(tree, name), cached on
+interior nodes and kept current as leaves are added (like get_names).
+
+field sums a kernel over all entries, treating any node whose side is
+smaller than theta times its distance to the query as a single mass at its
+centroid.
+"""
+
+import numpy as np
+
+class Reducer(object):
+    """
+    Named summary: leaf(records) for a leaf's (name, position, info) records,
+    merge(a, b) to combine.  merge may update and return a mutable a, if copy
+    is given to copy a child's value before it is merged into.
+    """
+
+    def __init__(self, name, leaf, merge, copy=None):
+        self.name = name
+        self.leaf = leaf
+        self.merge = merge
+        self.copy = copy
+
+def info_value(info, key, default):
+    "info[key], or default when info is None or lacks key."
+    if info is None:
+        return default
+    return info.get(key, default)
+
+def count_reducer(name="count"):
+    "Number of entries."
+    return Reducer(name, len, lambda a, b: a + b)
+
+def weight_reducer(name="weight", key="weight", default=1.0):
+    "Total of info[key] over the entries (default for entries without it)."
+    def leaf(records):
+        return float(sum(info_value(info, key, default) for (n, position, info) in records))
+    return Reducer(name, leaf, lambda a, b: a + b)
+
+def centroid_reducer(name="centroid", key=None, default=1.0):
+    """
+    (total weight, weighted mean position) of the entries, weighting by
+    info[key] (or equally when key is None).
+    """
+    def leaf(records):
+        weights = np.array([1.0 if key is None else info_value(info, key, default)
+                            for (n, position, info) in records], dtype=float)
+        positions = np.array([position for (n, position, info) in records], dtype=float)
+        total = weights.sum()
+        if total == 0:
+            return (0.0, positions.mean(axis=0))
+        return (total, weights.dot(positions) / total)
+    def merge(a, b):
+        (weight_a, centroid_a) = a
+        (weight_b, centroid_b) = b
+        total = weight_a + weight_b
+        if total == 0:
+            return (0.0, 0.5 * (centroid_a + centroid_b))
+        return (total, (weight_a * centroid_a + weight_b * centroid_b) / total)
+    return Reducer(name, leaf, merge)
+
+def bounds_reducer(name="bounds"):
+    "(lower, upper) corners of the bounding box of the entry positions."
+    def leaf(records):
+        positions = np.array([position for (n, position, info) in records], dtype=float)
+        return (positions.min(axis=0), positions.max(axis=0))
+    def merge(a, b):
+        return (np.minimum(a[0], b[0]), np.maximum(a[1], b[1]))
+    return Reducer(name, leaf, merge)
+
+def merge_children(tree, node, name):
+    "Aggregate name for an interior node, merged from its children."
+    reducer = tree.reducers[name]
+    value = None
+    for child in node.child_nodes():
+        child_value = child.get_aggregate(tree, name)
+        if value is None:
+            value = child_value
+            if reducer.copy is not None:
+                value = reducer.copy(value)
+        else:
+            value = reducer.merge(value, child_value)
+    return value
+
+def cached_aggregate(node, name):
+    "Aggregate name cached on node, or None if it has not been computed."
+    aggregates = getattr(node, "_aggregates", None)
+    if not aggregates:
+        return None
+    return aggregates.get(name)
+
+def merge_added(tree, aggregates, node):
+    "Merge the aggregates of a node added below an interior node into its cached aggregates."
+    for name in aggregates:
+        aggregates[name] = tree.reducers[name].merge(aggregates[name], node.get_aggregate(tree, name))
+
+def replaces(tree, node, leaf):
+    "Whether combining leaf into the subtree at node may replace names stored there."
+    prefix = leaf.prefix
+    while node is not None and node.level is not None:
+        (remainder, quadrant) = tree.quadrant(prefix, node.level + 1)
+        if remainder != node.prefix:
+            return False
+        node = node.children.get(quadrant)
+    if node is None or node.prefix != prefix:
+        return False
+    return not leaf.get_names().isdisjoint(node.get_names())
+
+def inverse_square(offsets, masses, softening=0.0):
+    """
+    Inverse square field at the origin of offsets from masses at offsets:
+    sum of mass * offset / |offset|**3.  Zero offsets contribute nothing.
+    """
+    squared = (offsets * offsets).sum(axis=1) + softening * softening
+    scale = np.zeros(len(masses))
+    nonzero = squared > 0
+    scale[nonzero] = masses[nonzero] / (squared[nonzero] * np.sqrt(squared[nonzero]))
+    return (offsets * scale[:, None]).sum(axis=0)
+
+def potential(offsets, masses, softening=0.0):
+    "Sum of mass / |offset|, skipping zero offsets."
+    distances = np.sqrt((offsets * offsets).sum(axis=1) + softening * softening)
+    nonzero = distances > 0
+    return (masses[nonzero] / distances[nonzero]).sum()
+
+def ensure_reducers(tree, mass, centroid):
+    "Register the default count and centroid reducers when missing."
+    if mass not in tree.reducers and mass == "count":
+        tree.add_reducer(count_reducer())
+    if centroid not in tree.reducers and centroid == "centroid":
+        tree.add_reducer(centroid_reducer())
+
+def sources(tree, position, theta, mass="count", centroid="centroid"):
+    """
+    (offsets, masses) standing in for all entries when evaluating a field at
+    position: leaf entries exactly, and nodes with side < theta * distance to
+    their centroid as one mass at the centroid.  Leaf entries weigh the
+    mass reducer's value for a single entry.
+    """
+    ensure_reducers(tree, mass, centroid)
+    position = np.asarray(position, dtype=float)
+    mass_reducer = tree.reducers[mass]
+    points = []
+    masses = []
+    stack = []
+    if tree.root is not None:
+        stack.append(tree.root)
+    while stack:
+        node = stack.pop()
+        if node.level is None:
+            for record in node.records():
+                points.append(record[1])
+                masses.append(mass_reducer.leaf([record]))
+            continue
+        (weight, center) = node.get_aggregate(tree, centroid)
+        offset = center - position
+        distance = np.sqrt(offset.dot(offset))
+        if tree.level_side(node.level) < theta * distance:
+            points.append(center)
+            masses.append(node.get_aggregate(tree, mass))
+        else:
+            stack.extend(node.child_nodes())
+    points = np.array(points, dtype=float).reshape((len(points), tree.dimensions))
+    return (points - position, np.array(masses, dtype=float))
+
+def field(tree, position, kernel=inverse_square, theta=0.5, mass="count", centroid="centroid"):
+    "kernel(offsets, masses) over the sources for position (see sources)."
+    (offsets, masses) = sources(tree, position, theta, mass, centroid)
+    return kernel(offsets, masses)
+
+def field_many(tree, positions, kernel=inverse_square, theta=0.5, mass="count", centroid="centroid"):
+    "Array of field values for each row of an (M, dimensions) array."
+    return np.array([field(tree, position, kernel, theta, mass, centroid)
+                     for position in np.asarray(positions, dtype=float)])
@@ -0,0 +1,233 @@
+"""
+Bounded LRU cache of query results, invalidated by Morton prefix.
+
+QueryCache (see GeneralizedQuadtree.enable_query_cache) keeps the results
+of repeated queries between updates:
+
+  adjacent   the nodes adjacency_walk and iter_adjacent visit, keyed by the
+             index of the voxel holding the position
+  box        the names query_box finds, keyed by the box corners
+  names      the names in the quadrant at a level holding a position
+             (quadrant_names), keyed by the level and its prefix
+
+Each entry registers the quadrants, as (level, prefix), its result
+depends on.  Box and names results depend on every name in a quadrant
+(the smallest holding the box, or the queried one), and are dropped when
+a name is added, removed or moved at an index in it: the entries of the
+quadrants holding the index are found with one dictionary lookup per
+level in use.  An adjacency walk result is the list of visited nodes,
+which changes only when an update changes the children of a node it
+expanded, so its entries are registered under the expanded nodes: an
+add drops those under the deepest node holding the new leaf, a remove
+those under the nodes on the path to it, and a change of root drops
+them all.
+
+Results are shared between hits, like the names get_names caches on a
+node, and must not be modified.  The byte limit counts the result
+containers and keys (sys.getsizeof), not the names and nodes they refer
+to, which belong to the tree.
+"""
+
+import collections
+import sys
+import numpy as np
+from . import gqmorton
+from . import gqnodes
+from . import gqquery
+from .gqneighbors import node_key
+
+class QueryCache(object):
+    "LRU cache of the query results of tree, with at most max_entries entries or max_bytes."
+
+    def __init__(self, tree, max_entries=1024, max_bytes=None):
+        assert max_entries is None or max_entries > 0, "bad max_entries " + repr(max_entries)
+        assert max_bytes is None or max_bytes > 0, "bad max_bytes " + repr(max_bytes)
+        self.tree = tree
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.clear()
+
+    def clear(self):
+        "Drop every entry, keeping the counts."
+        # key: (result, nbytes, regions, expanded), least recently used first
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        # (level, prefix): set of the keys of entries depending on the quadrant
+        self.regions = {}
+        # level: number of (level, prefix) keys in regions
+        self.region_levels = {}
+        # (level, prefix): set of the keys of adjacency entries expanding the node
+        self.expanded = {}
+        # keys of the adjacency entries
+        self.adjacent_keys = set()
+
+    def stats(self):
+        "Dictionary of the hit, miss, eviction and invalidation counts and the current size."
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self.entries),
+                "bytes": self.nbytes}
+
+    def get(self, key):
+        "The result for key, or None, counting the hit or miss."
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, result, regions=(), expanded=()):
+        """
+        Keep result for key, depending on the names in the quadrants regions
+        and the children of the nodes expanded, then evict down to the limits.
+        """
+        self.discard(key)
+        nbytes = sys.getsizeof(key) + sys.getsizeof(result)
+        self.entries[key] = (result, nbytes, regions, expanded)
+        self.nbytes += nbytes
+        for region in regions:
+            keys = self.regions.get(region)
+            if keys is None:
+                keys = self.regions[region] = set()
+                self.region_levels[region[0]] = self.region_levels.get(region[0], 0) + 1
+            keys.add(key)
+        for node in expanded:
+            self.expanded.setdefault(node, set()).add(key)
+        if key[0] == "adjacent":
+            self.adjacent_keys.add(key)
+        entries = self.entries
+        while entries and ((self.max_entries is not None and len(entries) > self.max_entries) or
+                           (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            self.discard(next(iter(entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        "Drop the entry for key, if any; return whether there was one."
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        (result, nbytes, regions, expanded) = entry
+        self.nbytes -= nbytes
+        for region in regions:
+            keys = self.regions[region]
+            keys.discard(key)
+            if not keys:
+                del self.regions[region]
+                self.region_levels[region[0]] -= 1
+        for node in expanded:
+            keys = self.expanded[node]
+            keys.discard(key)
+            if not keys:
+                del self.expanded[node]
+        self.adjacent_keys.discard(key)
+        return True
+
+    def invalidate(self, keys):
+        "Drop the entries for keys, counting them as invalidated."
+        for key in list(keys):
+            if self.discard(key):
+                self.invalidations += 1
+
+    def changed(self, index):
+        "Drop the entries depending on the names in a quadrant holding index."
+        tree = self.tree
+        regions = self.regions
+        for (level, count) in self.region_levels.items():
+            if count:
+                keys = regions.get((level, gqmorton.ancestor(index, tree.levels,
+                                                             tree.dimensions, level)))
+                if keys:
+                    self.invalidate(keys)
+
+    def restructured(self, nodes):
+        "Drop the adjacency entries which expanded one of nodes."
+        tree = self.tree
+        expanded = self.expanded
+        for node in nodes:
+            keys = expanded.get(node_key(tree, node))
+            if keys:
+                self.invalidate(keys)
+
+    def added(self, index, old_path, old_root):
+        "Drop the entries a new leaf at index changes; old_path held index before."
+        self.changed(index)
+        if self.tree.root is not old_root:
+            self.invalidate(self.adjacent_keys)
+        elif old_path and old_path[-1].level is not None:
+            # the leaf went below the deepest node holding index; a leaf
+            # already there took the new name without changing the nodes.
+            self.restructured(old_path[-1:])
+
+    def removed(self, index, old_path, old_root):
+        "Drop the entries a removal at index changes; old_path held index before."
+        self.changed(index)
+        if self.tree.root is not old_root:
+            self.invalidate(self.adjacent_keys)
+        else:
+            self.restructured(old_path)
+
+    def adjacent(self, position):
+        "List of the nodes adjacency_walk visits for position."
+        tree = self.tree
+        if tree.root is None:
+            return []
+        (index, ipos) = tree.index_position(position)
+        key = ("adjacent", index)
+        nodes = self.get(key)
+        if nodes is None:
+            if tree.neighbor_index is not None:
+                nodes = list(tree.neighbor_index.iter_adjacent(index))
+            else:
+                nodes = list(gqnodes.iter_adjacent(tree, tree.root, ipos))
+            self.put(key, nodes, expanded=expanded_keys(tree, nodes))
+        return nodes
+
+    def query_box(self, lower, upper):
+        "Set of names with positions in the closed box lower <= position <= upper."
+        tree = self.tree
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        key = ("box", tuple(lower.tolist()), tuple(upper.tolist()))
+        names = self.get(key)
+        if names is None:
+            names = gqquery.query_box(tree, lower, upper)
+            self.put(key, names, [box_region(tree, lower, upper)])
+        return names
+
+    def quadrant_names(self, position, level):
+        "Set of the names in the quadrant at level holding position."
+        tree = self.tree
+        prefix = gqmorton.ancestor(tree.index(position), tree.levels, tree.dimensions, level)
+        key = ("names", level, prefix)
+        names = self.get(key)
+        if names is None:
+            names = tree.names_in_quadrant(prefix, level)
+            self.put(key, names, [(level, prefix)])
+        return names
+
+def expanded_keys(tree, visited):
+    "Keys of the nodes an adjacency walk visiting the nodes visited expanded."
+    visited = set(id(node) for node in visited)
+    keys = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if id(node) not in visited:
+            keys.append(node_key(tree, node))
+            stack.extend(node.child_nodes())
+    return keys
+
+def box_region(tree, lower, upper):
+    "(level, prefix) of the smallest quadrant holding the voxels of the box, clipped to the volume."
+    ((low, high), inner) = gqquery.box_voxel_ranges(tree, lower, upper)
+    top = tree.int_side - 1
+    # the centers of the corner voxels
+    low = (np.clip(low, 0, top) + 0.5) * tree.min_side + tree.origin
+    high = (np.clip(high, 0, top) + 0.5) * tree.min_side + tree.origin
+    (prefix, level) = tree.common_prefix_level(tree.index(low), tree.index(high))
+    return (level, prefix)
@@ -0,0 +1,273 @@
+"""
+Dual tree traversal: recursion on pairs of nodes from two trees (or one tree
+against itself), for all pairs neighbour and interaction queries.
+
+Each tree is first flattened (FlatTree) into arrays of names and positions
+in depth first order, so that every node covers a contiguous range of rows
+and has a tight bounding box of its positions.  DualTraversal.run recurses
+on node pairs, dropping pairs that prune rejects using box to box distance
+bounds, handing pairs that accept approves to accepted whole, and calling
+base_case on pairs of small nodes, where work is done on array slices.
+
+all_nearest, within_pairs and spatial_join are built on it.
+"""
+
+import operator
+from . import gqquery
+import numpy as np
+
+class FlatTree(object):
+    "Names and positions of a tree in depth first order, with row ranges and boxes of nodes."
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.names = []
+        positions = []
+        # id(node): number of the node, indexing starts, stops, lowers and uppers
+        self.numbers = {}
+        # keep nodes alive while their ids are used as keys.
+        self.nodes = []
+        starts = []
+        stops = []
+        if tree.root is not None:
+            self.flatten(tree.root, positions, starts, stops)
+        npoints = len(self.names)
+        self.positions = np.array(positions, dtype=float).reshape((npoints, tree.dimensions))
+        self.starts = np.array(starts, dtype=int)
+        self.stops = np.array(stops, dtype=int)
+        self.lowers = self.reduce_rows(np.minimum)
+        self.uppers = self.reduce_rows(np.maximum)
+
+    def flatten(self, root, positions, starts, stops):
+        "Visit leaves in index order, numbering nodes with their rows on the way back up."
+        names = self.names
+        prefix = operator.attrgetter("prefix")
+        stack = [(root, False)]
+        while stack:
+            (node, done) = stack.pop()
+            if node.level is None:
+                start = len(names)
+                for (name, position) in node.entries():
+                    names.append(name)
+                    positions.append(position)
+            elif done:
+                start = min(starts[self.numbers[id(child)]] for child in node.child_nodes())
+            else:
+                stack.append((node, True))
+                for child in sorted(node.child_nodes(), key=prefix, reverse=True):
+                    stack.append((child, False))
+                continue
+            self.numbers[id(node)] = len(self.nodes)
+            self.nodes.append(node)
+            starts.append(start)
+            stops.append(len(names))
+
+    def reduce_rows(self, ufunc):
+        "ufunc reduced over the rows of every node, one row per node."
+        if not self.nodes:
+            return np.zeros((0, self.tree.dimensions))
+        # reduceat reduces from each index to the next: interleave starts and stops,
+        # with a spare row so that a stop may be the end.
+        padded = np.vstack((self.positions, self.positions[-1:]))
+        bounds = np.empty(2 * len(self.nodes), dtype=int)
+        bounds[0::2] = self.starts
+        bounds[1::2] = self.stops
+        return ufunc.reduceat(padded, bounds, axis=0)[0::2]
+
+    def number(self, node):
+        return self.numbers[id(node)]
+
+    def rows(self, node):
+        "(start, stop) rows of the entries below node."
+        number = self.numbers[id(node)]
+        return (self.starts[number], self.stops[number])
+
+    def box(self, node):
+        "(lower, upper) corners of the box around the entries below node."
+        number = self.numbers[id(node)]
+        return (self.lowers[number], self.uppers[number])
+
+    def count(self, node):
+        number = self.numbers[id(node)]
+        return self.stops[number] - self.starts[number]
+
+
+class DualTraversal(object):
+    """
+    Pairs of nodes from tree1 and tree2 (tree1 against itself when tree2 is
+    None or tree1).  Distances use the metric names of gqquery.
+    """
+
+    def __init__(self, tree1, tree2=None, metric="l2", base_size=32):
+        self.order = gqquery.metric_order(metric)
+        self.flat1 = FlatTree(tree1)
+        if tree2 is None or tree2 is tree1:
+            self.flat2 = self.flat1
+        else:
+            self.flat2 = FlatTree(tree2)
+        self.self_pairs = self.flat2 is self.flat1
+        self.base_size = base_size
+
+    def min_distances(self, numbers1, numbers2):
+        "Lower bounds on the distances between entries of pairs of numbered nodes."
+        (flat1, flat2) = (self.flat1, self.flat2)
+        gaps = np.maximum(flat2.lowers[numbers2] - flat1.uppers[numbers1],
+                          flat1.lowers[numbers1] - flat2.uppers[numbers2])
+        return gqquery.norms(np.maximum(gaps, 0), self.order)
+
+    def min_distance(self, node1, node2):
+        "Lower bound on the distance between entries of node1 and node2."
+        return self.min_distances(self.flat1.number(node1), self.flat2.number(node2))
+
+    def max_distance(self, node1, node2):
+        "Upper bound on the distance between entries of node1 and node2."
+        (lower1, upper1) = self.flat1.box(node1)
+        (lower2, upper2) = self.flat2.box(node2)
+        return gqquery.norms(np.maximum(upper2 - lower1, upper1 - lower2), self.order)
+
+    def distances(self, node1, node2):
+        "(rows1, rows2, distance matrix) between the entries of node1 and node2."
+        (start1, stop1) = self.flat1.rows(node1)
+        (start2, stop2) = self.flat2.rows(node2)
+        offsets = (self.flat1.positions[start1:stop1, None, :]
+                   - self.flat2.positions[None, start2:stop2, :])
+        return (np.arange(start1, stop1), np.arange(start2, stop2),
+                gqquery.norms(offsets, self.order))
+
+    def is_small(self, flat, node):
+        return node.level is None or flat.count(node) <= self.base_size
+
+    def run(self, prune, base_case, accept=None, accepted=None, symmetric=None):
+        """
+        Recurse from the pair of roots.  prune(node1, node2, distance) drops
+        a pair given the lower bound on its distances, accept(node1, node2)
+        hands it to accepted(node1, node2) without recursing, and pairs of
+        small nodes go to base_case(node1, node2).  With symmetric (default
+        for a tree against itself) each unordered pair of distinct subtrees
+        is visited once and a node may be paired with itself; otherwise all
+        ordered pairs are visited.  The larger node of a pair is split,
+        nearer children first.
+        """
+        flat1 = self.flat1
+        flat2 = self.flat2
+        if symmetric is None:
+            symmetric = self.self_pairs
+        root1 = flat1.tree.root
+        root2 = flat2.tree.root
+        if root1 is None or root2 is None:
+            return
+        stack = [(root1, root2, self.min_distance(root1, root2))]
+        while stack:
+            (node1, node2, distance) = stack.pop()
+            if prune(node1, node2, distance):
+                continue
+            if accept is not None and accept(node1, node2):
+                accepted(node1, node2)
+                continue
+            small1 = self.is_small(flat1, node1)
+            small2 = self.is_small(flat2, node2)
+            if small1 and small2:
+                base_case(node1, node2)
+                continue
+            if symmetric and node1 is node2:
+                children = node1.child_nodes()
+                pairs = [(child1, child2) for (i, child1) in enumerate(children)
+                         for child2 in children[i:]]
+            elif small2 or (not small1 and flat1.count(node1) >= flat2.count(node2)):
+                pairs = [(child, node2) for child in node1.child_nodes()]
+            else:
+                pairs = [(node1, child) for child in node2.child_nodes()]
+            bounds = self.min_distances([flat1.number(pair[0]) for pair in pairs],
+                                        [flat2.number(pair[1]) for pair in pairs])
+            for i in np.argsort(bounds)[::-1]:
+                stack.append(pairs[i] + (bounds[i],))
+
+
+def all_nearest(tree1, k=1, tree2=None, metric="l2"):
+    """
+    k nearest entries of tree2 (or of tree1 itself, excluding the entry) to
+    every entry of tree1: dict of name to (names, distances).
+    """
+    dual = DualTraversal(tree1, tree2, metric)
+    flat1 = dual.flat1
+    flat2 = dual.flat2
+    npoints = len(flat1.names)
+    best_distances = np.empty((npoints, k))
+    best_distances.fill(np.inf)
+    best_rows = np.zeros((npoints, k), dtype=int)
+    best_rows.fill(-1)
+    def prune(node1, node2, distance):
+        (start, stop) = flat1.rows(node1)
+        return distance > best_distances[start:stop, k - 1].max()
+    def base_case(node1, node2):
+        (rows1, rows2, distances) = dual.distances(node1, node2)
+        if dual.self_pairs:
+            distances[rows1[:, None] == rows2[None, :]] = np.inf
+        start = rows1[0]
+        stop = rows1[-1] + 1
+        candidates = np.hstack((best_distances[start:stop], distances))
+        candidate_rows = np.hstack((best_rows[start:stop],
+                                    np.repeat(rows2[None, :], len(rows1), axis=0)))
+        keep = np.argsort(candidates, axis=1, kind="mergesort")[:, :k]
+        line = np.arange(len(rows1))[:, None]
+        best_distances[start:stop] = candidates[line, keep]
+        best_rows[start:stop] = candidate_rows[line, keep]
+    dual.run(prune, base_case, symmetric=False)
+    result = {}
+    for (row, name) in enumerate(flat1.names):
+        found = best_rows[row] >= 0
+        result[name] = ([flat2.names[i] for i in best_rows[row][found]],
+                        best_distances[row][found])
+    return result
+
+def within_rows(dual, radius):
+    "(rows1, rows2, distances) arrays of the entry pairs of a DualTraversal within radius."
+    found = [(np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))]
+    def prune(node1, node2, distance):
+        return distance > radius
+    def accept(node1, node2):
+        return dual.max_distance(node1, node2) <= radius
+    def collect(node1, node2, check):
+        (rows1, rows2, distances) = dual.distances(node1, node2)
+        inside = np.ones(distances.shape, dtype=bool)
+        if check:
+            inside = distances <= radius
+        if dual.self_pairs and node1 is node2:
+            inside &= rows1[:, None] < rows2[None, :]
+        (i, j) = np.nonzero(inside)
+        found.append((rows1[i], rows2[j], distances[i, j]))
+    dual.run(prune, lambda node1, node2: collect(node1, node2, True),
+             accept, lambda node1, node2: collect(node1, node2, False))
+    return tuple(np.concatenate(arrays) for arrays in zip(*found))
+
+def within_pairs(tree1, radius, tree2=None, metric="l2"):
+    """
+    List of (name1, name2, distance) for entries of tree1 and tree2 at most
+    radius apart.  Against itself (tree2 None) each pair of distinct entries
+    is listed once.
+    """
+    dual = DualTraversal(tree1, tree2, metric)
+    (rows1, rows2, distances) = within_rows(dual, radius)
+    (names1, names2) = (dual.flat1.names, dual.flat2.names)
+    return zip([names1[i] for i in rows1], [names2[j] for j in rows2], distances.tolist())
+
+def spatial_join(tree1, tree2, radius, metric="l2"):
+    """
+    Entries of tree2 within radius of each entry of tree1: dict of name1 to a
+    list of (name2, distance) by increasing distance, for names with matches.
+    """
+    dual = DualTraversal(tree1, tree2, metric)
+    (rows1, rows2, distances) = within_rows(dual, radius)
+    (names1, names2) = (dual.flat1.names, dual.flat2.names)
+    if not len(rows1):
+        return {}
+    order = np.lexsort((distances, rows1))
+    (rows1, rows2, distances) = (rows1[order], rows2[order], distances[order])
+    # split where the tree1 row changes
+    starts = np.flatnonzero(np.diff(rows1)) + 1
+    result = {}
+    for (row1, matches, matched_distances) in zip(rows1[np.concatenate(([0], starts))],
+                                                  np.split(rows2, starts),
+                                                  np.split(distances, starts)):
+        result[names1[row1]] = zip([names2[j] for j in matches], matched_distances.tolist())
+    return result
@@ -0,0 +1,342 @@
+"""
+Single file columnar storage for quadtrees.
+
+save writes the rows of a tree in index order as arrays: sorted quadtree
+indices, positions, names (as utf-8 bytes with offsets, an int64 column, or
+a pickled list) and the row order of the sorted names, plus the list of
+infos when any row has one: as JSON when the infos are made of dicts with
+str keys, lists, str, numbers, booleans and None, else pickled.  A
+versioned JSON header records the tree parameters and where each array
+starts.
+
+load(path) rebuilds a tree of the saved kind.  load(path, mmap=True) instead
+returns a read only MappedQuadtree whose columns are numpy.memmap arrays:
+like LinearQuadtree it derives interior nodes from index ranges by binary
+search, so queries run without building a node object per leaf, and names
+are found by binary search over the stored name order.
+
+Indices are stored as uint64, so only trees with levels * dimensions <= 64
+can be saved.  Pickled sections (names other than ints or strings, and
+other infos) can run arbitrary code when loaded, so like numpy.load, load
+refuses them unless allow_pickle is set; only load such files from
+trusted sources.
+"""
+
+import json
+import math
+import pickle
+import struct
+from . import gqtree
+from . import gqlinear
+import numpy as np
+
+MAGIC = b"GQTREE\x00\x00"
+VERSION = 1
+# sections start at multiples of ALIGN bytes.
+ALIGN = 16
+
+# sections holding pickles, read only with allow_pickle.
+PICKLED = ("name_pickle", "info_pickle")
+
+def aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def tree_kind(tree):
+    if isinstance(tree, gqlinear.LinearQuadtree):
+        return "linear"
+    if tree.compact:
+        return "compact"
+    return "pointer"
+
+def tree_rows(tree):
+    "(indices, positions, names, infos) of the rows of tree in index order."
+    if isinstance(tree, gqlinear.LinearQuadtree):
+        return (np.asarray(tree.indices, dtype=np.uint64), np.asarray(tree.positions, dtype=float),
+                list(tree.names), list(tree.infos))
+    indices = []
+    positions = []
+    names = []
+    infos = []
+    stack = []
+    if tree.root is not None:
+        stack.append(tree.root)
+    while stack:
+        node = stack.pop()
+        if node.level is None:
+            for (name, position, info) in node.records():
+                if info and "position" in info:
+                    info = dict(info)
+                    del info["position"]
+                indices.append(node.prefix)
+                positions.append(position)
+                names.append(name)
+                infos.append(info or None)
+        else:
+            stack.extend(sorted(node.child_nodes(), key=lambda child: child.prefix, reverse=True))
+    positions = np.array(positions, dtype=float).reshape((len(names), tree.dimensions))
+    return (np.array(indices, dtype=np.uint64), positions, names, infos)
+
+def names_kind(names):
+    "How names are stored: int, str, unicode or pickle."
+    if all(isinstance(name, (int, long)) and not isinstance(name, bool)
+           and -2 ** 63 <= name < 2 ** 63 for name in names):
+        return "int"
+    for (kind, types) in (("str", str), ("unicode", unicode)):
+        if all(isinstance(name, types) for name in names):
+            return kind
+    return "pickle"
+
+def name_columns(names, kind=None):
+    "(names kind, {section: array}) encoding a list of names."
+    if kind is None:
+        kind = names_kind(names)
+    if kind == "int":
+        return (kind, {"names": np.array(names, dtype=np.int64)})
+    if kind in ("str", "unicode"):
+        encoded = [name if kind == "str" else name.encode("utf-8") for name in names]
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return (kind, {"name_offsets": offsets, "name_bytes": data})
+    return (kind, {"name_pickle": pickled(names)})
+
+def json_value(value):
+    "Whether value comes back from JSON equal and of the same types (see from_json)."
+    if value is None or isinstance(value, (bool, int, long)):
+        return True
+    if isinstance(value, float):
+        return not (math.isnan(value) or math.isinf(value))
+    if isinstance(value, str):
+        try:
+            value.decode("utf-8")
+        except UnicodeDecodeError:
+            return False
+        return True
+    if type(value) is list:
+        return all(json_value(item) for item in value)
+    if type(value) is dict:
+        return all(isinstance(key, str) and json_value(key) and json_value(item)
+                   for (key, item) in value.items())
+    return False
+
+def from_json(value):
+    "value decoded by json, with its text as utf-8 str."
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    if isinstance(value, dict):
+        return dict((from_json(key), from_json(item)) for (key, item) in value.items())
+    return value
+
+def info_columns(infos):
+    "{section: array} encoding a list of infos, as JSON if they allow it."
+    if all(json_value(info) for info in infos):
+        return {"info_json": np.frombuffer(json.dumps(infos), dtype=np.uint8)}
+    return {"info_pickle": pickled(infos)}
+
+def pickled(value):
+    return np.frombuffer(pickle.dumps(value, 2), dtype=np.uint8)
+
+def check_index_bits(levels, dimensions):
+    "Raise ValueError unless the indices of a tree with levels and dimensions fit in uint64."
+    if levels * dimensions > 64:
+        raise ValueError("saved indices must fit in uint64: levels * dimensions > 64 for "
+                         + repr((levels, dimensions)))
+
+def save(tree, path):
+    """
+    Write tree to path in the format read by load.  Indices are stored as
+    uint64, so trees with levels * dimensions > 64 raise ValueError.  Names
+    other than ints or strings, and infos which are not JSON values (see
+    json_value), are pickled: loading them needs allow_pickle.
+    """
+    check_index_bits(tree.levels, tree.dimensions)
+    (indices, positions, names, infos) = tree_rows(tree)
+    (kind, sections) = name_columns(names)
+    sections["indices"] = indices
+    sections["positions"] = positions
+    sections["name_order"] = np.array(sorted(range(len(names)), key=names.__getitem__),
+                                      dtype=np.int64)
+    if any(info is not None for info in infos):
+        sections.update(info_columns(infos))
+    write_file(path, tree_kind(tree), tree.origin, tree.sidelength, tree.levels, len(names), kind,
+               sections)
+
+def write_file(path, kind, origin, sidelength, levels, rows, names, sections, block=1 << 20):
+    """
+    Write the header and sections (arrays by section name, possibly memory
+    mapped) of a saved tree, copying at most block elements at a time.
+    """
+    layout = {}
+    offset = 0
+    for (section, array) in sorted(sections.items()):
+        layout[section] = [offset, array.dtype.str, list(array.shape)]
+        offset = aligned(offset + array.nbytes)
+    header = json.dumps({
+        "kind": kind,
+        "origin": [float(x) for x in origin],
+        "sidelength": float(sidelength),
+        "levels": int(levels),
+        "rows": rows,
+        "names": names,
+        "sections": layout,
+    }).encode("utf-8")
+    start = aligned(len(MAGIC) + 8 + len(header))
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<II", VERSION, len(header)))
+        f.write(header)
+        for (section, array) in sorted(sections.items()):
+            f.seek(start + layout[section][0])
+            flat = array.reshape(-1)
+            for first in range(0, len(flat), block):
+                f.write(np.ascontiguousarray(flat[first:first + block]).tobytes())
+        f.truncate(start + offset)
+
+def read_header(f):
+    "(header dict, offset of the first section) from an open saved file."
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("not a saved quadtree " + repr(magic))
+    (version, length) = struct.unpack("<II", f.read(8))
+    if version != VERSION:
+        raise ValueError("unsupported quadtree file version " + repr(version))
+    header = json.loads(f.read(length).decode("utf-8"))
+    return (header, aligned(len(MAGIC) + 8 + length))
+
+def load(path, mmap=False, allow_pickle=False):
+    """
+    Tree saved at path.  With mmap the columns stay on disk as numpy.memmap
+    arrays of a read only MappedQuadtree; otherwise a tree of the saved kind
+    is rebuilt in memory.
+
+    Files with pickled names or infos raise ValueError unless allow_pickle
+    is set.  Unpickling can run arbitrary code: allow it only for files
+    from trusted sources.
+    """
+    with open(path, "rb") as f:
+        (header, start) = read_header(f)
+    pickled_sections = sorted(set(PICKLED) & set(header["sections"]))
+    if pickled_sections and not allow_pickle:
+        raise ValueError("saved tree holds pickled %s; load with allow_pickle=True "
+                         "only if the file is trusted" % ", ".join(pickled_sections))
+    sections = {}
+    for (section, (offset, dtype, shape)) in header["sections"].items():
+        if np.prod(shape) == 0:
+            sections[section] = np.zeros(shape, dtype=dtype)
+        else:
+            sections[section] = np.memmap(path, dtype=dtype, mode="r", offset=start + offset,
+                                          shape=tuple(shape))
+    names = MappedNames(header["names"], sections)
+    infos = [None] * header["rows"]
+    if "info_json" in sections:
+        infos = from_json(json.loads(sections["info_json"].tobytes()))
+    elif "info_pickle" in sections:
+        infos = pickle.loads(sections["info_pickle"].tobytes())
+    (origin, sidelength, levels) = (header["origin"], header["sidelength"], header["levels"])
+    if mmap:
+        return MappedQuadtree(origin, sidelength, levels, sections, names, infos)
+    positions = np.array(sections["positions"])
+    names = list(names)
+    if header["kind"] == "linear":
+        tree = gqlinear.LinearQuadtree(origin, sidelength, levels)
+        tree.set_rows(np.array(sections["indices"]), positions, names, infos)
+        return tree
+    tree = gqtree.GeneralizedQuadtree(origin, sidelength, levels, compact=header["kind"] == "compact")
+    (indices, leaves) = tree.sorted_leaves(positions, names, infos)
+    tree.root = tree.build_from_sorted(indices, leaves)
+    return tree
+
+
+class MappedNames(object):
+    "Read only sequence of the names stored in the sections of a saved file."
+
+    def __init__(self, kind, sections):
+        self.kind = kind
+        if kind == "int":
+            self.values = sections["names"]
+        elif kind == "pickle":
+            self.values = pickle.loads(sections["name_pickle"].tobytes())
+        else:
+            self.offsets = sections["name_offsets"]
+            self.data = sections["name_bytes"]
+
+    def __len__(self):
+        if self.kind in ("int", "pickle"):
+            return len(self.values)
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if self.kind == "int":
+            return int(self.values[row])
+        if self.kind == "pickle":
+            return self.values[row]
+        name = self.data[self.offsets[row]:self.offsets[row + 1]].tobytes()
+        if self.kind == "unicode":
+            return name.decode("utf-8")
+        return name
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class MappedQuadtree(gqlinear.LinearQuadtree):
+    """
+    Read only LinearQuadtree over the memory mapped columns of a saved file.
+    """
+
+    def __init__(self, origin, sidelength, levels, sections, names, infos):
+        gqlinear.LinearQuadtree.__init__(self, origin, sidelength, levels)
+        self.indices = sections["indices"]
+        self.positions = sections["positions"]
+        self.names = names
+        self.infos = infos
+        self.name_order = sections["name_order"]
+        self.name_count = None
+        self.reset_root()
+
+    def row_of(self, name):
+        "Row holding name, by binary search over the sorted names."
+        (names, order) = (self.names, self.name_order)
+        (low, high) = (0, len(order))
+        while low < high:
+            middle = (low + high) // 2
+            if names[int(order[middle])] < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and names[int(order[low])] == name:
+            return int(order[low])
+        raise ValueError("name not in tree " + repr(name))
+
+    def size(self):
+        "Number of distinct names, counted once over the sorted names."
+        if self.name_count is None:
+            (names, count, last) = (self.names, 0, None)
+            for (i, row) in enumerate(self.name_order):
+                name = names[int(row)]
+                if i == 0 or name != last:
+                    count += 1
+                last = name
+            self.name_count = count
+        return self.name_count
+
+    def __contains__(self, name):
+        try:
+            self.row_of(name)
+        except ValueError:
+            return False
+        return True
+
+    def locate(self, name):
+        index = int(self.indices[self.row_of(name)])
+        return (index, self.lookup_range(index, self.levels))
+
+    def read_only(self, *args, **kwargs):
+        raise NotImplementedError("mapped quadtrees are read only; load without mmap to modify")
+
+    add = remove = move = move_many = add_points = read_only
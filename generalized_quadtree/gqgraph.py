@@ -0,0 +1,270 @@
+"""
+Quadtree of graph nodes, for laying out graphs.
+
+GraphQuadTree keeps an undirected adjacency alongside the spatial tree and
+an "endpoints" aggregate on the tree nodes: for each name not yet placed, the
+number and position sum of its placed neighbours below the node.  The sum of
+squared distances from a point q to those neighbours is
+count * |q|**2 - 2 * q . sum + constant, so a candidate quadrant is scored
+against all placed neighbours from one aggregate without visiting them.
+
+graph_penalty scores quadrants for add_at_min_penalty from the aggregates
+of frontier nodes.  place descends the tree using only the summary at the
+root and the occupancy of the candidate quadrants, which is fast enough to
+lay out large graphs (see layout and bench/graph.py).
+"""
+
+import collections
+from . import gqtree
+from . import gqaggregate
+import numpy as np
+
+class GraphQuadTree(gqtree.GeneralizedQuadtree):
+
+    def __init__(self, origin, sidelength, levels, compact=False):
+        gqtree.GeneralizedQuadtree.__init__(self, origin, sidelength, levels, compact)
+        # name: set of neighbouring names
+        self.adjacency = {}
+        # name: position for the names in the tree
+        self.placed = {}
+        self.add_reducer(gqaggregate.count_reducer())
+        self.add_reducer(endpoints_reducer(self))
+
+    @classmethod
+    def from_points(cls, origin, sidelength, levels, positions, names, infos=None,
+                    compact=False, edges=()):
+        "Bulk constructor for placed names, with an iterable of (name1, name2) edges."
+        tree = cls(origin, sidelength, levels, compact)
+        tree.add_edges(edges)
+        (indices, leaves) = tree.sorted_leaves(positions, names, infos)
+        tree.root = tree.build_from_sorted(indices, leaves)
+        for (name, position) in zip(names, positions):
+            tree.placed[name] = np.asarray(position, dtype=float)
+        return tree
+
+    def enable_snapshots(self):
+        raise NotImplementedError("endpoint summaries are updated in place on shared nodes")
+
+    def add_edge(self, name1, name2):
+        "Add an undirected edge, updating cached endpoint summaries."
+        adjacency = self.adjacency
+        neighbours1 = adjacency.setdefault(name1, set())
+        neighbours2 = adjacency.setdefault(name2, set())
+        if name2 in neighbours1 or name1 == name2:
+            return
+        neighbours1.add(name2)
+        neighbours2.add(name1)
+        placed = self.placed
+        if (name1 in placed) == (name2 in placed):
+            return
+        if name2 in placed:
+            (name1, name2) = (name2, name1)
+        # name1 is placed: count it for name2 in the summaries above it.
+        self.count_endpoint(name1, name2)
+
+    def count_endpoint(self, placed_name, name):
+        "Count placed_name for the unplaced name in the cached summaries above it."
+        position = self.placed[placed_name]
+        for node in self.containing_path(self.index(position)):
+            summary = gqaggregate.cached_aggregate(node, "endpoints")
+            if summary is not None:
+                (count, total) = summary.get(name, (0, 0.0))
+                summary[name] = (count + 1, total + position)
+
+    def add_edges(self, edges):
+        for (name1, name2) in edges:
+            self.add_edge(name1, name2)
+
+    def neighbours(self, name):
+        "Set of names adjacent to name."
+        return self.adjacency.get(name, set())
+
+    def add(self, at_position, name, info=None):
+        if name in self.placed:
+            raise ValueError("name already placed " + repr(name))
+        at_position = np.asarray(at_position, dtype=float)
+        self.placed[name] = at_position
+        # summaries count placed neighbours of unplaced names only.
+        placed = self.placed
+        for neighbour in self.neighbours(name):
+            if neighbour in placed and neighbour != name:
+                for node in self.containing_path(self.index(placed[neighbour])):
+                    summary = gqaggregate.cached_aggregate(node, "endpoints")
+                    if summary is not None:
+                        summary.pop(name, None)
+        gqtree.GeneralizedQuadtree.add(self, at_position, name, info)
+
+    def remove(self, name):
+        "Remove a placed name, which is counted again above its placed neighbours."
+        result = gqtree.GeneralizedQuadtree.remove(self, name)
+        del self.placed[name]
+        placed = self.placed
+        for neighbour in self.neighbours(name):
+            if neighbour in placed:
+                self.count_endpoint(neighbour, name)
+        return result
+
+    def move(self, name, at_position):
+        (position, info) = self.remove(name)
+        self.add(at_position, name, info)
+
+    def move_many(self, names, positions, rebuild_fraction=0.2):
+        gqtree.GeneralizedQuadtree.move_many(self, names, positions, rebuild_fraction)
+        for (name, position) in zip(names, np.asarray(positions, dtype=float)):
+            self.placed[name] = position
+
+    def endpoint_summary(self, name):
+        "(count, position sum) of the placed neighbours of an unplaced name."
+        if self.root is None:
+            return (0, 0.0)
+        return self.root.get_aggregate(self, "endpoints").get(name, (0, 0.0))
+
+    def graph_penalty(self, name, attraction=1.0, repulsion=1.0):
+        """
+        vector_penalty_fn for add_at_min_penalty placing name: attraction times
+        the sum of squared distances from the quadrant corner to the placed
+        neighbours in each frontier node, plus repulsion times the names in
+        the node over one plus its distance, both in units of the quadrant side.
+        """
+        dimensions = self.dimensions
+        min_side = self.min_side
+        def penalty_fn(nodes, node_positions, qindices, voxels, corners):
+            nnodes = len(nodes)
+            counts = np.zeros(nnodes)
+            totals = np.zeros((nnodes, dimensions))
+            sizes = np.zeros(nnodes)
+            for (j, node) in enumerate(nodes):
+                (counts[j], totals[j]) = node.get_aggregate(self, "endpoints").get(name, (0, 0.0))
+                sizes[j] = node.get_aggregate(self, "count")
+            step = float(np.abs(voxels[-1] - voxels[0]).max())
+            side = step * min_side
+            # count * |q|**2 - 2 q . total, dropping the constant sum of |u|**2
+            squared = ((corners * corners).sum(axis=1)[:, None] * counts[None, :]
+                       - 2 * corners.dot(totals.T))
+            distances = np.abs(voxels[:, None, :] - node_positions[None, :, :]).max(axis=2) / step
+            return attraction * squared / (side * side) + repulsion * sizes / (1.0 + distances)
+        return penalty_fn
+
+    def quadrant_counts(self, node, level, qindices):
+        "Names below each quadrant in qindices at level + 1, for the subtree node of their parent."
+        counts = [0] * len(qindices)
+        if node is None:
+            return counts
+        if node.level == level:
+            for (quadrant, child) in node.children.items():
+                counts[quadrant] = child.get_aggregate(self, "count")
+        else:
+            quadrant = self.quadrant(node.prefix, level + 1)[1]
+            counts[quadrant] = node.get_aggregate(self, "count")
+        return counts
+
+    def place(self, name, info=None, attraction=1.0, repulsion=4.0):
+        """
+        Add name at a voxel near its placed neighbours, returning the position.
+        The descent picks at each level the quadrant minimizing attraction times
+        the sum of squared distances from its center to the placed neighbours
+        (from the root endpoint summary), in units of the quadrant side, plus
+        repulsion times the ratio of names to voxels in it.  Quadrants with at
+        least as many names as voxels are avoided while any other is left.
+        """
+        if self.root is None:
+            position = self.center
+            self.add(position, name, info)
+            return position
+        (count, total) = self.endpoint_summary(name)
+        levels = self.levels
+        index = 0
+        iposition = np.zeros(self.dimensions, dtype=gqtree.int_position_dtype(levels))
+        node = self.root
+        for level in range(levels):
+            qindices = list(self.quadrant_indices(index, level))
+            voxels = iposition + self.quadrant_offsets(level)
+            corners = voxels * self.min_side + self.origin
+            step = 1 << (levels - level - 1)
+            side = step * self.min_side
+            fullness = np.array(self.quadrant_counts(node, level, qindices), dtype=float)
+            fullness /= float(step ** self.dimensions)
+            penalties = repulsion * fullness
+            # quadrants with a name for every voxel are chosen only if all are.
+            penalties[fullness >= 1] = np.inf
+            if count:
+                offsets = corners + 0.5 * side - total / count
+                penalties += attraction * count * (offsets * offsets).sum(axis=1) / (side * side)
+            best = self.best_quadrant(penalties.tolist(), corners)
+            index = qindices[best]
+            iposition = voxels[best]
+            node = self.subtree_below(node, level, best)
+        position = self.index_corner(index)
+        self.add(position, name, info)
+        return position
+
+    def subtree_below(self, node, level, quadrant):
+        "Node holding the names below quadrant of the parent subtree node at level, or None."
+        if node is None:
+            return None
+        if node.level == level:
+            return node.children.get(quadrant)
+        if self.quadrant(node.prefix, level + 1)[1] == quadrant:
+            return node
+        return None
+
+    def layout(self, names=None, attraction=1.0, repulsion=4.0):
+        """
+        place each name of the graph (or of names) in breadth first order,
+        returning (names in placement order, (N, dimensions) positions).
+        """
+        order = breadth_first_order(self.adjacency, names)
+        positions = [self.place(name, None, attraction, repulsion) for name in order]
+        return (order, np.array(positions, dtype=float).reshape((len(order), self.dimensions)))
+
+
+def endpoints_reducer(tree, name="endpoints"):
+    """
+    Reducer mapping each unplaced name with placed neighbours among the entries
+    to (number of those neighbours, sum of their positions).
+    """
+    def leaf(records):
+        adjacency = tree.adjacency
+        placed = tree.placed
+        result = {}
+        for (entry_name, position, info) in records:
+            position = np.asarray(position, dtype=float)
+            for neighbour in adjacency.get(entry_name, ()):
+                if neighbour not in placed:
+                    (count, total) = result.get(neighbour, (0, 0.0))
+                    result[neighbour] = (count + 1, total + position)
+        return result
+    def merge(a, b):
+        for (neighbour, (count, total)) in b.items():
+            if neighbour in a:
+                (a_count, a_total) = a[neighbour]
+                a[neighbour] = (a_count + count, a_total + total)
+            else:
+                a[neighbour] = (count, total)
+        return a
+    return gqaggregate.Reducer(name, leaf, merge, copy=dict)
+
+def breadth_first_order(adjacency, names=None):
+    """
+    names (default all names in adjacency) in breadth first order, starting
+    each connected component at its first name of highest degree.
+    """
+    if names is None:
+        names = list(adjacency)
+    wanted = set(names)
+    starts = sorted(names, key=lambda name: -len(adjacency.get(name, ())))
+    seen = set()
+    order = []
+    for start in starts:
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = collections.deque([start])
+        while queue:
+            name = queue.popleft()
+            order.append(name)
+            for neighbour in adjacency.get(name, ()):
+                if neighbour in wanted and neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+    return order
@@ -0,0 +1,495 @@
+
+"""
+Linear (pointerless) quadtree storage.
+
+Leaves are kept as a sorted uint64 array of quadtree indices with parallel
+name, position and info columns.  Interior nodes are not stored: they are
+derived on demand from the index range they cover, and lookups use binary
+search (searchsorted) over the index column.  Walks take the levels,
+prefixes and row ranges of all nodes from one vectorized pass over the
+index column (see node_table) and build node views only to pass them on.
+"""
+
+from . import gqtree
+from . import gqnodes
+from . import gqaggregate
+from . import gqneighbors
+import itertools
+import numpy as np
+
+class LinearQuadtree(gqtree.GeneralizedQuadtree):
+
+    def __init__(self, origin, sidelength, levels):
+        gqtree.GeneralizedQuadtree.__init__(self, origin, sidelength, levels)
+        assert self.levels * self.dimensions <= 64, (
+            "linear quadtree indices must fit in uint64 " + repr((levels, self.dimensions)))
+        # one row per (index, name) pair, sorted by index.
+        self.indices = np.zeros(0, dtype=np.uint64)
+        self.positions = np.zeros((0, self.dimensions))
+        self.names = []
+        # extra info for each row (without "position"), or None when empty.
+        self.infos = []
+        # node levels, prefixes and row ranges in walk order (see node_table)
+        self._node_table = None
+
+    @classmethod
+    def from_points(cls, origin, sidelength, levels, positions, names, infos=None):
+        "Bulk constructor, equivalent to add(positions[i], names[i], infos[i]) in order."
+        tree = cls(origin, sidelength, levels)
+        tree.add_points(positions, names, infos)
+        return tree
+
+    def _insert(self, at_position, name, info=None):
+        "add without recording stats, inserting a row; returns the index of the voxel."
+        (pos_index, int_pos) = self.index_position(at_position)
+        info = self.row_info(info)
+        indices = self.indices
+        start = indices.searchsorted(np.uint64(pos_index), side="left")
+        stop = indices.searchsorted(np.uint64(pos_index), side="right")
+        self.index_name(name, pos_index, None)
+        cache = self.query_cache
+        for row in range(start, stop):
+            if self.names[row] == name:
+                # leaf collision with the same name replaces the entry.
+                (positions, infos) = (self.positions, self.infos)
+                if self.persistent:
+                    (positions, infos) = (positions.copy(), list(infos))
+                positions[row] = at_position
+                infos[row] = info
+                self.set_columns(indices, positions, self.names, infos)
+                if cache is not None:
+                    cache.changed(pos_index)
+                return pos_index
+        old_root = self.root
+        (names, infos) = (self.names, self.infos)
+        if self.persistent:
+            (names, infos) = (names[:stop] + [name] + names[stop:],
+                              infos[:stop] + [info] + infos[stop:])
+        else:
+            names.insert(stop, name)
+            infos.insert(stop, info)
+        self.set_columns(np.insert(indices, stop, np.uint64(pos_index)),
+                         np.insert(self.positions, stop, at_position, axis=0), names, infos)
+        self.reset_root()
+        if cache is not None:
+            cache.added(pos_index, [], old_root)
+        return pos_index
+
+    def enable_neighbor_index(self):
+        """
+        Index the neighbours of every node (see gqneighbors).  Nodes are
+        derived again from the rows after each update, so the index is
+        rebuilt then, at a cost growing with the size of the tree.
+        """
+        return gqtree.GeneralizedQuadtree.enable_neighbor_index(self)
+
+    def neighbors(self, node):
+        """
+        neighbors of the node derived from the root with the level and prefix
+        of node, which may be a view from a walk.
+        """
+        key = gqneighbors.node_key(self, node)
+        for derived in self.containing_path(node.prefix):
+            if gqneighbors.node_key(self, derived) == key:
+                return gqtree.GeneralizedQuadtree.neighbors(self, derived)
+        raise ValueError("node not in tree " + repr(key))
+
+    def enable_snapshots(self):
+        """
+        Replace the columns on each update instead of changing them in place,
+        so snapshot can share them.  Updates copy the index and position
+        arrays anyway; this copies the name and info lists too.
+        """
+        self.persistent = True
+
+    def snapshot(self):
+        "Read only view of the tree as it is now, sharing its columns (see gqsnapshot)."
+        if not self.persistent:
+            raise ValueError("snapshot needs enable_snapshots")
+        from . import gqsnapshot
+        return gqsnapshot.LinearSnapshot(self)
+
+    def remove(self, name):
+        "Remove the row of name at the voxel where it was last added, returning (position, info)."
+        (index, leaf) = self.locate(name)
+        row = leaf.start + self.names[leaf.start:leaf.stop].index(name)
+        result = (self.positions[row], self.infos[row])
+        old_root = self.root
+        (names, infos) = (self.names, self.infos)
+        if self.persistent:
+            (names, infos) = (names[:row] + names[row + 1:], infos[:row] + infos[row + 1:])
+        else:
+            del names[row]
+            del infos[row]
+        self.set_columns(np.delete(self.indices, row), np.delete(self.positions, row, axis=0),
+                         names, infos)
+        self.reset_root()
+        self.unindex(name)
+        if self.query_cache is not None:
+            self.query_cache.removed(index, [], old_root)
+        return result
+
+    def move(self, name, at_position):
+        "Relocate name to at_position keeping its info, as remove then add."
+        (position, info) = self.remove(name)
+        self.add(at_position, name, info)
+
+    def move_many(self, names, positions):
+        "move for each name to the matching row of positions, with one merge of the moved rows."
+        keep = np.ones(len(self.names), dtype=bool)
+        infos = []
+        for name in names:
+            (index, leaf) = self.locate(name)
+            row = leaf.start + self.names[leaf.start:leaf.stop].index(name)
+            keep[row] = False
+            infos.append(self.infos[row])
+        rows = np.flatnonzero(keep)
+        self.set_columns(self.indices[rows], self.positions[rows],
+                         [self.names[row] for row in rows], [self.infos[row] for row in rows])
+        self.reset_root()
+        for name in names:
+            self.unindex(name)
+        self.add_points(positions, names, infos)
+
+    def add_points(self, positions, names, infos=None):
+        "Add many points with one vectorized indexing pass and one merge."
+        npoints = len(names)
+        if npoints == 0:
+            return
+        positions = np.asarray(positions, dtype=float)
+        (indices, int_positions) = self.index_positions(positions)
+        for (name, index) in zip(names, indices.tolist()):
+            self.index_name(name, index, None)
+        if infos is None:
+            infos = [None] * npoints
+        all_indices = np.concatenate((self.indices, indices))
+        all_positions = np.concatenate((self.positions, positions))
+        all_names = self.names + list(names)
+        all_infos = self.infos + [self.row_info(info) for info in infos]
+        order = np.argsort(all_indices, kind="mergesort")
+        # drop earlier rows repeating a name at the same index, as in add.
+        keep = []
+        last_for_key = {}
+        for row in order:
+            key = (all_indices[row], all_names[row])
+            if key in last_for_key:
+                keep[last_for_key[key]] = row
+            else:
+                last_for_key[key] = len(keep)
+                keep.append(row)
+        keep = np.array(keep, dtype=int)
+        self.set_columns(all_indices[keep], all_positions[keep], [all_names[row] for row in keep],
+                         [all_infos[row] for row in keep])
+        self.reset_root()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def set_rows(self, indices, positions, names, infos):
+        "Replace all rows with columns already sorted by index."
+        self.set_columns(indices, positions, names, infos)
+        (self.name_index, self.name_copies) = ({}, {})
+        for (name, index) in zip(names, indices.tolist()):
+            self.index_name(name, index, None)
+        self.reset_root()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def set_columns(self, indices, positions, names, infos):
+        """
+        Replace the columns in one dictionary update, so that a snapshot
+        taken from another thread gets all old or all new columns.
+        """
+        self.__dict__.update(indices=indices, positions=positions, names=names, infos=infos)
+
+    def row_info(self, info):
+        "Copy of info for storage in a row, or None if there is nothing to store."
+        if not info:
+            return None
+        assert "position" not in info, "position dict key is reserved " + repr(info)
+        return info.copy()
+
+    def row_data(self, row):
+        "Leaf data dict entry for row, as stored by QtLeafNode."
+        info = self.infos[row]
+        if info is None:
+            info = {}
+        else:
+            info = info.copy()
+        info["position"] = self.positions[row]
+        return info
+
+    def reset_root(self):
+        "Derive the root node for the current rows, dropping what was derived from the old rows."
+        self._node_table = None
+        if len(self.indices) == 0:
+            self.root = None
+        else:
+            self.root = self.range_node(0, len(self.indices))
+        if self.neighbor_index is not None:
+            self.neighbor_index.rebuild()
+
+    def range_node(self, start, stop):
+        "Node covering the non-empty row range [start, stop)."
+        indices = self.indices
+        first = int(indices[start])
+        last = int(indices[stop - 1])
+        if first == last:
+            return LinearLeafNode(self, start, stop, first)
+        (prefix, level) = self.common_prefix_level(first, last)
+        return LinearInteriorNode(self, start, stop, prefix, level)
+
+    def prefix_range(self, prefix, level):
+        "Row range [start, stop) of the leaves below the quadrant at level with prefix."
+        shift = self.dimensions * (self.levels - level)
+        low = np.uint64(prefix)
+        high = np.uint64(prefix | ((1 << shift) - 1))
+        indices = self.indices
+        return (int(indices.searchsorted(low, side="left")),
+                int(indices.searchsorted(high, side="right")))
+
+    def locate(self, name):
+        "(index, leaf) of the voxel holding name, the leaf derived from the current rows."
+        index = gqtree.GeneralizedQuadtree.locate(self, name)[0]
+        return (index, self.lookup_range(index, self.levels))
+
+    def lookup(self, position):
+        "Leaf containing position, or None."
+        pos_index = self.index(position)
+        (start, stop) = self.prefix_range(pos_index, self.levels)
+        if start == stop:
+            return None
+        return LinearLeafNode(self, start, stop, pos_index)
+
+    def lookup_range(self, prefix, level):
+        "Node for the quadrant at level with prefix, or None if it holds no leaves."
+        (start, stop) = self.prefix_range(prefix, level)
+        if start == stop:
+            return None
+        return self.range_node(start, stop)
+
+    def names_in_quadrant(self, prefix, level):
+        "Set of the names in the quadrant at level with prefix, from its row range."
+        (start, stop) = self.prefix_range(prefix, level)
+        return set(self.names[start:stop])
+
+    def get_names(self):
+        return set(self.names)
+
+    def iter_nodes(self, order="post"):
+        "Iterator over the nodes in order post or pre (from node_table), or bfs."
+        if order == "bfs" or self.root is None:
+            return gqtree.GeneralizedQuadtree.iter_nodes(self, order)
+        (levels, prefixes, starts, stops) = self.node_table()
+        if order == "pre":
+            # parents before their children: by the start of the range, shallower first
+            rows = np.lexsort((levels, starts))
+            (levels, prefixes, starts, stops) = (levels[rows], prefixes[rows], starts[rows],
+                                                 stops[rows])
+        elif order != "post":
+            raise ValueError("unknown traversal order " + repr(order))
+        return self.table_nodes(levels, prefixes, starts, stops)
+
+    def node_table(self):
+        """
+        (levels, prefixes, starts, stops) arrays of all nodes, children before
+        their parent, leaves at level self.levels, computed in bulk from the
+        rows and kept until they change.  The interior nodes are the
+        quadrants at the common prefix levels of neighbouring leaves.
+        """
+        table = self._node_table
+        if table is not None:
+            return table
+        indices = self.indices
+        (levels, dimensions) = (self.levels, self.dimensions)
+        leaf_starts = np.concatenate(([0], np.flatnonzero(indices[1:] != indices[:-1]) + 1))
+        leaf_stops = np.append(leaf_starts[1:], len(indices))
+        unique = indices[leaf_starts]
+        clevels = gqtree.common_prefix_levels(unique[:-1], unique[1:], levels, dimensions)
+        shifts = (dimensions * (levels - clevels)).astype(np.uint64)
+        # numpy shifts by the width modulo 64; the quadrant at level 0 covers all indices
+        wide = shifts >= 64
+        shifts[wide] = 0
+        prefixes = (unique[:-1] >> shifts) << shifts
+        prefixes[wide] = 0
+        highs = prefixes | ((np.uint64(1) << shifts) - np.uint64(1))
+        highs[wide] = np.iinfo(np.uint64).max
+        starts = indices.searchsorted(prefixes, side="left")
+        stops = indices.searchsorted(highs, side="right")
+        # a node with more than two children appears once per pair of them
+        first = np.ones(len(clevels), dtype=bool)
+        rows = np.lexsort((starts, clevels))
+        first[rows[1:]] = ((clevels[rows[1:]] != clevels[rows[:-1]]) |
+                           (starts[rows[1:]] != starts[rows[:-1]]))
+        levels = np.concatenate((np.zeros(len(unique), dtype=clevels.dtype) + levels,
+                                 clevels[first]))
+        prefixes = np.concatenate((unique, prefixes[first]))
+        starts = np.concatenate((leaf_starts, starts[first]))
+        stops = np.concatenate((leaf_stops, stops[first]))
+        # children before their parent: by the end of the range, deeper first
+        rows = np.lexsort((-levels, stops))
+        table = self._node_table = (levels[rows], prefixes[rows], starts[rows], stops[rows])
+        return table
+
+    def table_nodes(self, levels, prefixes, starts, stops):
+        "Generate the nodes for rows of node_table arrays."
+        leaf_level = self.levels
+        for (level, prefix, start, stop) in itertools.izip(levels.tolist(), prefixes.tolist(),
+                                                           starts.tolist(), stops.tolist()):
+            if level == leaf_level:
+                yield LinearLeafNode(self, start, stop, prefix)
+            else:
+                yield LinearInteriorNode(self, start, stop, prefix, level)
+
+    def nodes_below(self, node):
+        "Generate the nodes below the interior node, children before their parent."
+        (levels, prefixes, starts, stops) = self.node_table()
+        # the nodes ending inside the range of node, deeper than its ancestors ending with it
+        low = stops.searchsorted(node.start, side="right")
+        high = stops.searchsorted(node.stop, side="left")
+        high += np.count_nonzero(levels[high:stops.searchsorted(node.stop, side="right")] >
+                                 node.level)
+        return self.table_nodes(levels[low:high], prefixes[low:high], starts[low:high],
+                                stops[low:high])
+
+    def iter_leaves(self):
+        "Iterator over the leaves, one per run of equal indices in row order."
+        indices = self.indices
+        if len(indices) == 0:
+            return
+        bounds = self.leaf_bounds()
+        for i in range(len(bounds) - 1):
+            yield LinearLeafNode(self, bounds[i], bounds[i + 1], int(indices[bounds[i]]))
+
+    def leaf_bounds(self):
+        "List of the first row of each leaf, and the number of rows."
+        indices = self.indices
+        return [0] + (np.flatnonzero(indices[1:] != indices[:-1]) + 1).tolist() + [len(indices)]
+
+
+class LinearInteriorNode(object):
+    "Interior node derived from the row range [start, stop) of a LinearQuadtree."
+
+    __slots__ = ("tree", "start", "stop", "prefix", "level", "_children", "_int_position",
+                 "_geometry", "_aggregates")
+
+    data = {}  # "read only constant"
+
+    def __init__(self, tree, start, stop, prefix, level):
+        self.tree = tree
+        self.start = start
+        self.stop = stop
+        self.prefix = prefix
+        self.level = level
+        self._children = None
+        self._int_position = None
+        self._geometry = None
+        self._aggregates = None
+
+    @property
+    def children(self):
+        "Dictionary of quadrant to child node, derived by binary search."
+        children = self._children
+        if children is None:
+            tree = self.tree
+            shift = tree.dimensions * (tree.levels - self.level - 1)
+            bounds = np.array([self.prefix + (quadrant << shift)
+                               for quadrant in range(1, tree.nquadrants)], dtype=np.uint64)
+            rows = tree.indices[self.start:self.stop].searchsorted(bounds) + self.start
+            rows = [self.start] + [int(row) for row in rows] + [self.stop]
+            children = {}
+            for quadrant in range(tree.nquadrants):
+                (start, stop) = (rows[quadrant], rows[quadrant + 1])
+                if start < stop:
+                    children[quadrant] = tree.range_node(start, stop)
+            self._children = children
+        return children
+
+    def get_names(self):
+        return set(self.tree.names[self.start:self.stop])
+
+    def get_aggregate(self, tree, name):
+        "Value of the reducer registered on tree as name over all descendents."
+        aggregates = self._aggregates
+        if aggregates is None:
+            aggregates = self._aggregates = {}
+        if name not in aggregates:
+            aggregates[name] = gqaggregate.merge_children(tree, self, name)
+        return aggregates[name]
+
+    def child_nodes(self):
+        "List of the child nodes."
+        return list(self.children.values())
+
+    def adjacency_walk(self, tree, callback, data, position, iposition):
+        for node in gqnodes.iter_adjacent(tree, self, iposition):
+            callback(position, node, tree, data)
+
+    def walk(self, tree, callback, data):
+        "walk reverse breadth first passing (node, tree, data) to callback."
+        for node in self.tree.nodes_below(self):
+            callback(node, tree, data)
+        callback(self, tree, data)
+
+    def list_dump(self, tree):
+        children_dumped = []
+        for (quadrant, child) in sorted(self.children.items()):
+            children_dumped.append((tree.quad_string(quadrant), child.list_dump(tree)))
+        return [
+            "node %s LV%s" % (tree.qs(self.prefix), self.level),
+            self.data,
+            children_dumped]
+
+
+class LinearLeafNode(object):
+    "Leaf derived from the rows [start, stop) sharing one index in a LinearQuadtree."
+
+    __slots__ = ("tree", "start", "stop", "prefix")
+
+    children = {}  # "read only constant"
+    level = None  # "read only constant"
+
+    def __init__(self, tree, start, stop, prefix):
+        self.tree = tree
+        self.start = start
+        self.stop = stop
+        self.prefix = prefix
+
+    @property
+    def data(self):
+        tree = self.tree
+        return dict((tree.names[row], tree.row_data(row))
+                    for row in range(self.start, self.stop))
+
+    def get_names(self):
+        return set(self.tree.names[self.start:self.stop])
+
+    def get_aggregate(self, tree, name):
+        return tree.reducers[name].leaf(self.records())
+
+    def child_nodes(self):
+        return []
+
+    def entries(self):
+        "List of (name, position) for the names in the leaf."
+        tree = self.tree
+        return [(tree.names[row], tree.positions[row]) for row in range(self.start, self.stop)]
+
+    def records(self):
+        "List of (name, position, info) for the names in the leaf."
+        tree = self.tree
+        return [(tree.names[row], tree.positions[row], tree.infos[row])
+                for row in range(self.start, self.stop)]
+
+    def adjacency_walk(self, tree, callback, data, position, iposition):
+        # always visit any leaf that is reached.
+        callback(position, self, tree, data)
+
+    def walk(self, tree, callback, data):
+        "walk reverse breadth first passing (node, tree, data) to callback."
+        callback(self, tree, data)
+
+    def list_dump(self, tree):
+        data = self.data
+        for name in data:
+            data[name]["position"] = list(data[name]["position"])
+        return ("Leaf " + tree.qs(self.prefix), data)
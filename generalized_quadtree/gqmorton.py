@@ -0,0 +1,252 @@
+"""
+Arithmetic on quadtree (Morton) indices without decoding them to int positions.
+
+Coordinate d of an index occupies bits d, d + D, d + 2D, ... (D being the
+number of dimensions).  Masked to those bits it is a dilated integer, which
+keeps the order of the coordinate and can be incremented (with the bits in
+between filled with ones to carry across them) or decremented (borrowing
+across cleared bits) directly.  The *_array functions take arrays of
+indices of dtype uint64 or object (Python ints), as from
+gqtree.index_dtype.  The byte dilation tables here are shared with the
+encoders in gqtree.
+"""
+
+import itertools
+import sys
+import numpy as np
+
+# Byte-at-a-time bit dilation tables for the Morton encoders, keyed by dimensions.
+_dilation_tables = {}
+
+def dilation_tables(dimensions):
+    """
+    Tables spreading the 8 bits of a byte `dimensions` positions apart.
+    Returns (dilate, compact, array_dilate): dilate[byte] is the spread value,
+    compact maps spread values back to bytes, and array_dilate holds the
+    spread values that fit in uint64 (a prefix, since dilate is increasing).
+    """
+    result = _dilation_tables.get(dimensions)
+    if result is None:
+        dilate = []
+        for byte in range(256):
+            spread = 0
+            for bit in range(8):
+                spread |= ((byte >> bit) & 1) << (bit * dimensions)
+            dilate.append(spread)
+        compact = dict((spread, byte) for (byte, spread) in enumerate(dilate))
+        array_dilate = np.array([spread for spread in dilate if spread < (1 << 64)],
+                                dtype=np.uint64)
+        result = (dilate, compact, array_dilate)
+        _dilation_tables[dimensions] = result
+    return result
+
+# (levels, dimensions): (masks, units by level, compact, byte mask)
+_tables = {}
+
+def tables(levels, dimensions):
+    """
+    (masks, units, compact, byte_mask) for indices of levels and dimensions:
+    masks and units[level] as from dimension_masks and level_units, and
+    compact and byte_mask from dilation_tables, mapping the 8 bits of a
+    byte spread dimensions apart (within byte_mask) back to the byte.
+    """
+    result = _tables.get((levels, dimensions))
+    if result is None:
+        masks = dimension_masks(levels, dimensions)
+        units = [level_units(levels, dimensions, level) for level in range(levels + 1)]
+        (dilate, compact) = dilation_tables(dimensions)[:2]
+        result = (masks, units, compact, dilate[0xff])
+        _tables[(levels, dimensions)] = result
+    return result
+
+def dimension_masks(levels, dimensions):
+    "Mask of the index bits of each coordinate."
+    ones = 0
+    for level in range(levels):
+        ones |= 1 << (level * dimensions)
+    return [ones << d for d in range(dimensions)]
+
+def level_units(levels, dimensions, level):
+    "Index step of one quadrant at level along each coordinate."
+    shift = dimensions * (levels - level)
+    return [1 << (shift + d) for d in range(dimensions)]
+
+def ancestor(index, levels, dimensions, level):
+    "Prefix of the quadrant at level containing index."
+    shift = dimensions * (levels - level)
+    return (index >> shift) << shift
+
+def parent(prefix, levels, dimensions, level):
+    "Prefix of the quadrant containing the one at level with prefix."
+    assert level > 0, "no parent above level 0"
+    return ancestor(prefix, levels, dimensions, level - 1)
+
+def children(prefix, levels, dimensions, level):
+    "Sequence of the prefixes of the quadrants at level + 1 in the one at level with prefix."
+    shift = dimensions * (levels - (level + 1))
+    assert shift >= 0, "no quadrants below leaf level " + repr((levels, level))
+    # Low order bits should be zeros
+    assert prefix & ((1 << (shift + dimensions)) - 1) == 0, (
+        "bad prefix " + repr((prefix, level, shift))
+    )
+    step = 1 << shift
+    stop = prefix + (step << dimensions)
+    if stop > sys.maxint:
+        # xrange takes C longs only
+        return range(prefix, stop, step)
+    return xrange(prefix, stop, step)
+
+def coordinates(index, levels, dimensions, level=None):
+    """
+    List of the int coordinates of the corner of the quadrant at level
+    (default levels) containing index, in voxels.
+    """
+    if level is None:
+        level = levels
+    (compact, byte_mask) = tables(levels, dimensions)[2:]
+    shift = levels - level
+    index >>= dimensions * shift
+    stride = 8 * dimensions
+    result = []
+    for dimension in range(dimensions):
+        bits = index >> dimension
+        coordinate = 0
+        place = shift
+        while bits:
+            coordinate |= compact[bits & byte_mask] << place
+            bits >>= stride
+            place += 8
+        result.append(coordinate)
+    return result
+
+def step(index, dimension, delta, levels, dimensions, level):
+    """
+    Prefix of the quadrant at level delta (1 or -1) quadrants along
+    dimension from the one containing index, or None outside the volume.
+    """
+    offsets = [0] * dimensions
+    offsets[dimension] = delta
+    return neighbor(index, offsets, levels, dimensions, level)
+
+def neighbor(index, offsets, levels, dimensions, level):
+    """
+    Prefix of the quadrant at level offset by offsets (each -1, 0 or 1)
+    from the one containing index, or None outside the volume.
+    """
+    (masks, units) = tables(levels, dimensions)[:2]
+    prefix = ancestor(index, levels, dimensions, level)
+    result = prefix
+    for (mask, unit, offset) in zip(masks, units[level], offsets):
+        if offset:
+            x = prefix & mask
+            if offset > 0:
+                moved = ((x | ~mask) + unit) & mask
+                if moved <= x:
+                    return None
+            else:
+                moved = (x - unit) & mask
+                if moved >= x:
+                    return None
+            result += moved - x
+    return result
+
+def adjacent_prefixes(prefix1, prefix2, masks, units):
+    """
+    Whether the quadrants with prefixes at one level (units from level_units)
+    are equal or share a face, edge or vertex.
+    """
+    for (mask, unit) in zip(masks, units):
+        x1 = prefix1 & mask
+        x2 = prefix2 & mask
+        if x1 < x2:
+            (x1, x2) = (x2, x1)
+        if x1 != x2 and x1 != ((x2 | ~mask) + unit) & mask:
+            return False
+    return True
+
+def adjacent(index1, index2, levels, dimensions, level):
+    "Whether the quadrants at level containing the indices are equal or adjacent."
+    (masks, units) = tables(levels, dimensions)[:2]
+    shift = dimensions * (levels - level)
+    return adjacent_prefixes((index1 >> shift) << shift, (index2 >> shift) << shift,
+                             masks, units[level])
+
+def adjacent_quadrants(prefix, masks, units):
+    """
+    Prefixes of the quadrants inside the volume sharing a face, edge or
+    vertex with the quadrant at prefix, at the level of units.
+    """
+    choices = []
+    for (mask, unit) in zip(masks, units):
+        x = prefix & mask
+        options = [x]
+        up = ((x | ~mask) + unit) & mask
+        if up > x:
+            options.append(up)
+        down = (x - unit) & mask
+        if down < x:
+            options.append(down)
+        choices.append(options)
+    # the first combination is prefix itself
+    return [sum(combination) for combination in itertools.product(*choices)][1:]
+
+def _constants(indices, values):
+    "values as scalars of the dtype of indices, so uint64 arithmetic stays uint64."
+    if indices.dtype == object:
+        return values
+    return [indices.dtype.type(value) for value in values]
+
+def ancestor_array(indices, levels, dimensions, level):
+    "Vectorized ancestor."
+    indices = np.asarray(indices)
+    shift = dimensions * (levels - level)
+    if shift >= 64 and indices.dtype != object:
+        # numpy shifts by the width modulo 64
+        return np.zeros_like(indices)
+    (shift,) = _constants(indices, [shift])
+    return (indices >> shift) << shift
+
+def neighbor_array(indices, offsets, levels, dimensions, level):
+    """
+    Vectorized neighbor: (prefixes, inside), the prefixes meaningless where
+    inside is False (outside the volume).
+    """
+    prefixes = ancestor_array(indices, levels, dimensions, level)
+    if level == 0:
+        # the volume has no neighbours; its units may not fit in uint64
+        return (prefixes, np.zeros(len(prefixes), dtype=bool) | (not any(offsets)))
+    (masks, units) = tables(levels, dimensions)[:2]
+    masks = _constants(prefixes, masks)
+    units = _constants(prefixes, units[level])
+    result = prefixes.copy()
+    inside = np.ones(len(prefixes), dtype=bool)
+    for (mask, unit, offset) in zip(masks, units, offsets):
+        if offset:
+            x = prefixes & mask
+            if offset > 0:
+                moved = ((x | ~mask) + unit) & mask
+                inside &= moved > x
+            else:
+                moved = (x - unit) & mask
+                inside &= moved < x
+            result = (result & ~mask) | moved
+    return (result, inside)
+
+def adjacent_array(indices1, indices2, levels, dimensions, level):
+    "Vectorized adjacent."
+    prefixes1 = ancestor_array(indices1, levels, dimensions, level)
+    prefixes2 = ancestor_array(indices2, levels, dimensions, level)
+    if level == 0:
+        # every index is in the volume; its units may not fit in uint64
+        return np.ones(len(prefixes1), dtype=bool)
+    (masks, units) = tables(levels, dimensions)[:2]
+    masks = _constants(prefixes1, masks)
+    units = _constants(prefixes1, units[level])
+    result = np.ones(len(prefixes1), dtype=bool)
+    for (mask, unit) in zip(masks, units):
+        x1 = prefixes1 & mask
+        x2 = prefixes2 & mask
+        high = np.maximum(x1, x2)
+        low = np.minimum(x1, x2)
+        result &= (high == low) | (high == (((low | ~mask) + unit) & mask))
+    return result
@@ -0,0 +1,274 @@
+"""
+Neighbours of quadtree nodes, searched or kept in an index.
+
+The neighbours of a node are the nodes at the same or a coarser level,
+other than its ancestors, whose quadrant is adjacent (shares a face, edge
+or vertex) to the quadrant at their level containing the node.  These are
+the nodes besides its ancestors that adjacency_walk expands (or visits,
+for leaves) at a position in the node.  Leaves count as level tree.levels
+and nodes are keyed by (level, prefix).  Adjacency is tested on the indices
+with gqmorton, without decoding them.
+
+NeighborIndex keeps the neighbours of every node of a tree (see
+GeneralizedQuadtree.enable_neighbor_index), updated as nodes are added by
+add and removed by remove, for neighbours(node) lookups and for adjacency
+walks that test expansion by set membership.
+"""
+
+from . import gqnodes
+from . import gqmorton
+
+def node_level(tree, node):
+    "Level of node, tree.levels for leaves."
+    level = node.level
+    if level is None:
+        return tree.levels
+    return level
+
+def node_key(tree, node):
+    "(level, prefix) of node."
+    return (node_level(tree, node), node.prefix)
+
+class Adjacency(object):
+    "Morton masks and per level units for adjacency tests on the indices of tree."
+
+    def __init__(self, tree):
+        self.tree = tree
+        (self.masks, self.units) = gqmorton.tables(tree.levels, tree.dimensions)[:2]
+
+    def adjacent(self, prefix, index, level):
+        "Whether the quadrant with prefix at level is adjacent to (or holds) index."
+        tree = self.tree
+        return gqmorton.adjacent_prefixes(
+            prefix, gqmorton.ancestor(index, tree.levels, tree.dimensions, level),
+            self.masks, self.units[level])
+
+    def search(self, path, node):
+        "List of the neighbours of node, whose ancestors from the root are path."
+        tree = self.tree
+        level = node_level(tree, node)
+        prefix = node.prefix
+        skip = set(id(ancestor) for ancestor in path)
+        skip.add(id(node))
+        found = []
+        stack = []
+        for ancestor in path:
+            stack.extend(ancestor.child_nodes())
+        while stack:
+            candidate = stack.pop()
+            candidate_level = node_level(tree, candidate)
+            # deeper nodes, and those below nodes not adjacent, cannot be neighbours.
+            if (id(candidate) in skip or candidate_level > level
+                    or not self.adjacent(candidate.prefix, prefix, candidate_level)):
+                continue
+            found.append(candidate)
+            stack.extend(candidate.child_nodes())
+        return found
+
+def ancestors(tree, node):
+    "List of the ancestors of node from the root."
+    path = tree.containing_path(node.prefix)
+    for (i, ancestor) in enumerate(path):
+        if ancestor is node:
+            return path[:i]
+    raise ValueError("node not in tree " + repr(node_key(tree, node)))
+
+def neighbors(tree, node):
+    "List of the neighbours of node by (level, prefix), searched from its ancestors."
+    found = Adjacency(tree).search(ancestors(tree, node), node)
+    found.sort(key=lambda other: node_key(tree, other))
+    return found
+
+
+class NeighborIndex(object):
+    """
+    Neighbours of every node of tree, kept current by add and remove.
+
+    The neighbours of a node are those of its parent and the nodes at the
+    levels from the parent's down to its own in the quadrants adjacent to
+    the one holding it, looked up by key.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.adjacency = Adjacency(tree)
+        self.rebuild()
+
+    def rebuild(self):
+        "Index every node of the tree."
+        tree = self.tree
+        # key: node
+        self.nodes = {}
+        # key: set of the keys of its neighbours
+        self.neighbors = {}
+        # key: set of the keys of the nodes having it as a neighbour
+        self.listed_by = {}
+        # level: number of nodes at level
+        self.level_counts = {}
+        if tree.root is None:
+            return
+        parents = {}
+        for node in gqnodes.iter_pre(tree.root):
+            key = node_key(tree, node)
+            self.nodes[key] = node
+            self.listed_by[key] = set()
+            self.level_counts[key[0]] = self.level_counts.get(key[0], 0) + 1
+            for child in node.child_nodes():
+                parents[id(child)] = key
+        # parents come before their children
+        for node in gqnodes.iter_pre(tree.root):
+            key = node_key(tree, node)
+            self.neighbors[key] = self.lookup(parents.get(id(node)), key)
+        listed_by = self.listed_by
+        for (key, found) in self.neighbors.items():
+            for other in found:
+                listed_by[other].add(key)
+
+    def lookup(self, parent, key):
+        "Set of the keys of the neighbours of the node with key and parent key."
+        if parent is None:
+            return set()
+        tree = self.tree
+        (level, prefix) = key
+        found = set(self.neighbors[parent])
+        nodes = self.nodes
+        counts = self.level_counts
+        adjacency = self.adjacency
+        for other_level in range(parent[0] + 1, level + 1):
+            if not counts.get(other_level):
+                continue
+            for other_prefix in gqmorton.adjacent_quadrants(
+                    gqmorton.ancestor(prefix, tree.levels, tree.dimensions, other_level),
+                    adjacency.masks, adjacency.units[other_level]):
+                other = (other_level, other_prefix)
+                if other in nodes:
+                    found.add(other)
+        return found
+
+    def below(self, level, prefix):
+        "The top node in the quadrant with prefix at level, or None."
+        tree = self.tree
+        nodes = self.nodes
+        node = nodes.get((level, prefix))
+        if node is not None:
+            return node
+        # otherwise it is the child towards prefix of the deepest node above
+        counts = self.level_counts
+        for above in range(level - 1, -1, -1):
+            if not counts.get(above):
+                continue
+            node = nodes.get((above, gqmorton.ancestor(prefix, tree.levels, tree.dimensions, above)))
+            if node is not None:
+                child = node.children.get(tree.quadrant(prefix, above + 1)[1])
+                if child is not None and gqmorton.ancestor(
+                        child.prefix, tree.levels, tree.dimensions, level) == prefix:
+                    return child
+                return None
+        return None
+
+    def neighbors_of(self, node):
+        "List of the neighbours of node by (level, prefix)."
+        key = node_key(self.tree, node)
+        if self.nodes.get(key) is not node:
+            raise ValueError("node not in tree " + repr(key))
+        nodes = self.nodes
+        return [nodes[other] for other in sorted(self.neighbors[key])]
+
+    def adjacent(self, index1, index2, level):
+        """
+        Whether the quadrants at level holding index1 and index2 are equal or
+        adjacent, or None unless both are nodes of the tree.
+        """
+        tree = self.tree
+        key1 = (level, gqmorton.ancestor(index1, tree.levels, tree.dimensions, level))
+        key2 = (level, gqmorton.ancestor(index2, tree.levels, tree.dimensions, level))
+        if key1 not in self.nodes or key2 not in self.nodes:
+            return None
+        return key1 == key2 or key2 in self.neighbors[key1]
+
+    def added(self, index):
+        "Index the nodes added on the path to index."
+        tree = self.tree
+        parent = None
+        for node in tree.containing_path(index):
+            key = node_key(tree, node)
+            if self.nodes.get(key) is not node:
+                self.register(parent, node)
+            parent = key
+
+    def removed(self, path, index):
+        "Drop the nodes of path, the old path to index, no longer in the tree."
+        remaining = set(id(node) for node in self.tree.containing_path(index))
+        for node in path:
+            if id(node) not in remaining:
+                self.unregister(node_key(self.tree, node))
+
+    def register(self, parent, node):
+        "Index a new node below the node with key parent, adding it to the nodes it neighbours."
+        tree = self.tree
+        key = node_key(tree, node)
+        if key in self.nodes:
+            self.unregister(key)
+        (level, prefix) = key
+        self.nodes[key] = node
+        self.level_counts[level] = self.level_counts.get(level, 0) + 1
+        found = self.neighbors[key] = self.lookup(parent, key)
+        listed = self.listed_by[key] = set()
+        for other in found:
+            self.listed_by[other].add(key)
+        # the nodes at the same or a finer level neighbouring node are the
+        # subtrees in the quadrants adjacent to it at its level.
+        adjacency = self.adjacency
+        for other_prefix in gqmorton.adjacent_quadrants(prefix, adjacency.masks,
+                                                        adjacency.units[level]):
+            top = self.below(level, other_prefix)
+            if top is None:
+                continue
+            for other in gqnodes.iter_pre(top):
+                other_key = node_key(tree, other)
+                self.neighbors[other_key].add(key)
+                listed.add(other_key)
+
+    def unregister(self, key):
+        "Drop the node with key from the index."
+        del self.nodes[key]
+        self.level_counts[key[0]] -= 1
+        for other in self.neighbors.pop(key):
+            self.listed_by[other].discard(key)
+        for other in self.listed_by.pop(key):
+            self.neighbors[other].discard(key)
+
+    def iter_adjacent(self, index):
+        """
+        Generate the nodes adjacency_walk visits for a position with index:
+        nodes at or above the deepest node holding it are expanded when they
+        are its ancestors or neighbours, deeper nodes when adjacent.
+        """
+        tree = self.tree
+        path = tree.containing_path(index)
+        limit = -1
+        known = set()
+        if path:
+            deepest = path[-1]
+            limit = node_level(tree, deepest)
+            known.update(id(node) for node in path)
+            nodes = self.nodes
+            known.update(id(nodes[key]) for key in self.neighbors[node_key(tree, deepest)])
+        adjacent = self.adjacency.adjacent
+        stack = [tree.root]
+        while stack:
+            node = stack.pop()
+            level = node.level
+            if level is None:
+                yield node
+                continue
+            if level <= limit:
+                expand = id(node) in known
+            else:
+                expand = adjacent(node.prefix, index, level)
+            if expand:
+                children = node.child_nodes()
+                children.reverse()
+                stack.extend(children)
+            else:
+                yield node
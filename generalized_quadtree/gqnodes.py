@@ -1,11 +1,121 @@
 
 #from . import gqtree
+from . import gqaggregate
+import collections
 import numpy as np
 
+def names_below(node):
+    """
+    Set of the names below node, gathered from its leaves (or from names
+    cached on nodes below) without caching any new sets.
+    """
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        cached = getattr(node, "_names", None)
+        if cached is not None:
+            names.update(cached)
+        elif node.level is None:
+            names.update(name for (name, position) in node.entries())
+        else:
+            stack.extend(node.child_nodes())
+    return names
+
+def iter_post(root):
+    "Generate the nodes at and below root, children before their parent."
+    if root.level is None:
+        yield root
+        return
+    # open interior nodes with iterators over their remaining children
+    stack = [(root, iter(root.child_nodes()))]
+    while stack:
+        (node, children) = stack[-1]
+        for child in children:
+            if child.level is None:
+                yield child
+            else:
+                stack.append((child, iter(child.child_nodes())))
+                break
+        else:
+            stack.pop()
+            yield node
+
+def iter_pre(root):
+    "Generate the nodes at and below root, parents before their children."
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.level is not None:
+            children = node.child_nodes()
+            children.reverse()
+            stack.extend(children)
+
+def iter_bfs(root):
+    "Generate the nodes at and below root level by level."
+    queue = collections.deque([root])
+    while queue:
+        node = queue.popleft()
+        yield node
+        if node.level is not None:
+            queue.extend(node.child_nodes())
+
+# node generators by traversal order name
+ORDERS = {"post": iter_post, "pre": iter_pre, "bfs": iter_bfs}
+
+def iter_nodes(root, order="post"):
+    """
+    Iterator over the nodes at and below root (none if it is None) in order
+    post, pre or bfs, children in child_nodes order.
+    """
+    if order not in ORDERS:
+        raise ValueError("unknown traversal order " + repr(order))
+    if root is None:
+        return iter(())
+    return ORDERS[order](root)
+
+def iter_leaves(root):
+    "Generate the leaves at and below root, in the order of iter_nodes."
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.level is None:
+            yield node
+        else:
+            children = node.child_nodes()
+            children.reverse()
+            stack.extend(children)
+
+def iter_adjacent(tree, root, iposition):
+    """
+    Generate the nodes adjacency_walk visits for int position iposition:
+    every leaf reached, and the nodes not expanded because their quadrant
+    is not adjacent to the quadrant containing iposition at their level.
+    """
+    levels = tree.levels
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        level = node.level
+        if level is None:
+            yield node
+            continue
+        shift = levels - level
+        offset = (tree.node_int_position(node) >> shift) - (iposition >> shift)
+        if np.abs(offset).max() <= 1:
+            children = node.child_nodes()
+            children.reverse()
+            stack.extend(children)
+        else:
+            yield node
+
 class QtInteriorNode:
 
     _int_position = None
+    _geometry = None   # see GeneralizedQuadtree.node_geometry
     _names = None   # names of all descendents
+    _aggregates = None   # name: value of cached reducer aggregates
 
     def __init__(self, prefix, level):
         self.prefix = prefix
@@ -14,43 +124,42 @@ class QtInteriorNode:
         self.children = {}
 
     def get_names(self):
+        "Set of the names below, cached on this node only and kept current after."
         names = self._names
         if names is None:
-            names = set()
-            for child in self.children.values():
-                names.update(child.get_names())
-            self._names = names
+            names = self._names = names_below(self)
         return names
 
+    def get_aggregate(self, tree, name):
+        "Value of the reducer registered on tree as name over all descendents."
+        aggregates = self._aggregates
+        if aggregates is None:
+            aggregates = self._aggregates = {}
+        if name not in aggregates:
+            aggregates[name] = gqaggregate.merge_children(tree, self, name)
+        return aggregates[name]
+
+    def copy(self):
+        "Node with the same children, for path copying; cached names and aggregates are dropped."
+        result = QtInteriorNode(self.prefix, self.level)
+        result.data = self.data
+        result.children = self.children.copy()
+        result._int_position = self._int_position
+        result._geometry = self._geometry
+        return result
+
+    def child_nodes(self):
+        "List of the child nodes."
+        return list(self.children.values())
+
     def adjacency_walk(self, tree, callback, data, position, iposition):
-        level = self.level
-        # XXXX could use tree.adjacent(...)?
-        my_ipos = self._int_position
-        if my_ipos is None:  
-            my_ipos = tree.index_to_index_position(self.prefix)
-            self._int_position = my_ipos
-        shift = tree.levels - level 
-        level_offset = (my_ipos >> shift) - (iposition >> shift)
-        max_offset = np.max(np.abs(level_offset))
-        #ind = "    " * level
-        #print ind, self._int_position, level, shift, "max", max_offset
-        if max_offset <= 1:
-            #print ind, "expand", level_offset
-            # recursively expand node
-            for node in self.children.values():
-                node.adjacency_walk(tree, callback, data, position, iposition)
-        else:
-            #print ind, "callback", level_offset
-            # visit node without expanding (not adjacent at level)
-            callback(position, self, tree, data)
+        for node in iter_adjacent(tree, self, iposition):
+            callback(position, node, tree, data)
 
     def walk(self, tree, callback, data):
         "walk reverse breadth first passing (node, tree, data) to callback."
-        children = self.children
-        for quadrant in children:
-            child = children[quadrant]
-            child.walk(tree, callback, data)
-        callback(self, tree, data)
+        for node in iter_post(self):
+            callback(node, tree, data)
 
     def add_new_child(self, node, tree):
         "Add a child in empty quadrant."
@@ -65,6 +174,8 @@ class QtInteriorNode:
         names = self._names
         if names is not None:
             names.update(node.get_names())
+        if self._aggregates:
+            gqaggregate.merge_added(tree, self._aggregates, node)
 
     def add_leaf(self, leaf, tree):
         level = self.level
@@ -74,14 +185,40 @@ class QtInteriorNode:
             repr(tree.qs(self.prefix), tree.qs(remainder), tree.qs(nprefix), level))
         children = self.children
         old_child = children.get(quadrant)
+        self.update_aggregates(tree, old_child, leaf)
         new_child = tree.combine(old_child, leaf)
-        if isinstance(new_child, QtInteriorNode):
+        if new_child.level is not None:
             assert new_child.level > level
         names = self._names
         if names is not None:
             names.update(leaf.get_names())
         children[quadrant] = new_child
 
+    def update_aggregates(self, tree, old_child, leaf):
+        "Merge leaf into cached aggregates, or drop them if leaf may replace names."
+        if not self._aggregates:
+            return
+        if gqaggregate.replaces(tree, old_child, leaf):
+            self._aggregates = None
+        else:
+            gqaggregate.merge_added(tree, self._aggregates, leaf)
+
+    def set_child(self, quadrant, node):
+        "Replace the child in quadrant, or empty it when node is None."
+        if node is None:
+            del self.children[quadrant]
+        else:
+            self.children[quadrant] = node
+
+    def removed(self, name, copied=False):
+        """
+        Repair cached names and drop cached aggregates after name was removed
+        below; copied tells whether another copy of name is still below.
+        """
+        self._aggregates = None
+        if self._names is not None and not copied:
+            self._names.discard(name)
+
     def list_dump(self, tree):
         children_dumped = []
         for (quadrant, child) in sorted(self.children.items()):
@@ -105,6 +242,26 @@ class QtLeafNode:
     def get_names(self):
         return set(self.data)
 
+    def get_aggregate(self, tree, name):
+        return tree.reducers[name].leaf(self.records())
+
+    def copy(self):
+        "Leaf with the same names, for path copying."
+        result = QtLeafNode(self.prefix, None, None)
+        result.data = self.data.copy()
+        return result
+
+    def child_nodes(self):
+        return []
+
+    def entries(self):
+        "List of (name, position) for the names in the leaf."
+        return [(name, info["position"]) for (name, info) in self.data.items()]
+
+    def records(self):
+        "List of (name, position, info) for the names in the leaf."
+        return [(name, info["position"], info) for (name, info) in self.data.items()]
+
     def adjacency_walk(self, tree, callback, data, position, iposition):
         # always visit any leaf that is reached.
         callback(position, self, tree, data)
@@ -120,6 +277,16 @@ class QtLeafNode:
         for (name, info) in leaf.data.items():
             self.add(name, info)
 
+    def remove(self, name):
+        "Remove name, returning (position, info without position or None)."
+        info = self.data.pop(name).copy()
+        position = info.pop("position")
+        return (position, info or None)
+
+    def size(self):
+        "Number of names in the leaf."
+        return len(self.data)
+
     def list_dump(self, tree):
         data = self.data.copy()
         # convert to lists (from array) to enable comparisons
@@ -127,3 +294,247 @@ class QtLeafNode:
             d = data[name] = data[name].copy()
             d["position"] = list(d["position"])
         return ("Leaf " + tree.qs(self.prefix), data)
+
+class _Many(object):
+    "Marks a CompactLeafNode holding more than one name; unpickles as the same object."
+
+    def __reduce__(self):
+        return "_MANY"
+
+_MANY = _Many()
+
+class CompactInteriorNode(object):
+    """
+    Interior node without an instance dict: children are kept in a list of
+    length nquadrants indexed by quadrant, with None for empty quadrants.
+    """
+
+    __slots__ = ("prefix", "level", "kids", "_int_position", "_geometry", "_names", "_aggregates")
+
+    data = {}  # "read only constant"
+
+    def __init__(self, prefix, level, nquadrants):
+        self.prefix = prefix
+        self.level = level
+        self.kids = [None] * nquadrants
+        self._int_position = None
+        self._geometry = None
+        self._names = None
+        self._aggregates = None
+
+    @property
+    def children(self):
+        "Dictionary view of the non-empty quadrants."
+        return dict((quadrant, child) for (quadrant, child) in enumerate(self.kids)
+                    if child is not None)
+
+    def get_names(self):
+        "Set of the names below, cached on this node only and kept current after."
+        names = self._names
+        if names is None:
+            names = self._names = names_below(self)
+        return names
+
+    def get_aggregate(self, tree, name):
+        "Value of the reducer registered on tree as name over all descendents."
+        aggregates = self._aggregates
+        if aggregates is None:
+            aggregates = self._aggregates = {}
+        if name not in aggregates:
+            aggregates[name] = gqaggregate.merge_children(tree, self, name)
+        return aggregates[name]
+
+    def copy(self):
+        "Node with the same children, for path copying; cached names and aggregates are dropped."
+        result = CompactInteriorNode(self.prefix, self.level, 0)
+        result.kids = list(self.kids)
+        result._int_position = self._int_position
+        result._geometry = self._geometry
+        return result
+
+    def child_nodes(self):
+        "List of the child nodes."
+        return [child for child in self.kids if child is not None]
+
+    def adjacency_walk(self, tree, callback, data, position, iposition):
+        for node in iter_adjacent(tree, self, iposition):
+            callback(position, node, tree, data)
+
+    def walk(self, tree, callback, data):
+        "walk reverse breadth first passing (node, tree, data) to callback."
+        for node in iter_post(self):
+            callback(node, tree, data)
+
+    def add_new_child(self, node, tree):
+        "Add a child in empty quadrant."
+        level = self.level
+        nprefix = node.prefix
+        (remainder, quadrant) = tree.quadrant(nprefix, level + 1)
+        assert remainder == self.prefix, ("bad child prefix" +
+            repr((tree.qs(self.prefix), tree.qs(remainder), tree.qs(nprefix), level)))
+        kids = self.kids
+        assert kids[quadrant] is None, "non-empty quadrant " + repr(quadrant)
+        kids[quadrant] = node
+        names = self._names
+        if names is not None:
+            names.update(node.get_names())
+        if self._aggregates:
+            gqaggregate.merge_added(tree, self._aggregates, node)
+
+    def add_leaf(self, leaf, tree):
+        level = self.level
+        (remainder, quadrant) = tree.quadrant(leaf.prefix, level + 1)
+        assert remainder == self.prefix, ("bad leaf prefix" +
+            repr((tree.qs(self.prefix), tree.qs(remainder), level)))
+        kids = self.kids
+        self.update_aggregates(tree, kids[quadrant], leaf)
+        new_child = tree.combine(kids[quadrant], leaf)
+        if new_child.level is not None:
+            assert new_child.level > level
+        names = self._names
+        if names is not None:
+            names.update(leaf.get_names())
+        kids[quadrant] = new_child
+
+    def update_aggregates(self, tree, old_child, leaf):
+        "Merge leaf into cached aggregates, or drop them if leaf may replace names."
+        if not self._aggregates:
+            return
+        if gqaggregate.replaces(tree, old_child, leaf):
+            self._aggregates = None
+        else:
+            gqaggregate.merge_added(tree, self._aggregates, leaf)
+
+    def set_child(self, quadrant, node):
+        "Replace the child in quadrant, or empty it when node is None."
+        self.kids[quadrant] = node
+
+    def removed(self, name, copied=False):
+        """
+        Repair cached names and drop cached aggregates after name was removed
+        below; copied tells whether another copy of name is still below.
+        """
+        self._aggregates = None
+        if self._names is not None and not copied:
+            self._names.discard(name)
+
+    def list_dump(self, tree):
+        children_dumped = []
+        for (quadrant, child) in enumerate(self.kids):
+            if child is not None:
+                children_dumped.append((tree.quad_string(quadrant), child.list_dump(tree)))
+        return [
+            "node %s LV%s" % (tree.qs(self.prefix), self.level),
+            self.data,
+            children_dumped]
+
+class CompactLeafNode(object):
+    """
+    Leaf without an instance dict.  A single name is stored directly with its
+    position and extra info (None when empty); a leaf holding several names
+    keeps a dict of name to (position, info) instead.
+    """
+
+    __slots__ = ("prefix", "name", "position", "info")
+
+    children = {}  # "read only constant"
+    level = None  # "read only constant"
+
+    def __init__(self, prefix, name, position, info=None):
+        self.prefix = prefix
+        self.name = name
+        self.position = position
+        self.info = info
+
+    def records(self):
+        "List of (name, position, info) for the names in the leaf."
+        if self.name is _MANY:
+            return [(name, position, info)
+                    for (name, (position, info)) in self.info.items()]
+        return [(self.name, self.position, self.info)]
+
+    @property
+    def data(self):
+        "Dictionary of name to info including position, as in QtLeafNode."
+        result = {}
+        for (name, position, info) in self.records():
+            entry = {}
+            if info:
+                entry.update(info)
+            entry["position"] = position
+            result[name] = entry
+        return result
+
+    def get_names(self):
+        if self.name is _MANY:
+            return set(self.info)
+        return set([self.name])
+
+    def get_aggregate(self, tree, name):
+        return tree.reducers[name].leaf(self.records())
+
+    def copy(self):
+        "Leaf with the same names, for path copying."
+        info = self.info
+        if self.name is _MANY:
+            info = info.copy()
+        return CompactLeafNode(self.prefix, self.name, self.position, info)
+
+    def child_nodes(self):
+        return []
+
+    def entries(self):
+        "List of (name, position) for the names in the leaf."
+        if self.name is _MANY:
+            return [(name, position) for (name, (position, info)) in self.info.items()]
+        return [(self.name, self.position)]
+
+    def adjacency_walk(self, tree, callback, data, position, iposition):
+        # always visit any leaf that is reached.
+        callback(position, self, tree, data)
+
+    def walk(self, tree, callback, data):
+        "walk reverse breadth first passing (node, tree, data) to callback."
+        callback(self, tree, data)
+
+    def add(self, name, position, info=None):
+        if self.name is _MANY:
+            self.info[name] = (position, info)
+        elif self.name == name or self.name is None:
+            self.name = name
+            self.position = position
+            self.info = info
+        else:
+            self.info = {self.name: (self.position, self.info), name: (position, info)}
+            self.name = _MANY
+            self.position = None
+
+    def add_leaf(self, leaf):
+        for (name, position, info) in leaf.records():
+            self.add(name, position, info)
+
+    def remove(self, name):
+        "Remove name, returning (position, info).  The last name leaves name None."
+        if self.name is _MANY:
+            (position, info) = self.info.pop(name)
+            if len(self.info) == 1:
+                [(self.name, (self.position, self.info))] = self.info.items()
+            return (position, info)
+        assert self.name == name, "name not in leaf " + repr(name)
+        result = (self.position, self.info)
+        self.name = self.position = self.info = None
+        return result
+
+    def size(self):
+        "Number of names in the leaf."
+        if self.name is _MANY:
+            return len(self.info)
+        if self.name is None:
+            return 0
+        return 1
+
+    def list_dump(self, tree):
+        data = self.data
+        for name in data:
+            data[name]["position"] = list(data[name]["position"])
+        return ("Leaf " + tree.qs(self.prefix), data)
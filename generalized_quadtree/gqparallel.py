@@ -0,0 +1,175 @@
+"""
+Opt-in process parallelism for bulk construction and batched queries.
+
+from_points partitions the points by Morton prefix at the shallowest level
+with at least one quadrant per worker (the top level quadrants,
+tree.quadrant(index, 1), unless there are more workers than those), builds
+the subtree of each quadrant in a process pool and stitches the subtrees
+together with join_sorted, giving the tree GeneralizedQuadtree.from_points
+builds.  The inputs reach the workers through fork, not pickling; each
+subtree comes back pickled once with its name index.  Unpickling nodes
+costs the parent about as much as creating them, so this pays only with
+several processors and while building a subtree costs more than shipping it.
+
+QueryPool shards batched nearest, within and box queries across worker
+processes which share one copy of the tree, either inherited at fork
+(share="fork") or memory mapped from a saved file (share="file", see
+gqfile), so the tree is never pickled per task.  Both rely on fork, as
+multiprocessing uses on POSIX systems.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+from . import gqtree
+import numpy as np
+
+# build inputs or query tree of the pool being started, inherited by its
+# forked workers.
+_shared = {}
+
+def split_level(tree, workers):
+    "Shallowest level with at least workers quadrants, and at least 1."
+    level = 1
+    while tree.nquadrants ** level < workers and level < tree.levels:
+        level += 1
+    return level
+
+def partition(tree, positions, level):
+    "Point numbers grouped by their quadrant at level, in index order."
+    indices = tree.index_positions(positions)[0]
+    prefixes = indices >> (tree.dimensions * (tree.levels - level))
+    order = np.argsort(prefixes, kind="mergesort")
+    prefixes = prefixes[order]
+    starts = np.flatnonzero(prefixes[1:] != prefixes[:-1]) + 1
+    return np.split(order, starts)
+
+def build_part(part):
+    "(subtree root, name index, name copies) of a partition, in a worker."
+    (cls, args, positions, names, infos, parts) = _shared["build"]
+    rows = parts[part]
+    tree = cls(*args)
+    part_infos = None
+    if infos is not None:
+        part_infos = [infos[row] for row in rows]
+    (indices, leaves) = tree.sorted_leaves(positions[rows], [names[row] for row in rows], part_infos)
+    return (tree.build_from_sorted(indices, leaves), tree.name_index, tree.name_copies)
+
+def from_points(cls, origin, sidelength, levels, positions, names, infos=None, compact=False,
+                workers=None):
+    "cls.from_points with the subtrees built by a pool of workers processes."
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    assert workers >= 1, "bad number of workers " + repr(workers)
+    tree = cls(origin, sidelength, levels, compact)
+    positions = np.asarray(positions, dtype=float)
+    assert len(positions) == len(names), "positions and names differ in length"
+    if not len(names):
+        return tree
+    parts = partition(tree, positions, split_level(tree, workers))
+    _shared["build"] = (cls, (origin, sidelength, levels, compact), positions, names, infos, parts)
+    try:
+        if workers == 1 or len(parts) == 1:
+            subtrees = map(build_part, range(len(parts)))
+        else:
+            pool = multiprocessing.Pool(min(workers, len(parts)))
+            try:
+                subtrees = pool.map(build_part, range(len(parts)), chunksize=1)
+            finally:
+                pool.terminate()
+    finally:
+        del _shared["build"]
+    roots = []
+    for (root, name_index, name_copies) in subtrees:
+        roots.append(root)
+        # later partitions win names repeated across them, as in build_from_sorted
+        for (name, indices) in name_copies.items():
+            tree.name_copies.setdefault(name, []).extend(indices)
+        for (name, (index, leaf)) in name_index.items():
+            tree.index_name(name, index, leaf)
+    prefixes = np.array([root.prefix for root in roots],
+                        dtype=gqtree.index_dtype(levels, tree.dimensions))
+    tree.root = tree.join_sorted(prefixes, roots)
+    return tree
+
+
+def open_file(path):
+    "Worker initializer mapping the saved tree at path, written by the pool."
+    from . import gqfile
+    _shared["tree"] = gqfile.load(path, mmap=True, allow_pickle=True)
+
+def query_shard(task):
+    "Results of one shard of a batched query, in a worker."
+    (method, arrays, args) = task
+    return getattr(_shared["tree"], method)(*(tuple(arrays) + args))
+
+class QueryPool(object):
+    """
+    Pool of workers processes (cpu_count by default) answering batched
+    queries on tree, each batch split into shards of about shard_rows
+    queries (by default about four shards per worker).
+    """
+
+    def __init__(self, tree, workers=None, share="fork", shard_rows=None):
+        assert share in ("fork", "file"), "bad share " + repr(share)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        assert workers >= 1, "bad number of workers " + repr(workers)
+        self.workers = workers
+        self.shard_rows = shard_rows
+        self.directory = None
+        if share == "file":
+            self.directory = tempfile.mkdtemp()
+            path = os.path.join(self.directory, "tree.gqt")
+            tree.save(path)
+            self.pool = multiprocessing.Pool(workers, open_file, (path,))
+        else:
+            _shared["tree"] = tree
+            try:
+                self.pool = multiprocessing.Pool(workers)
+            finally:
+                del _shared["tree"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        "Stop the workers and remove any saved file."
+        self.pool.terminate()
+        self.pool.join()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+            self.directory = None
+
+    def run(self, method, arrays, *args):
+        "Concatenated results of tree.method(*(shards of arrays + args)) over shards of the rows."
+        arrays = [np.asarray(array, dtype=float) for array in arrays]
+        nrows = len(arrays[0])
+        if not nrows:
+            return []
+        nshards = 4 * self.workers
+        if self.shard_rows is not None:
+            nshards = -(-nrows // self.shard_rows)
+        bounds = np.linspace(0, nrows, min(nshards, nrows) + 1).astype(int)
+        tasks = [(method, [array[start:stop] for array in arrays], args)
+                 for (start, stop) in zip(bounds[:-1], bounds[1:])]
+        results = []
+        for shard in self.pool.map(query_shard, tasks, chunksize=1):
+            results.extend(shard)
+        return results
+
+    def nearest_many(self, positions, k=1, metric="l2"):
+        "tree.nearest_many across the workers."
+        return self.run("nearest_many", [positions], k, metric)
+
+    def within_many(self, positions, radius, metric="l2"):
+        "tree.within_many across the workers."
+        return self.run("within_many", [positions], radius, metric)
+
+    def query_boxes(self, lowers, uppers):
+        "tree.query_boxes across the workers."
+        return self.run("query_boxes", [lowers, uppers])
@@ -0,0 +1,232 @@
+
+"""
+Spatial queries over quadtrees: k nearest neighbours, radius and box searches.
+
+nearest and within use exact lower bounds on the distance from the query point to the
+quadrant covered by a node, under the L1, L2 or L-infinity metric in any
+number of dimensions.  nearest is a best-first search on a priority queue
+of nodes and points; within is a depth first search pruning quadrants
+farther than the radius.  Each returns (names, positions, distances)
+ordered by increasing distance.  query_box returns the set of names in an
+axis aligned box, testing quadrants against the box in voxel coordinates.
+"""
+
+import heapq
+import itertools
+from . import gqnodes
+import numpy as np
+
+# metric names accepted by the queries, and the norm order for each.
+METRICS = {"l1": 1, "l2": 2, "linf": np.inf}
+
+def metric_order(metric):
+    "Norm order (1, 2 or inf) for a metric name or order."
+    if metric in METRICS:
+        return METRICS[metric]
+    if metric in (1, 2, np.inf):
+        return metric
+    raise ValueError("unknown metric " + repr(metric))
+
+def norms(offsets, order):
+    "Norms of offsets along the last axis."
+    offsets = np.abs(offsets)
+    if order == 1:
+        return offsets.sum(axis=-1)
+    if order == 2:
+        return np.sqrt((offsets * offsets).sum(axis=-1))
+    return offsets.max(axis=-1)
+
+def node_box(tree, node, cache=None):
+    "(lower, upper) corners of the quadrant covered by node."
+    if cache is not None:
+        box = cache.get(id(node))
+        if box is not None:
+            return box
+    geometry = tree.node_geometry(node)
+    box = (geometry[0], geometry[1])
+    if cache is not None:
+        cache[id(node)] = box
+    return box
+
+def child_bounds(tree, node, position, order, cache=None):
+    "(children, lower bounds on the distance from position to each child)."
+    children = node.child_nodes()
+    boxes = [node_box(tree, child, cache) for child in children]
+    lower = np.array([box[0] for box in boxes])
+    upper = np.array([box[1] for box in boxes])
+    return (children, norms(np.maximum(np.maximum(lower - position, position - upper), 0), order))
+
+def leaf_distances(leaf, position, order):
+    "(entries, distances) for the (name, position) entries of a leaf."
+    entries = leaf.entries()
+    points = np.array([point for (name, point) in entries], dtype=float)
+    return (entries, norms(points - position, order))
+
+def results(found, dimensions):
+    "Query result from a list of (distance, name, position)."
+    names = [name for (distance, name, point) in found]
+    positions = np.array([point for (distance, name, point) in found], dtype=float)
+    distances = np.array([distance for (distance, name, point) in found], dtype=float)
+    return (names, positions.reshape((len(found), dimensions)), distances)
+
+def nearest(tree, position, k=1, metric="l2", box_cache=None):
+    "The k names nearest to position: (names, positions, distances)."
+    order = metric_order(metric)
+    position = np.asarray(position, dtype=float)
+    found = []
+    if tree.root is None or k < 1:
+        return results(found, tree.dimensions)
+    # heap of (lower bound, tie breaker, node or (name, position) entry)
+    counter = itertools.count()
+    heap = [(0.0, next(counter), tree.root)]
+    while heap and len(found) < k:
+        (distance, tie, item) = heapq.heappop(heap)
+        if isinstance(item, tuple):
+            found.append((distance, item[0], item[1]))
+        elif item.level is None:
+            (entries, distances) = leaf_distances(item, position, order)
+            for (entry, entry_distance) in zip(entries, distances):
+                heapq.heappush(heap, (entry_distance, next(counter), entry))
+        else:
+            (children, bounds) = child_bounds(tree, item, position, order, box_cache)
+            for (child, bound) in zip(children, bounds):
+                heapq.heappush(heap, (bound, next(counter), child))
+    return results(found, tree.dimensions)
+
+def within(tree, position, radius, metric="l2", box_cache=None):
+    "All names within radius of position: (names, positions, distances)."
+    order = metric_order(metric)
+    position = np.asarray(position, dtype=float)
+    found = []
+    stack = []
+    if tree.root is not None:
+        stack.append(tree.root)
+    while stack:
+        node = stack.pop()
+        if node.level is None:
+            (entries, distances) = leaf_distances(node, position, order)
+            for ((name, point), distance) in zip(entries, distances):
+                if distance <= radius:
+                    found.append((distance, name, point))
+        else:
+            (children, bounds) = child_bounds(tree, node, position, order, box_cache)
+            for (child, bound) in zip(children, bounds):
+                if bound <= radius:
+                    stack.append(child)
+    found.sort(key=lambda item: item[0])
+    return results(found, tree.dimensions)
+
+def nearest_many(tree, positions, k=1, metric="l2"):
+    "nearest for each row of an (M, dimensions) array, sharing node boxes."
+    box_cache = {}
+    return [nearest(tree, position, k, metric, box_cache)
+            for position in np.asarray(positions, dtype=float)]
+
+def within_many(tree, positions, radius, metric="l2"):
+    "within for each row of an (M, dimensions) array, sharing node boxes."
+    box_cache = {}
+    return [within(tree, position, radius, metric, box_cache)
+            for position in np.asarray(positions, dtype=float)]
+
+def node_voxel_range(tree, node):
+    "Inclusive (lowest, highest) voxel coordinates covered by node."
+    level = node.level
+    if level is None:
+        ipos = tree.index_to_index_position(node.prefix)
+        return (ipos, ipos)
+    ipos = node._int_position
+    if ipos is None:
+        ipos = tree.index_to_index_position(node.prefix)
+        node._int_position = ipos
+    return (ipos, ipos + ((1 << (tree.levels - level)) - 1))
+
+def box_voxel_ranges(tree, lower, upper):
+    """
+    Voxel ranges for the box [lower, upper]: every stored position in the box
+    lies in a voxel of the outer range, and every position stored in a voxel of
+    the inner range lies in the box (with a voxel of margin against rounding).
+    """
+    low = (lower - tree.origin) / tree.min_side
+    high = (upper - tree.origin) / tree.min_side
+    outer = (np.floor(low), np.floor(high))
+    inner = (np.floor(low) + 1, np.floor(high) - 1)
+    return (outer, inner)
+
+def query_box(tree, lower, upper):
+    """
+    Set of names with positions in the closed box lower <= position <= upper.
+    Quadrants disjoint from the box are pruned and quadrants inside it are
+    accepted whole through names cached on them or their descendents,
+    without testing positions (see gqnodes.names_below).
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    names = set()
+    if tree.root is not None:
+        collect_box(tree, tree.root, lower, upper, box_voxel_ranges(tree, lower, upper), names)
+    return names
+
+def collect_box(tree, root, lower, upper, ranges, names):
+    "Add the names below root in the box to names, given its box_voxel_ranges."
+    ((outer_lo, outer_hi), (inner_lo, inner_hi)) = ranges
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        (lo, hi) = node_voxel_range(tree, node)
+        if (hi < outer_lo).any() or (lo > outer_hi).any():
+            continue
+        if (lo >= inner_lo).all() and (hi <= inner_hi).all():
+            names.update(gqnodes.names_below(node))
+        elif node.level is None:
+            for (name, position) in node.entries():
+                position = np.asarray(position, dtype=float)
+                if (lower <= position).all() and (position <= upper).all():
+                    names.add(name)
+        else:
+            stack.extend(node.child_nodes())
+
+def query_boxes(tree, lowers, uppers):
+    """
+    query_box for each row of (M, dimensions) arrays of lower and upper
+    corners, in one descent: each node is tested against all the boxes still
+    open at it at once, and the names below a node inside several boxes are
+    gathered once.  A subtree open to one box is searched as by query_box.
+    """
+    lowers = np.asarray(lowers, dtype=float).reshape((-1, tree.dimensions))
+    uppers = np.asarray(uppers, dtype=float).reshape((-1, tree.dimensions))
+    ((outer_lo, outer_hi), (inner_lo, inner_hi)) = box_voxel_ranges(tree, lowers, uppers)
+    found = [set() for row in range(len(lowers))]
+    stack = []
+    if tree.root is not None and len(lowers):
+        stack.append((tree.root, np.arange(len(lowers))))
+    while stack:
+        (node, rows) = stack.pop()
+        if len(rows) == 1:
+            row = rows[0]
+            collect_box(tree, node, lowers[row], uppers[row],
+                        ((outer_lo[row], outer_hi[row]), (inner_lo[row], inner_hi[row])),
+                        found[row])
+            continue
+        (lo, hi) = node_voxel_range(tree, node)
+        rows = rows[~((hi < outer_lo[rows]).any(axis=1) | (lo > outer_hi[rows]).any(axis=1))]
+        if not len(rows):
+            continue
+        inside = (lo >= inner_lo[rows]).all(axis=1) & (hi <= inner_hi[rows]).all(axis=1)
+        if inside.any():
+            names = gqnodes.names_below(node)
+            for row in rows[inside]:
+                found[row].update(names)
+            rows = rows[~inside]
+            if not len(rows):
+                continue
+        if node.level is None:
+            for (name, position) in node.entries():
+                position = np.asarray(position, dtype=float)
+                hits = ((lowers[rows] <= position).all(axis=1) &
+                        (position <= uppers[rows]).all(axis=1))
+                for row in rows[hits]:
+                    found[row].add(name)
+        else:
+            for child in node.child_nodes():
+                stack.append((child, rows))
+    return found
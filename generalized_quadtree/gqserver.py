@@ -0,0 +1,407 @@
+"""
+Query server batching concurrent requests, with a client and a load generator.
+
+    python -m generalized_quadtree.gqserver serve tree.gqt (--port 9000 | --unix path)
+        [--window 0.0003] [--max-batch 256] [--max-pending 1024]
+    python -m generalized_quadtree.gqserver load (--port 9000 | --unix path)
+        [--op nearest] [--clients 8] [--requests 10000]
+
+Requests and responses are JSON objects, one per line, matched by "id":
+
+  {"id": 1, "op": "nearest", "position": [x, y], "k": 1, "metric": "l2"}
+      -> {"id": 1, "names": [...], "positions": [[x, y], ...], "distances": [...]}
+  {"id": 2, "op": "box", "lower": [x, y], "upper": [x, y]}
+      -> {"id": 2, "names": [...]}  (sorted)
+  {"id": 3, "op": "adjacent", "position": [x, y]}
+      -> {"id": 3, "nodes": [[level, prefix], ...]}  (the nodes adjacency_walk visits)
+  {"id": 4, "op": "info"}
+      -> {"id": 4, "origin": [...], "sidelength": s, "levels": n, "size": names}
+
+A request that fails gets {"id": ..., "error": message}.
+
+Connections are served by threads which parse requests and queue them for
+one Batcher thread.  The batcher waits up to window seconds after the first
+request of a batch for more (at most max_batch), groups them by operation
+and parameters, and runs each group as one batched query (nearest_many,
+query_boxes, and one int position conversion for the adjacency walks), then writes
+the responses back to their connections.  A connection may pipeline up to
+max_in_flight requests; further requests, and those arriving while
+max_pending are queued, wait, so clients producing requests faster than
+they are served are slowed down instead of growing the queues.
+
+The batches run on tree.snapshot() when the tree has snapshots enabled, so
+another thread may update it while serving; otherwise the tree must not
+change while the server runs.  This uses threads and SocketServer, as the
+package runs on Python 2 where asyncio is not available.
+"""
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+import Queue
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import numpy as np
+from . import gqnodes
+from .gqneighbors import node_key
+
+OPERATIONS = ("nearest", "box", "adjacent", "info")
+
+class Batcher(object):
+    "Thread running the requests queued by submit against tree in batches."
+
+    def __init__(self, tree, window=0.0003, max_batch=256, max_pending=1024):
+        assert window >= 0, "bad window " + repr(window)
+        assert max_batch > 0, "bad max_batch " + repr(max_batch)
+        self.tree = tree
+        self.window = window
+        self.max_batch = max_batch
+        # (request, reply) waiting, or None to stop
+        self.queue = Queue.Queue(max_pending)
+        # number of batches and requests run
+        self.batches = 0
+        self.requests = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        "Run the requests already queued, then stop."
+        self.queue.put(None)
+        self.thread.join()
+
+    def submit(self, request, reply):
+        "Queue request, to call reply(response) from the batcher; waits while the queue is full."
+        self.queue.put((request, reply))
+
+    def run(self):
+        queue = self.queue
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.time() + self.window
+            stopping = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        item = queue.get(timeout=remaining)
+                    else:
+                        item = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.execute(batch)
+            if stopping:
+                return
+
+    def execute(self, batch):
+        "Run a batch of (request, reply), grouping requests which can run as one query."
+        tree = self.tree
+        if tree.persistent:
+            tree = tree.snapshot()
+        # counted before replying, so a client sees the counts of its answered requests
+        self.batches += 1
+        self.requests += len(batch)
+        groups = collections.OrderedDict()
+        for (request, reply) in batch:
+            try:
+                key = group_key(tree, request)
+            except Exception as e:
+                reply(error_response(request, e))
+                continue
+            groups.setdefault(key, []).append((request, reply))
+        for (key, items) in groups.items():
+            requests = [request for (request, reply) in items]
+            # any failure is answered, so the batcher thread keeps serving
+            try:
+                responses = run_group(tree, key, requests)
+            except Exception as e:
+                responses = [error_response(request, e) for request in requests]
+            for ((request, reply), response) in zip(items, responses):
+                response["id"] = request.get("id")
+                reply(response)
+
+def error_response(request, error):
+    request_id = None
+    if isinstance(request, dict):
+        request_id = request.get("id")
+    return {"id": request_id, "error": "%s: %s" % (type(error).__name__, error)}
+
+def vector(tree, request, field):
+    "Field of request as a position of tree."
+    value = np.asarray(request[field], dtype=float)
+    if value.shape != (tree.dimensions,):
+        raise ValueError("%s needs %s coordinates" % (field, tree.dimensions))
+    return value
+
+def group_key(tree, request):
+    "Key of the requests run together with request, after checking it."
+    if not isinstance(request, dict):
+        raise TypeError("request is not an object")
+    op = request["op"]
+    if op not in OPERATIONS:
+        raise ValueError("unknown op " + repr(op))
+    if op == "nearest":
+        vector(tree, request, "position")
+        return (op, int(request.get("k", 1)), str(request.get("metric", "l2")))
+    if op == "box":
+        vector(tree, request, "lower")
+        vector(tree, request, "upper")
+    elif op == "adjacent":
+        vector(tree, request, "position")
+    return (op,)
+
+def run_group(tree, key, requests):
+    "Responses to requests with the same group_key, run as one batched query."
+    op = key[0]
+    if op == "nearest":
+        positions = [vector(tree, request, "position") for request in requests]
+        return [{"names": names, "positions": points.tolist(), "distances": distances.tolist()}
+                for (names, points, distances) in tree.nearest_many(positions, key[1], key[2])]
+    if op == "box":
+        lowers = [vector(tree, request, "lower") for request in requests]
+        uppers = [vector(tree, request, "upper") for request in requests]
+        return [{"names": sorted(names)} for names in tree.query_boxes(lowers, uppers)]
+    if op == "adjacent":
+        positions = np.array([vector(tree, request, "position") for request in requests])
+        if tree.root is None or tree.query_cache is not None or tree.neighbor_index is not None:
+            walks = [tree.iter_adjacent(position) for position in positions]
+        else:
+            # one conversion to int positions for the batch
+            walks = [gqnodes.iter_adjacent(tree, tree.root, ipos)
+                     for ipos in tree.int_positions(positions)]
+        return [{"nodes": [list(node_key(tree, node)) for node in walk]} for walk in walks]
+    return [{"origin": tree.origin.tolist(), "sidelength": tree.sidelength,
+             "levels": tree.levels, "size": tree.size()}
+            for request in requests]
+
+class QueryHandler(SocketServer.StreamRequestHandler):
+    "Reads the requests of a connection and writes the responses as the batcher replies."
+
+    def handle(self):
+        server = self.server
+        wfile = self.wfile
+        lock = threading.Lock()
+        in_flight = threading.Condition(threading.Lock())
+        counts = [0]
+        def reply(response):
+            try:
+                data = json.dumps(response) + "\n"
+            except Exception as e:
+                # such as names JSON cannot encode
+                data = json.dumps(error_response(response, e)) + "\n"
+            with lock:
+                try:
+                    wfile.write(data)
+                    wfile.flush()
+                except socket.error:
+                    pass
+            with in_flight:
+                counts[0] -= 1
+                in_flight.notify()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                with in_flight:
+                    counts[0] += 1
+                reply(error_response(None, e))
+                continue
+            with in_flight:
+                while counts[0] >= server.max_in_flight:
+                    in_flight.wait()
+                counts[0] += 1
+            server.batcher.submit(request, reply)
+        # the batcher writes to the connection until its requests are answered
+        with in_flight:
+            while counts[0]:
+                in_flight.wait()
+
+class QueryServerMixIn(SocketServer.ThreadingMixIn):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def close(self):
+        "Stop serve_forever (running in another thread), finish the queued requests and close."
+        self.shutdown()
+        self.batcher.stop()
+        self.server_close()
+
+class TCPQueryServer(QueryServerMixIn, SocketServer.TCPServer):
+    pass
+
+class UnixQueryServer(QueryServerMixIn, SocketServer.UnixStreamServer):
+    pass
+
+def serve(tree, address, window=0.0003, max_batch=256, max_pending=1024, max_in_flight=64):
+    """
+    Server for queries on tree at address, (host, port) for TCP or a path for
+    a Unix socket, with its batcher started.  Call serve_forever (or run it in
+    a thread) to answer requests, and close to stop.
+    """
+    if isinstance(address, tuple):
+        server = TCPQueryServer(address, QueryHandler)
+    else:
+        server = UnixQueryServer(address, QueryHandler)
+    server.max_in_flight = max_in_flight
+    server.batcher = Batcher(tree, window, max_batch, max_pending)
+    server.batcher.start()
+    return server
+
+class QueryClient(object):
+    "Connection to a query server, sending one request at a time."
+
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.rfile = self.socket.makefile("rb")
+        self.wfile = self.socket.makefile("wb")
+        self.ids = 0
+
+    def request(self, request):
+        "Response to a request dict."
+        self.ids += 1
+        request = dict(request, id=self.ids)
+        self.wfile.write(json.dumps(request) + "\n")
+        self.wfile.flush()
+        line = self.rfile.readline()
+        if not line:
+            raise IOError("connection closed by server")
+        response = json.loads(line)
+        assert response.get("id") == self.ids, "response out of order " + repr(response)
+        return response
+
+    def nearest(self, position, k=1, metric="l2"):
+        return self.request({"op": "nearest", "position": list(position), "k": k,
+                             "metric": metric})
+
+    def box(self, lower, upper):
+        return self.request({"op": "box", "lower": list(lower), "upper": list(upper)})
+
+    def adjacent(self, position):
+        return self.request({"op": "adjacent", "position": list(position)})
+
+    def info(self):
+        return self.request({"op": "info"})
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.socket.close()
+
+def random_requests(info, op, count, seed=0, box_side=0.02):
+    "count requests of op at uniform positions in the volume described by an info response."
+    rng = np.random.RandomState(seed)
+    origin = np.array(info["origin"])
+    side = info["sidelength"]
+    positions = origin + rng.uniform(0.0, side, size=(count, len(origin)))
+    if op == "box":
+        half = box_side * side / 2.0
+        return [{"op": op, "lower": (position - half).tolist(), "upper": (position + half).tolist()}
+                for position in positions]
+    return [{"op": op, "position": position.tolist()} for position in positions]
+
+def load(address, requests, clients=8):
+    """
+    Send requests from clients threads, each with its own connection and
+    one request in flight, and return a summary: the number of requests and
+    errors, seconds, requests per second and the p50 and p99 latency in
+    seconds.
+    """
+    latencies = [[] for client in range(clients)]
+    errors = [0] * clients
+    def run(client):
+        connection = QueryClient(address)
+        try:
+            for request in requests[client::clients]:
+                start = time.time()
+                response = connection.request(request)
+                latencies[client].append(time.time() - start)
+                if "error" in response:
+                    errors[client] += 1
+        finally:
+            connection.close()
+    threads = [threading.Thread(target=run, args=(client,)) for client in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    times = np.concatenate([np.array(client_times, dtype=float) for client_times in latencies])
+    summary = {"requests": len(times), "errors": sum(errors), "seconds": seconds,
+               "per_second": len(times) / seconds if seconds else None,
+               "p50": None, "p99": None}
+    if len(times):
+        summary["p50"] = float(np.percentile(times, 50))
+        summary["p99"] = float(np.percentile(times, 99))
+    return summary
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="quadtree query server")
+    parser.add_argument("command", choices=("serve", "load"))
+    parser.add_argument("tree", nargs="?", help="tree file written by save (serve)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--unix", help="path of a Unix socket instead of TCP")
+    parser.add_argument("--window", type=float, default=0.0003,
+                        help="seconds to gather a batch (default 0.0003)")
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-pending", type=int, default=1024)
+    parser.add_argument("--allow-pickle", action="store_true",
+                        help="load pickled names and infos (trusted tree files only)")
+    parser.add_argument("--op", choices=("nearest", "box", "adjacent"), default="nearest")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=10000)
+    args = parser.parse_args(argv)
+    address = args.unix
+    if address is None:
+        if args.port is None:
+            parser.error("--port or --unix is needed")
+        address = (args.host, args.port)
+    if args.command == "serve":
+        if args.tree is None:
+            parser.error("serve needs a tree file")
+        from . import gqfile
+        tree = gqfile.load(args.tree, allow_pickle=args.allow_pickle)
+        server = serve(tree, address, args.window, args.max_batch, args.max_pending)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.batcher.stop()
+        server.server_close()
+        return 0
+    connection = QueryClient(address)
+    info = connection.info()
+    connection.close()
+    summary = load(address, random_requests(info, args.op, args.requests), args.clients)
+    print("%(requests)s requests, %(errors)s errors in %(seconds).2f seconds: "
+          "%(per_second).0f per second" % summary)
+    if summary["p50"] is not None:
+        print("latency p50 %.3f ms, p99 %.3f ms" % (summary["p50"] * 1e3, summary["p99"] * 1e3))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""
+Read only views of trees updated by path copying.
+
+After GeneralizedQuadtree.enable_snapshots, add and remove never change a
+node reachable from a published root: they copy the nodes on the path to
+the changed voxel, link the copies to the unchanged subtrees, and then
+replace tree.root, a single attribute assignment.  tree.snapshot() takes
+a TreeSnapshot holding the root of that moment, so readers in other
+threads query a consistent tree without locks while the writer goes on.
+A writer still needs a lock against other writers.
+
+A snapshot is a GeneralizedQuadtree sharing the nodes and settings of
+its tree, so every query works on it; the updates raise
+NotImplementedError.  The name index (for locate, position_of and "in")
+is rebuilt from the leaves on first use, since the tree's own one is
+changed in place.  Names and aggregates cached lazily on shared nodes are
+the same for every version holding the node, so computing them from a
+reader is safe.
+
+A LinearQuadtree with snapshots enabled replaces its columns on each
+update instead of changing them, publishing them in one dictionary
+update.  Its LinearSnapshot shares the columns of the moment it is taken
+and derives its own nodes from them.
+"""
+
+from . import gqtree
+from . import gqlinear
+
+class ReadOnly:
+    "Name lookups rebuilt from the leaves of a snapshot, which refuses updates."
+
+    def share(self, tree):
+        "Share the settings and contents of tree, leaving out its indexes, caches and stats."
+        self.__dict__.update(tree.__dict__)
+        self.taken_size = tree.size()
+        # built from the leaves by locate
+        self.name_index = None
+        self.name_copies = None
+        self.neighbor_index = None
+        self.query_cache = None
+        self.stats_recorder = None
+        self.reducers = dict(tree.reducers)
+        self._quadrant_offsets = {}
+
+    def snapshot(self):
+        return self
+
+    def __contains__(self, name):
+        return name in self.located()
+
+    def size(self):
+        "Number of names when the snapshot was taken."
+        if self.name_index is None:
+            return self.taken_size
+        return len(self.name_index)
+
+    def located(self):
+        "name: (index, leaf) for the names in the snapshot."
+        if self.name_index is None:
+            (self.name_index, self.name_copies) = ({}, {})
+            for leaf in self.iter_leaves():
+                for (name, position) in leaf.entries():
+                    self.index_name(name, leaf.prefix, leaf)
+        return self.name_index
+
+    def locate(self, name):
+        self.located()
+        return gqtree.GeneralizedQuadtree.locate(self, name)
+
+    def _insert(self, at_position, name, info=None):
+        raise NotImplementedError("snapshots are read only")
+
+    def remove(self, name):
+        raise NotImplementedError("snapshots are read only")
+
+    def move(self, name, at_position):
+        raise NotImplementedError("snapshots are read only")
+
+    def move_many(self, names, positions, rebuild_fraction=0.2):
+        raise NotImplementedError("snapshots are read only")
+
+class TreeSnapshot(ReadOnly, gqtree.GeneralizedQuadtree):
+    "Read only view of a tree with snapshots enabled, as it was when taken."
+
+    def __init__(self, tree):
+        root = tree.root
+        self.share(tree)
+        self.root = root
+
+class LinearSnapshot(ReadOnly, gqlinear.LinearQuadtree):
+    "Read only view of a linear quadtree with snapshots enabled, sharing its columns."
+
+    def __init__(self, tree):
+        self.share(tree)
+        # derive nodes reading the shared columns of this view
+        self.reset_root()
+
+    def add_points(self, positions, names, infos=None):
+        raise NotImplementedError("snapshots are read only")
+
+    def set_rows(self, indices, positions, names, infos):
+        raise NotImplementedError("snapshots are read only")
@@ -0,0 +1,159 @@
+"""
+Opt-in counters and timers for tree operations.
+
+GeneralizedQuadtree.enable_stats(hook) attaches a StatsRecorder.  The
+instrumented operations test tree.stats_recorder against None before
+doing any work for it, so a tree without a recorder pays one attribute
+test per operation (per level for add_at_min_penalty).
+
+The recorder keeps running totals, returned by snapshot():
+
+  counters       counts by name: int_index encodes, walk and adjacency_walk
+                 node visits, penalty function calls and evaluations,
+                 frontier nodes tested for expansion, ...
+  distributions  count, total, mean and max of observed values by name:
+                 combine_depth (nodes on the path to an added leaf) and
+                 frontier_size, overall and per level as frontier_size.<level>
+  seconds        wall clock seconds by operation or phase (expand and
+                 penalties of the descent, insert), with calls the number
+                 of times each was timed
+
+Each top level operation (add, add_at_min_penalty, walk, adjacency_walk)
+also collects an event dict of what happened during it: its seconds, the
+counts, the observed values (the largest, for repeats) and phase seconds.
+When it finishes, hook(operation, event) is called, e.g. to push the
+event to a metrics system.  Operations nested in another (the add of
+add_at_min_penalty) report their own event and add to the outer one.
+"""
+
+import collections
+import time
+
+class Distribution(object):
+    "Count, total and max of observed values."
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def summary(self):
+        mean = None
+        if self.count:
+            mean = self.total / float(self.count)
+        return {"count": self.count, "total": self.total, "mean": mean, "max": self.max}
+
+class _NullPhase(object):
+    "Context manager doing nothing, for phases of trees without a recorder."
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_PHASE = _NullPhase()
+
+class _Phase(object):
+    "Context manager adding its wall clock time to a recorder under name."
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.timed(self.name, time.time() - self.start)
+        return False
+
+class _Operation(_Phase):
+    "A phase which also collects an event for the hook."
+
+    def __enter__(self):
+        self.recorder.events.append({})
+        return _Phase.__enter__(self)
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        recorder = self.recorder
+        event = recorder.events.pop()
+        recorder.timed(self.name, elapsed)
+        event["seconds"] = elapsed
+        if recorder.hook is not None and exc_info[0] is None:
+            recorder.hook(self.name, event)
+        return False
+
+class StatsRecorder(object):
+    "Counters, distributions and timers of a tree's operations, with an optional hook."
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        # events of the operations in progress, outermost first
+        self.events = []
+        self.reset()
+
+    def reset(self):
+        "Zero the totals."
+        self.counters = collections.defaultdict(int)
+        self.distributions = collections.defaultdict(Distribution)
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+
+    def count(self, name, n=1):
+        "Add n to the counter name."
+        self.counters[name] += n
+        for event in self.events:
+            event[name] = event.get(name, 0) + n
+
+    def observe(self, name, value):
+        "Add value to the distribution name."
+        self.distributions[name].add(value)
+        for event in self.events:
+            if name not in event or value > event[name]:
+                event[name] = value
+
+    def timed(self, name, seconds):
+        "Add seconds to the timer name."
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+        key = name + "_seconds"
+        # an operation's own event gets its total as "seconds" instead
+        for event in self.events:
+            event[key] = event.get(key, 0.0) + seconds
+
+    def phase(self, name):
+        "Context manager timing a phase of an operation."
+        return _Phase(self, name)
+
+    def operation(self, name):
+        "Context manager timing an operation and reporting its event to the hook."
+        return _Operation(self, name)
+
+    def counted(self, name, nodes):
+        "Generate nodes, counting them under name."
+        count = 0
+        for node in nodes:
+            count += 1
+            yield node
+        self.count(name, count)
+
+    def snapshot(self):
+        "Dictionary of the totals (see the module docstring)."
+        return {
+            "counters": dict(self.counters),
+            "distributions": dict((name, distribution.summary())
+                                  for (name, distribution) in self.distributions.items()),
+            "seconds": dict(self.seconds),
+            "calls": dict(self.calls),
+        }
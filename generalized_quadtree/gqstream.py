@@ -0,0 +1,398 @@
+"""
+Streaming construction of saved quadtree files (see gqfile) from chunks of
+points that together do not fit in memory.
+
+StreamBuilder indexes each (positions, names) chunk as
+GeneralizedQuadtree.index_positions does, buffers rows up to a memory
+budget and spills them as runs sorted by index to temporary .npy columns.
+finish merges the runs block by block into the columns of the saved file,
+dropping earlier rows repeating a name at the same index as from_points
+does, and sorts the names the same way (external sort) for the name order.
+Only blocks of rows are held in memory at any time.
+
+build_file runs a builder over an iterable of chunks; npy_chunks and
+csv_chunks read chunks from files.
+"""
+
+from __future__ import print_function
+import heapq
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+from . import gqtree
+from . import gqfile
+import numpy as np
+
+# rough bytes per buffered row besides its index and position: the list
+# entry and name object.
+ROW_OVERHEAD = 64
+# and per (name, row) pair being sorted: the tuple, row and list entries.
+PAIR_OVERHEAD = 128
+
+class StreamBuilder(object):
+    """
+    Builder for a saved tree with the given parameters.  budget is the
+    approximate number of bytes of rows held in memory, not counting the
+    chunk being added.  progress(report) is called after each chunk with a
+    dict of the chunk number, its rows, seconds and rows per second, the
+    total rows so far and the number of spilled runs.
+    """
+
+    def __init__(self, origin, sidelength, levels, budget=256 << 20, directory=None, progress=None,
+                 kind="pointer"):
+        # a tree provides the indexing.
+        self.tree = gqtree.GeneralizedQuadtree(origin, sidelength, levels)
+        gqfile.check_index_bits(levels, self.tree.dimensions)
+        self.budget = budget
+        self.progress = progress
+        self.kind = kind
+        self.directory = tempfile.mkdtemp(dir=directory)
+        self.names_kind = None
+        # spilled runs, as paths of their column directories
+        self.runs = []
+        # buffered (indices, positions, names) pieces and their row count
+        self.pieces = []
+        self.buffered = 0
+        self.chunks = 0
+        self.rows = 0
+
+    def row_bytes(self, names):
+        "Estimated bytes held per row of names."
+        sizes = [len(name) for name in names[:100]] if self.names_kind != "int" else [0]
+        return 8 + 8 * self.tree.dimensions + ROW_OVERHEAD + int(np.mean(sizes or [0]))
+
+    def add(self, positions, names):
+        "Index a chunk of (N, dimensions) positions with N names, spilling runs as needed."
+        started = time.time()
+        positions = np.asarray(positions, dtype=float).reshape((-1, self.tree.dimensions))
+        names = list(names)
+        assert len(names) == len(positions), "positions and names differ in length"
+        if not names:
+            return
+        kind = gqfile.names_kind(names)
+        if self.names_kind is None:
+            if kind == "pickle":
+                raise ValueError("streamed names must all be int, str or unicode")
+            self.names_kind = kind
+        elif kind != self.names_kind:
+            raise ValueError("names of kind %s after names of kind %s" % (kind, self.names_kind))
+        indices = self.tree.index_positions(positions)[0].astype(np.uint64)
+        limit = max(1, self.budget // self.row_bytes(names))
+        start = 0
+        while start < len(names):
+            stop = min(len(names), start + max(1, limit - self.buffered))
+            self.pieces.append((indices[start:stop], positions[start:stop], names[start:stop]))
+            self.buffered += stop - start
+            if self.buffered >= limit:
+                self.spill()
+            start = stop
+        self.chunks += 1
+        self.rows += len(names)
+        if self.progress is not None:
+            seconds = time.time() - started
+            self.progress({"chunk": self.chunks, "rows": len(names), "seconds": seconds,
+                           "rate": len(names) / max(seconds, 1e-9), "total": self.rows,
+                           "runs": len(self.runs)})
+
+    def spill(self):
+        "Write the buffered rows as a run sorted by index."
+        if not self.pieces:
+            return
+        indices = np.concatenate([piece[0] for piece in self.pieces])
+        positions = np.concatenate([piece[1] for piece in self.pieces])
+        names = [name for piece in self.pieces for name in piece[2]]
+        order = np.argsort(indices, kind="mergesort")
+        columns = gqfile.name_columns([names[i] for i in order], self.names_kind)[1]
+        columns["indices"] = indices[order]
+        columns["positions"] = positions[order]
+        path = os.path.join(self.directory, "run%s" % len(self.runs))
+        save_columns(path, columns)
+        self.runs.append(path)
+        self.pieces = []
+        self.buffered = 0
+
+    def finish(self, path):
+        "Merge the runs into the saved file at path, returning its number of rows."
+        self.spill()
+        kind = self.names_kind or "int"
+        runs = [Run(run, kind) for run in self.runs]
+        # half the budget for blocks of the runs, half for sorting names.
+        row_bytes = 8 + 8 * self.tree.dimensions + ROW_OVERHEAD
+        block = max(1, self.budget // (2 * row_bytes * max(1, len(runs))))
+        output = os.path.join(self.directory, "output")
+        os.mkdir(output)
+        columns = ColumnWriter(output, kind)
+        names = NameSorter(os.path.join(self.directory, "names"), kind,
+                           max(1, self.budget // (2 * (row_bytes + PAIR_OVERHEAD))))
+        for (indices, positions, block_names) in merge_runs(runs, block):
+            (indices, positions, block_names) = drop_repeats(indices, positions, block_names)
+            names.add(block_names, columns.rows)
+            columns.write(indices, positions, block_names)
+        sections = columns.close(self.tree.dimensions)
+        sections["name_order"] = names.order(os.path.join(output, "name_order"))
+        tree = self.tree
+        gqfile.write_file(path, self.kind, tree.origin, tree.sidelength, tree.levels, columns.rows,
+                          kind, sections)
+        return columns.rows
+
+    def close(self):
+        "Remove the temporary files."
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def save_columns(path, columns):
+    "Save a dict of arrays as .npy files in a new directory."
+    os.mkdir(path)
+    for (name, array) in columns.items():
+        np.save(os.path.join(path, name + ".npy"), array)
+
+def load_columns(path):
+    "Memory mapped arrays saved by save_columns."
+    return dict((name[:-len(".npy")], np.load(os.path.join(path, name), mmap_mode="r"))
+                for name in os.listdir(path))
+
+
+class Run(object):
+    "Sorted run read a block at a time."
+
+    def __init__(self, path, kind):
+        columns = load_columns(path)
+        self.indices = columns["indices"]
+        self.positions = columns["positions"]
+        self.names = gqfile.MappedNames(kind, columns)
+        self.next = 0
+
+    def remaining(self):
+        return len(self.indices) - self.next
+
+    def read(self, rows):
+        "(indices, positions, names) of the next rows of the run."
+        (start, stop) = (self.next, min(self.next + rows, len(self.indices)))
+        self.next = stop
+        return (np.array(self.indices[start:stop]), np.array(self.positions[start:stop]),
+                self.names[start:stop])
+
+def merge_runs(runs, block):
+    """
+    Generate (indices, positions, names) blocks of all rows of the runs in
+    index order, rows with equal indices in run order.  Every block holds
+    all the rows of each index in it.
+    """
+    buffers = [run.read(block) for run in runs]
+    while True:
+        # rows below the least last index of a run with more to read are final.
+        pending = [i for (i, run) in enumerate(runs) if run.remaining()]
+        if pending:
+            limit = min(buffers[i][0][-1] if len(buffers[i][0]) else 0 for i in pending)
+        taken = []
+        for (i, (indices, positions, names)) in enumerate(buffers):
+            count = len(indices)
+            if pending:
+                count = int(indices.searchsorted(limit, side="left"))
+            if count:
+                taken.append((indices[:count], positions[:count], names[:count]))
+                buffers[i] = (indices[count:], positions[count:], names[count:])
+        if taken:
+            indices = np.concatenate([piece[0] for piece in taken])
+            order = np.argsort(indices, kind="mergesort")
+            positions = np.concatenate([piece[1] for piece in taken])
+            names = [name for piece in taken for name in piece[2]]
+            yield (indices[order], positions[order], [names[i] for i in order])
+        elif not pending:
+            return
+        # read more where a buffer ran out or holds only the limit index.
+        for i in pending:
+            (indices, positions, names) = buffers[i]
+            if not len(indices) or indices[0] == limit:
+                (more_indices, more_positions, more_names) = runs[i].read(block)
+                buffers[i] = (np.concatenate((indices, more_indices)),
+                              np.concatenate((positions, more_positions)), names + more_names)
+
+def drop_repeats(indices, positions, names):
+    "Drop all but the last row of each name repeated at one index."
+    repeated = np.flatnonzero(indices[1:] == indices[:-1])
+    if not len(repeated):
+        return (indices, positions, names)
+    keep = np.ones(len(names), dtype=bool)
+    starts = np.flatnonzero(np.concatenate(([True], indices[1:] != indices[:-1])))
+    stops = np.concatenate((starts[1:], [len(names)]))
+    for (start, stop) in zip(starts, stops):
+        if stop - start > 1:
+            seen = set()
+            for row in range(stop - 1, start - 1, -1):
+                if names[row] in seen:
+                    keep[row] = False
+                seen.add(names[row])
+    rows = np.flatnonzero(keep)
+    return (indices[rows], positions[rows], [names[row] for row in rows])
+
+
+class ColumnWriter(object):
+    "Raw column files of the merged rows, appended a block at a time."
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.rows = 0
+        self.name_bytes = 0
+        self.files = {}
+        sections = ["indices", "positions"]
+        if kind == "int":
+            sections.append("names")
+        else:
+            sections.extend(["name_offsets", "name_bytes"])
+        for section in sections:
+            self.files[section] = open(os.path.join(path, section), "wb")
+        if kind != "int":
+            self.files["name_offsets"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def write(self, indices, positions, names):
+        files = self.files
+        files["indices"].write(indices.astype(np.uint64).tobytes())
+        files["positions"].write(np.ascontiguousarray(positions, dtype=float).tobytes())
+        columns = gqfile.name_columns(names, self.kind)[1]
+        if self.kind == "int":
+            files["names"].write(columns["names"].tobytes())
+        else:
+            files["name_offsets"].write((columns["name_offsets"][1:] + self.name_bytes).tobytes())
+            files["name_bytes"].write(columns["name_bytes"].tobytes())
+            self.name_bytes += len(columns["name_bytes"])
+        self.rows += len(names)
+
+    def close(self, dimensions):
+        "Memory mapped sections of the written columns."
+        for f in self.files.values():
+            f.close()
+        shapes = {
+            "indices": (np.uint64, (self.rows,)),
+            "positions": (float, (self.rows, dimensions)),
+            "names": (np.int64, (self.rows,)),
+            "name_offsets": (np.int64, (self.rows + 1,)),
+            "name_bytes": (np.uint8, (self.name_bytes,)),
+        }
+        return dict((section, mapped(os.path.join(self.path, section), *shapes[section]))
+                    for section in self.files)
+
+def mapped(path, dtype, shape):
+    "Read only memory map of a raw column file (an empty array if it is empty)."
+    if not np.prod(shape):
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class NameSorter(object):
+    "External sort of (name, row) pairs giving the row order of the sorted names."
+
+    def __init__(self, path, kind, limit):
+        self.path = path
+        self.kind = kind
+        self.limit = limit
+        # buffered (names, first row) pieces and their row count
+        self.pieces = []
+        self.buffered = 0
+        self.runs = []
+        os.mkdir(path)
+
+    def add(self, names, first_row):
+        self.pieces.append((names, first_row))
+        self.buffered += len(names)
+        if self.buffered >= self.limit:
+            self.spill()
+
+    def spill(self):
+        if not self.pieces:
+            return
+        names = [name for (piece, first_row) in self.pieces for name in piece]
+        rows = np.concatenate([np.arange(first_row, first_row + len(piece), dtype=np.int64)
+                               for (piece, first_row) in self.pieces])
+        # rows ascend, so stable sorts keep equal names in row order
+        if self.kind == "int":
+            order = np.argsort(np.array(names, dtype=np.int64), kind="mergesort")
+        else:
+            order = np.array(sorted(range(len(names)), key=names.__getitem__), dtype=np.int64)
+        columns = gqfile.name_columns([names[i] for i in order], self.kind)[1]
+        columns["rows"] = rows[order]
+        path = os.path.join(self.path, "run%s" % len(self.runs))
+        save_columns(path, columns)
+        self.runs.append(path)
+        self.pieces = []
+        self.buffered = 0
+
+    def pairs_of(self, path, block):
+        "Generate the (name, row) pairs of a run, reading a block at a time."
+        columns = load_columns(path)
+        names = gqfile.MappedNames(self.kind, columns)
+        rows = columns["rows"]
+        for start in range(0, len(rows), block):
+            for pair in itertools.izip(names[start:start + block], rows[start:start + block].tolist()):
+                yield pair
+
+    def order(self, path):
+        "Write the rows in name order to a raw column file at path, returning its memory map."
+        self.spill()
+        block = max(1, self.limit // max(1, len(self.runs)))
+        merged = heapq.merge(*[self.pairs_of(run, block) for run in self.runs])
+        count = 0
+        with open(path, "wb") as f:
+            while True:
+                rows = [row for (name, row) in itertools.islice(merged, block)]
+                if not rows:
+                    break
+                f.write(np.array(rows, dtype=np.int64).tobytes())
+                count += len(rows)
+        return mapped(path, np.int64, (count,))
+
+
+def build_file(chunks, path, origin, sidelength, levels, budget=256 << 20, directory=None,
+               progress=None, kind="pointer"):
+    """
+    Save the tree of all (positions, names) chunks to path with a
+    StreamBuilder, returning the number of rows.
+    """
+    builder = StreamBuilder(origin, sidelength, levels, budget, directory, progress, kind)
+    try:
+        for (positions, names) in chunks:
+            builder.add(positions, names)
+        return builder.finish(path)
+    finally:
+        builder.close()
+
+def print_progress(report):
+    "progress callback printing one line per chunk to stderr."
+    print("chunk %(chunk)s: %(rows)s rows in %(seconds).2fs (%(rate).0f rows/s), "
+          "%(total)s rows, %(runs)s runs" % report, file=sys.stderr)
+
+def npy_chunks(paths, rows=1000000):
+    """
+    (positions, names) chunks of rows points from .npy files of (N, dimensions)
+    positions, named by their number across the files.
+    """
+    first = 0
+    for path in paths:
+        positions = np.load(path, mmap_mode="r")
+        for start in range(0, len(positions), rows):
+            chunk = np.array(positions[start:start + rows], dtype=float)
+            yield (chunk, range(first, first + len(chunk)))
+            first += len(chunk)
+
+def csv_chunks(path, rows=1000000, name_column=None, delimiter=","):
+    """
+    (positions, names) chunks of rows lines of a delimited file of coordinates.
+    Names are the strings in name_column, or the line numbers.
+    """
+    first = 0
+    with open(path) as f:
+        while True:
+            lines = list(itertools.islice(f, rows))
+            if not lines:
+                return
+            fields = [line.rstrip("\r\n").split(delimiter) for line in lines]
+            if name_column is None:
+                names = range(first, first + len(lines))
+            else:
+                names = [row.pop(name_column) for row in fields]
+            yield (np.array(fields, dtype=float), names)
+            first += len(lines)
@@ -1,13 +1,21 @@
 
 # Todo:
-#  GraphQuadTree
-#  centroid and names accumulation at nodes
 #  node distance to point
-#  add graph node heuristic
 #  node attraction heuristic
 
 from . import gqnodes
+from . import gqquery
+from . import gqaggregate
+from . import gqdual
+from . import gqneighbors
+from . import gqmorton
+from .gqmorton import dilation_tables
+from . import gqstats
+from . import gqcache
+import bisect
+import collections
 import pprint
+import operator
 import numpy as np
 from numpy.linalg import norm
 
@@ -21,7 +29,7 @@ def qs(index, levels, dimensions=2):
 
 class GeneralizedQuadtree:
 
-    def __init__(self, origin, sidelength, levels):
+    def __init__(self, origin, sidelength, levels, compact=False):
         self.root = None
         # minimum position of the volume
         self.origin = np.array(origin)
@@ -39,42 +47,151 @@ class GeneralizedQuadtree:
         self.nquadrants1 = self.nquadrants - 1
         # side length of a voxel
         self.min_side = float(sidelength) / self.int_side
+        # side length of the quadrants at each level
+        self.level_sides = [float(sidelength) / 2 ** level for level in range(levels + 1)]
+        # int position offsets of quadrants, by level (see quadrant_offsets)
+        self._quadrant_offsets = {}
+        # use slotted nodes with quadrant-indexed children (see gqnodes.Compact*)
+        self.compact = compact
+        # reducers for node aggregates, by name (see gqaggregate)
+        self.reducers = {}
+        # name: (index, leaf) of the voxel where the name was last added
+        self.name_index = {}
+        # name: indices of the voxels holding the other copies of a name
+        # added at more than one voxel, the latest last
+        self.name_copies = {}
+        # optional gqneighbors.NeighborIndex (see enable_neighbor_index)
+        self.neighbor_index = None
+        # optional gqstats.StatsRecorder (see enable_stats)
+        self.stats_recorder = None
+        # optional gqcache.QueryCache (see enable_query_cache)
+        self.query_cache = None
+        # update by path copying, leaving published nodes unchanged (see enable_snapshots)
+        self.persistent = False
 
     def quadrant_indices(self, index, level):
         """
         Sequence of quadrant indices at the next level below index.
         """
-        dimensions = self.dimensions
-        levels = self.levels
-        shift = dimensions * (levels - (level + 1))
-        assert shift >= 0, "no quadrants below leaf level " + repr((levels, level))
-        # Low order bits should be zeros
-        assert (index << (shift + dimensions)) & ((1 << (levels * dimensions)) - 1) == 0, (
-            "bad index " + repr((index, level, shift, self.qs(index)))
-        )
-        step = 1 << shift
-        limit = (self.nquadrants << shift) + index
-        return xrange(index, limit, step)
+        return gqmorton.children(index, self.levels, self.dimensions, level)
 
     def walk(self, callback, data=None):
         "walk reverse breadth first passing (node, tree, data) to callback."
+        recorder = self.stats_recorder
+        if recorder is not None:
+            with recorder.operation("walk"):
+                for node in recorder.counted("walk_nodes", self.iter_nodes("post")):
+                    callback(node, self, data)
+            return
+        for node in self.iter_nodes("post"):
+            callback(node, self, data)
+
+    def iter_nodes(self, order="post"):
+        """
+        Iterator over the nodes, children before their parent (post), parents
+        before their children (pre) or level by level (bfs).
+        """
+        return gqnodes.iter_nodes(self.root, order)
+
+    def iter_leaves(self):
+        "Iterator over the leaves, in walk order."
+        if self.root is None:
+            return iter(())
+        return gqnodes.iter_leaves(self.root)
+
+    def iter_adjacent(self, position):
+        "Iterator over the nodes adjacency_walk visits for position."
         if self.root is None:
-            return   # Do nothing if tree is empty.
-        self.root.walk(self, callback, data)
+            return iter(())
+        if self.query_cache is not None:
+            return iter(self.query_cache.adjacent(position))
+        if self.neighbor_index is not None:
+            return self.neighbor_index.iter_adjacent(self.index(position))
+        return gqnodes.iter_adjacent(self, self.root, self.int_position(position))
+
+    def enable_stats(self, hook=None):
+        """
+        Record counters and timers of tree operations, calling
+        hook(operation, event) after each (see gqstats).
+        """
+        self.stats_recorder = gqstats.StatsRecorder(hook)
+        return self.stats_recorder
+
+    def disable_stats(self):
+        "Stop recording stats."
+        self.stats_recorder = None
+
+    def stats(self):
+        "Snapshot of the recorded stats, or None unless enabled."
+        if self.stats_recorder is None:
+            return None
+        return self.stats_recorder.snapshot()
+
+    def phase(self, name):
+        "Context manager timing a phase of an operation when recording stats."
+        if self.stats_recorder is None:
+            return gqstats.NULL_PHASE
+        return self.stats_recorder.phase(name)
+
+    def enable_query_cache(self, max_entries=1024, max_bytes=None):
+        """
+        Keep the results of adjacency walks, query_box and quadrant_names in a
+        least recently used cache of at most max_entries entries (and
+        max_bytes, if given), dropped as updates change them (see gqcache).
+        """
+        self.query_cache = gqcache.QueryCache(self, max_entries, max_bytes)
+        return self.query_cache
+
+    def disable_query_cache(self):
+        "Stop caching query results."
+        self.query_cache = None
+
+    def enable_snapshots(self):
+        """
+        Update by path copying: add and remove copy the nodes on the path to
+        the changed voxel instead of changing them, and then replace the
+        root, so the nodes reachable from any earlier root never change and
+        snapshot can share them.  The copies drop the names and aggregates
+        cached on the nodes they replace, which are recomputed on demand.
+        """
+        self.persistent = True
+
+    def snapshot(self):
+        """
+        Read only view of the tree as it is now, sharing its nodes (see
+        gqsnapshot).  Taking it costs the same for any size of tree, and it
+        can be queried from other threads while this tree is updated.
+        """
+        if not self.persistent:
+            raise ValueError("snapshot needs enable_snapshots")
+        from . import gqsnapshot
+        return gqsnapshot.TreeSnapshot(self)
+
+    def enable_neighbor_index(self):
+        "Index the neighbours of every node, kept current by add and remove (see gqneighbors)."
+        self.neighbor_index = gqneighbors.NeighborIndex(self)
+        return self.neighbor_index
+
+    def neighbors(self, node):
+        """
+        List of the nodes at the same or a coarser level, other than ancestors,
+        adjacent at their level to the quadrant holding node (see gqneighbors).
+        """
+        if self.neighbor_index is not None:
+            return self.neighbor_index.neighbors_of(node)
+        return gqneighbors.neighbors(self, node)
 
     def adjacent(self, index1, index2, level, pos1=None, pos2=None):
         """
         Test whether quadrants at level containing indices have abs
-        common border or vertex.
+        common border or vertex.  (pos1 and pos2, the int positions, are
+        no longer needed: the test is on the indices.)
         """
-        shift = self.levels - level
-        if pos1 is None:
-            pos1 = self.index_to_index_position(index1)
-        if pos2 is None:
-            pos2 = self.index_to_index_position(index2)
-        level_offset = (pos1 >> shift) - (pos2 >> shift)
-        max_offset = np.max(np.abs(level_offset))
-        return max_offset <= 1
+        if self.neighbor_index is not None:
+            found = self.neighbor_index.adjacent(index1, index2, level)
+            if found is not None:
+                return found
+        return gqmorton.adjacent(index1, index2, self.levels, self.dimensions, level)
 
     def adjacency_walk(self, position, callback, data=None):
         """
@@ -84,50 +201,190 @@ class GeneralizedQuadtree:
         the quadrant containing position.
         call callback(position, node, tree, data) at non-recursed nodes.
         """
+        recorder = self.stats_recorder
+        if recorder is not None:
+            with recorder.operation("adjacency_walk"):
+                for node in recorder.counted("adjacency_walk_nodes", self.iter_adjacent(position)):
+                    callback(position, node, self, data)
+            return
+        for node in self.iter_adjacent(position):
+            callback(position, node, self, data)
+
+    def nearest(self, position, k=1, metric="l2"):
+        "The k names nearest to position as (names, positions, distances)."
+        return gqquery.nearest(self, position, k, metric)
+
+    def within(self, position, radius, metric="l2"):
+        "Names within radius of position as (names, positions, distances)."
+        return gqquery.within(self, position, radius, metric)
+
+    def nearest_many(self, positions, k=1, metric="l2"):
+        "nearest for each row of an (M, dimensions) array of positions."
+        return gqquery.nearest_many(self, positions, k, metric)
+
+    def within_many(self, positions, radius, metric="l2"):
+        "within for each row of an (M, dimensions) array of positions."
+        return gqquery.within_many(self, positions, radius, metric)
+
+    def query_box(self, lower, upper):
+        "Set of names with positions in the box lower <= position <= upper."
+        if self.query_cache is not None:
+            return self.query_cache.query_box(lower, upper)
+        return gqquery.query_box(self, lower, upper)
+
+    def query_boxes(self, lowers, uppers):
+        "query_box for each pair of rows of (M, dimensions) corner arrays."
+        if self.query_cache is not None:
+            return [self.query_box(lower, upper) for (lower, upper) in zip(lowers, uppers)]
+        return gqquery.query_boxes(self, lowers, uppers)
+
+    def quadrant_names(self, position, level):
+        "Set of the names in the quadrant at level holding position."
+        if self.query_cache is not None:
+            return self.query_cache.quadrant_names(position, level)
+        prefix = gqmorton.ancestor(self.index(position), self.levels, self.dimensions, level)
+        return self.names_in_quadrant(prefix, level)
+
+    def names_in_quadrant(self, prefix, level):
+        "Set of the names in the quadrant at level with prefix."
+        (levels, dimensions) = (self.levels, self.dimensions)
+        node = self.root
+        while node is not None:
+            node_level = gqneighbors.node_level(self, node)
+            if node_level >= level:
+                # the only node in the quadrant, if inside it
+                if gqmorton.ancestor(node.prefix, levels, dimensions, level) == prefix:
+                    return node.get_names()
+                break
+            if gqmorton.ancestor(prefix, levels, dimensions, node_level) != node.prefix:
+                break
+            node = node.children.get(self.quadrant(prefix, node_level + 1)[1])
+        return set()
+
+    def all_nearest(self, k=1, other=None, metric="l2"):
+        "The k nearest names in other (or this tree) to every name, as name: (names, distances)."
+        return gqdual.all_nearest(self, k, other, metric)
+
+    def within_pairs(self, radius, other=None, metric="l2"):
+        "(name, other name, distance) for entries of this tree and other (or this tree) within radius."
+        return gqdual.within_pairs(self, radius, other, metric)
+
+    def spatial_join(self, other, radius, metric="l2"):
+        "Names of other within radius of each name, as name: [(other name, distance)]."
+        return gqdual.spatial_join(self, other, radius, metric)
+
+    def add_reducer(self, reducer):
+        "Register a gqaggregate.Reducer for node.get_aggregate(tree, reducer.name)."
+        assert reducer.name not in self.reducers, "reducer already registered " + repr(reducer.name)
+        self.reducers[reducer.name] = reducer
+
+    def get_aggregate(self, name):
+        "Aggregate name over the whole tree, or None if it is empty."
         if self.root is None:
             return None
-        iposition = self.int_position(position)
-        #print "iposition", iposition
-        self.root.adjacency_walk(self, callback, data, position, iposition)
+        return self.root.get_aggregate(self, name)
+
+    def field(self, position, kernel=gqaggregate.inverse_square, theta=0.5, mass="count",
+              centroid="centroid"):
+        "Barnes-Hut approximation of kernel summed over all entries at position."
+        return gqaggregate.field(self, position, kernel, theta, mass, centroid)
+
+    def field_many(self, positions, kernel=gqaggregate.inverse_square, theta=0.5, mass="count",
+                   centroid="centroid"):
+        "field at each row of an (M, dimensions) array."
+        return gqaggregate.field_many(self, positions, kernel, theta, mass, centroid)
 
-    def index_corner(self, index):
-        voxels = int_index_inverse(index, self.levels, self.dimensions)
+    def index_corner(self, index, level=None):
+        "Minimum position of the quadrant at level (default leaf level) containing index."
+        voxels = gqmorton.coordinates(index, self.levels, self.dimensions, level)
         return np.array(voxels) * self.min_side + self.origin
 
     def level_side(self, level):
-        return self.sidelength / float(2 ** level)
+        "Side length of the quadrants at level."
+        return self.level_sides[level]
+
+    def node_geometry(self, node):
+        """
+        (3, dimensions) array of the lower corner, upper corner and center of
+        the quadrant of node, computed once for interior nodes.
+        """
+        level = node.level
+        if level is None:
+            return self.quadrant_geometry(self.index_to_index_position(node.prefix), self.levels)
+        geometry = node._geometry
+        if geometry is None:
+            geometry = self.quadrant_geometry(self.node_int_position(node), level)
+            node._geometry = geometry
+        return geometry
+
+    def quadrant_geometry(self, ipos, level):
+        "node_geometry of the quadrant at level with int position ipos."
+        lower = ipos * self.min_side + self.origin
+        side = self.level_sides[level]
+        return np.array([lower, lower + side, lower + 0.5 * side])
+
+    def quadrant_boxes(self, indices, levels):
+        """
+        (lowers, sides) of the quadrants at levels with prefixes indices:
+        (N, dimensions) lower corners and N side lengths.
+        """
+        levels = np.asarray(levels, dtype=int)
+        ipos = int_index_inverse_array(indices, self.levels, self.dimensions)
+        lowers = ipos * self.min_side + self.origin
+        sides = np.array(self.level_sides)[levels]
+        return (lowers, sides)
+
+    def quadrant_lower(self, index):
+        "List of the coordinates of the lower corner of the voxel index."
+        min_side = self.min_side
+        return [origin + min_side * voxels for (origin, voxels) in
+                zip(self.origin.tolist(), gqmorton.coordinates(index, self.levels, self.dimensions))]
 
     def avg_dist_to_quadrant_point(self, index, level, location):
         "Heuristic average L1 distance to a point in the quadrant from location."
-        side = self.level_side(level)
-        corner = self.index_corner(index)
-        ur_corner = corner + side
-        location = np.array(location)
-        offset = max(0, max(corner - location), max(location - ur_corner))
+        side = self.level_sides[level]
+        offset = 0
+        for (corner, x) in zip(self.quadrant_lower(index), location):
+            offset = max(offset, corner - x, x - (corner + side))
         return offset + side/2.0
 
     def avg_dist_between_quadrants(self, index1, level1, index2, level2):
         """
         Heuristic L1 distance between two points in quadrants.
         """
-        side1 = self.level_side(level1)
-        side2 = self.level_side(level2)
-        corner1 = self.index_corner(index1)
-        corner2 = self.index_corner(index2)
-        ur_corner1 = corner1 + side1
-        ur_corner2 = corner2 + side2
+        side1 = self.level_sides[level1]
+        side2 = self.level_sides[level2]
         offset = 0  # default
         intersecting = True
-        for index in (0, 1):
-            d1 = corner1[index] - ur_corner2[index]
-            d2 = corner2[index] - ur_corner1[index]
+        for (corner1, corner2) in zip(self.quadrant_lower(index1), self.quadrant_lower(index2)):
+            d1 = corner1 - (corner2 + side2)
+            d2 = corner2 - (corner1 + side1)
             if d1 >= 0 or d2 >= 0:
                 intersecting = False
-            offset = max(offset, corner1[index] - ur_corner2[index], corner2[index] - ur_corner1[index])
+            offset = max(offset, d1, d2)
         if intersecting:
             return 0.5 * max(side1, side2)
         return offset + 0.5 * (side1 + side2)
 
+    def avg_dists_to_quadrant_points(self, indices, levels, locations):
+        "avg_dist_to_quadrant_point for arrays of indices and levels and (N, dimensions) locations."
+        (lowers, sides) = self.quadrant_boxes(indices, levels)
+        locations = np.asarray(locations, dtype=float)
+        uppers = lowers + sides[:, np.newaxis]
+        offsets = np.maximum(np.maximum(lowers - locations, locations - uppers).max(axis=1), 0)
+        return offsets + sides / 2.0
+
+    def avg_dists_between_quadrants(self, indices1, levels1, indices2, levels2):
+        "avg_dist_between_quadrants for arrays of indices and levels."
+        (lowers1, sides1) = self.quadrant_boxes(indices1, levels1)
+        (lowers2, sides2) = self.quadrant_boxes(indices2, levels2)
+        gaps = np.maximum(lowers1 - (lowers2 + sides2[:, np.newaxis]),
+                          lowers2 - (lowers1 + sides1[:, np.newaxis]))
+        intersecting = (gaps < 0).all(axis=1)
+        offsets = np.maximum(gaps.max(axis=1), 0)
+        return np.where(intersecting, 0.5 * np.maximum(sides1, sides2),
+                        offsets + 0.5 * (sides1 + sides2))
+
     def ppnode(self, node):
         pprint.pprint(node.list_dump(self))
 
@@ -145,77 +402,444 @@ class GeneralizedQuadtree:
             return None
         return root.list_dump(self)
 
-    def add(self, at_position, name, info=None):
+    def new_interior(self, prefix, level):
+        "Empty interior node for the quadrant at level with prefix."
+        if self.compact:
+            return gqnodes.CompactInteriorNode(prefix, level, self.nquadrants)
+        return gqnodes.QtInteriorNode(prefix, level)
+
+    def new_leaf(self, pos_index, at_position, name, info=None):
+        "Leaf node at pos_index holding name with a copy of info."
+        if self.compact:
+            if info:
+                assert "position" not in info, "position dict key is reserved " + repr(info)
+                info = info.copy()
+            return gqnodes.CompactLeafNode(pos_index, name, at_position, info or None)
         if info is None:
             info = {}
-        (pos_index, int_pos) = self.index_position(at_position)
         info = info.copy()
         assert "position" not in info, "position dict key is reserved " + repr(info)
         info["position"] = at_position
-        leaf = gqnodes.QtLeafNode(pos_index, name, info)
+        return gqnodes.QtLeafNode(pos_index, name, info)
+
+    def add(self, at_position, name, info=None):
+        recorder = self.stats_recorder
+        if recorder is not None:
+            with recorder.operation("add"):
+                pos_index = self._insert(at_position, name, info)
+                recorder.observe("combine_depth", len(self.containing_path(pos_index)))
+            return
+        self._insert(at_position, name, info)
+
+    def _insert(self, at_position, name, info=None):
+        "add without recording stats, returning the index of the voxel."
+        (pos_index, int_pos) = self.index_position(at_position)
+        leaf = self.new_leaf(pos_index, at_position, name, info)
+        cache = self.query_cache
+        if cache is not None:
+            (old_root, old_path) = (self.root, self.containing_path(pos_index))
+        # combine re-indexes name if the leaf merges into one already there.
+        self.index_name(name, pos_index, leaf)
         self.root = self.combine(self.root, leaf)
+        if self.neighbor_index is not None:
+            self.neighbor_index.added(pos_index)
+        if cache is not None:
+            cache.added(pos_index, old_path, old_root)
+        return pos_index
 
-    def add_at_min_penalty(self, node_penalty_fn, name, info=None, initial_penalty_fn=None, normalize=None):
-        
-        # p "insert", (name, info)
-        root = self.root
+    def index_name(self, name, index, leaf):
+        """
+        Index name to leaf at index.  A copy of name at another voxel stays in
+        the tree, and its index is kept in name_copies; a copy at the same
+        voxel was replaced by the new one.
+        """
+        located = self.name_index.get(name)
+        if located is not None and located[0] != index:
+            copies = self.name_copies.setdefault(name, [])
+            copies.append(located[0])
+            if index in copies:
+                copies.remove(index)
+        self.name_index[name] = (index, leaf)
+
+    def relink(self, index, leaf, entries):
+        "Index the names of entries indexed at index to leaf, a new node there."
+        name_index = self.name_index
+        for (name, position) in entries:
+            if name_index[name][0] == index:
+                name_index[name] = (index, leaf)
+
+    def unindex(self, name):
+        "Drop name from name_index after its indexed copy was removed, indexing its latest other copy."
+        del self.name_index[name]
+        copies = self.name_copies.get(name)
+        if copies is not None:
+            index = copies.pop()
+            if not copies:
+                del self.name_copies[name]
+            self.name_index[name] = (index, self.containing_path(index)[-1])
+
+    def __contains__(self, name):
+        return name in self.name_index
+
+    def size(self):
+        "Number of names in the tree."
+        return len(self.name_index)
+
+    def locate(self, name):
+        "(index, leaf) of the voxel holding name."
+        located = self.name_index.get(name)
+        if located is None:
+            raise ValueError("name not in tree " + repr(name))
+        return located
+
+    def position_of(self, name):
+        "Position of name."
+        (index, leaf) = self.locate(name)
+        for (entry_name, position) in leaf.entries():
+            if entry_name == name:
+                return position
+
+    def remove(self, name):
+        """
+        Remove name from the voxel where it was last added, returning its
+        (position, info).  Interior nodes left with one child are replaced by
+        the child, keeping the tree compressed as combine builds it.  Cached
+        names above are repaired and cached aggregates dropped; the cached
+        int positions only depend on the prefix and stay valid.  With
+        enable_snapshots the nodes on the path are copied instead.
+        """
+        (index, leaf) = self.locate(name)
+        old_root = self.root
+        path = self.containing_path(index)
+        assert path[-1] is leaf, "indexed leaf not in tree " + repr(name)
+        persistent = self.persistent
+        if persistent:
+            leaf = leaf.copy()
+        result = leaf.remove(name)
+        replacement = leaf
+        if leaf.size() == 0:
+            replacement = None
+        elif persistent:
+            self.relink(index, leaf, leaf.entries())
+        # other copies of name stay in the cached names of the nodes above them
+        copies = self.name_copies.get(name, ())
+        for i in range(len(path) - 2, -1, -1):
+            node = path[i]
+            if persistent:
+                node = node.copy()
+            if replacement is not path[i + 1]:
+                node.set_child(self.quadrant(index, node.level + 1)[1], replacement)
+            node.removed(name, any(
+                gqmorton.ancestor(copy, self.levels, self.dimensions, node.level) == node.prefix
+                for copy in copies))
+            children = node.child_nodes()
+            if len(children) == 1:
+                # compress the path through a node with one child left.
+                replacement = children[0]
+            elif children:
+                replacement = node
+            else:
+                replacement = None
+        self.root = replacement
+        self.unindex(name)
+        if self.neighbor_index is not None:
+            self.neighbor_index.removed(path, index)
+            if persistent:
+                self.neighbor_index.added(index)
+        if self.query_cache is not None:
+            self.query_cache.removed(index, path, old_root)
+        return result
+
+    def move(self, name, at_position):
+        "Relocate name to at_position keeping its info, as remove then add."
+        (index, leaf) = self.locate(name)
+        new_index = self.index(at_position)
+        if index == new_index and not self.persistent:
+            # same voxel: update the position in place, only aggregates change.
+            for node in self.containing_path(index)[:-1]:
+                node._aggregates = None
+            (position, info) = leaf.remove(name)
+            leaf.add_leaf(self.new_leaf(index, at_position, name, info))
+            if self.query_cache is not None:
+                self.query_cache.changed(index)
+            return
+        (position, info) = self.remove(name)
+        self.add(at_position, name, info)
+
+    def move_many(self, names, positions, rebuild_fraction=0.2):
+        """
+        move each name to the matching row of an (N, dimensions) array.  When
+        more than rebuild_fraction of the indexed names move, the tree is
+        rebuilt in bulk (as from_points) instead, which is faster than moving
+        them one at a time.
+        """
+        positions = np.asarray(positions, dtype=float)
+        name_index = self.name_index
+        if len(names) <= rebuild_fraction * len(name_index):
+            for (name, position) in zip(names, positions):
+                self.move(name, position)
+            return
+        moved = {}
+        for (i, name) in enumerate(names):
+            if name not in name_index:
+                raise ValueError("name not in tree " + repr(name))
+            moved[name] = i
+        all_names = []
+        all_positions = []
+        all_infos = []
+        for node in self.iter_leaves():
+            for (name, position, info) in node.records():
+                if name in moved and name_index[name][1] is node:
+                    position = positions[moved[name]]
+                if info and "position" in info:
+                    info = dict(info)
+                    del info["position"]
+                all_names.append(name)
+                all_positions.append(position)
+                all_infos.append(info)
+        self.name_index = {}
+        self.name_copies = {}
+        (indices, leaves) = self.sorted_leaves(all_positions, all_names, all_infos)
+        self.root = self.build_from_sorted(indices, leaves)
+        if self.neighbor_index is not None:
+            self.neighbor_index.rebuild()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def save(self, path):
+        "Write the tree to a single file, read back by gqfile.load (see gqfile.save)."
+        from . import gqfile
+        gqfile.save(self, path)
+
+    def query_pool(self, workers=None, share="fork"):
+        "Process pool for sharded batched queries on this tree (see gqparallel.QueryPool)."
+        from . import gqparallel
+        return gqparallel.QueryPool(self, workers, share)
+
+    @classmethod
+    def from_points(cls, origin, sidelength, levels, positions, names, infos=None,
+                    compact=False, workers=None):
+        """
+        Bulk constructor: the tree produced by add(positions[i], names[i], infos[i])
+        for each i in order, built by sorting indices instead of repeated combine.
+        With workers, subtrees are built in that many processes (see gqparallel).
+        """
+        if workers is not None:
+            from . import gqparallel
+            return gqparallel.from_points(cls, origin, sidelength, levels, positions, names,
+                                          infos, compact, workers)
+        tree = cls(origin, sidelength, levels, compact)
+        (indices, leaves) = tree.sorted_leaves(positions, names, infos)
+        tree.root = tree.build_from_sorted(indices, leaves)
+        return tree
+
+    def sorted_leaves(self, positions, names, infos=None):
+        """
+        Index all positions in one vectorized pass and merge colliding points.
+        Returns (strictly increasing indices, leaf for each index).
+        """
+        npoints = len(names)
+        assert len(positions) == npoints, "positions and names differ in length"
+        if npoints == 0:
+            return (np.zeros(0, dtype=index_dtype(self.levels, self.dimensions)), [])
+        (indices, int_positions) = self.index_positions(positions)
+        # stable sort so that later points win name collisions, as in add.
+        order = np.argsort(indices, kind="mergesort")
+        indices = indices[order]
+        starts = np.flatnonzero(indices[1:] != indices[:-1]) + 1
+        run_index = np.zeros(npoints, dtype=int)
+        run_index[starts] = 1
+        run_index = np.cumsum(run_index)
+        leaves = []
+        for (i, point) in enumerate(order):
+            info = None
+            if infos is not None:
+                info = infos[point]
+            if len(leaves) == run_index[i]:
+                leaves.append(self.new_leaf(int(indices[i]), positions[point], names[point], info))
+            else:
+                leaves[-1].add_leaf(self.new_leaf(int(indices[i]), positions[point], names[point], info))
+        unique_indices = indices[np.concatenate(([0], starts))]
+        return (unique_indices, leaves)
+
+    def build_from_sorted(self, indices, leaves):
+        """
+        Root of the compressed tree over leaves with strictly increasing indices,
+        built bottom up from the common prefix levels of neighbouring indices.
+        A name in several leaves is indexed in the last of them.
+        """
+        if not leaves:
+            return None
+        for leaf in leaves:
+            for (name, position) in leaf.entries():
+                self.index_name(name, leaf.prefix, leaf)
+        return self.join_sorted(indices, leaves)
+
+    def join_sorted(self, indices, nodes):
+        """
+        Root of the compressed tree over disjoint nodes in increasing index
+        order (indices[i] is the prefix of nodes[i]), adding the interior
+        nodes above them.
+        """
+        levels = self.levels
+        dimensions = self.dimensions
+        clevels = common_prefix_levels(indices[:-1], indices[1:], levels, dimensions)
+        # rightmost open path of the tree as (level, node), deepest last.
+        stack = [(levels, nodes[0])]
+        for i in range(1, len(nodes)):
+            clevel = int(clevels[i - 1])
+            last = None
+            while stack and stack[-1][0] > clevel:
+                (level, node) = stack.pop()
+                if last is not None:
+                    node.add_new_child(last, self)
+                last = node
+            if not stack or stack[-1][0] < clevel:
+                shift = dimensions * (levels - clevel)
+                prefix = (nodes[i].prefix >> shift) << shift
+                parent = self.new_interior(prefix, clevel)
+                parent.add_new_child(last, self)
+                stack.append((clevel, parent))
+            else:
+                stack[-1][1].add_new_child(last, self)
+            stack.append((levels, nodes[i]))
+        last = None
+        while stack:
+            (level, node) = stack.pop()
+            if last is not None:
+                node.add_new_child(last, self)
+            last = node
+        return last
+
+    def add_at_min_penalty(self, node_penalty_fn, name, info=None, initial_penalty_fn=None, normalize=None,
+                           vector_penalty_fn=None):
+        """
+        Add name at the corner of the voxel reached by descending, one level at a
+        time, into the quadrant with the least total penalty against the frontier
+        nodes (see min_penalty_index).  An empty tree gets name at its center.
+        """
+        recorder = self.stats_recorder
+        if recorder is not None:
+            with recorder.operation("add_at_min_penalty"):
+                self.place_at_min_penalty(node_penalty_fn, name, info, initial_penalty_fn,
+                                          normalize, vector_penalty_fn)
+            return
+        self.place_at_min_penalty(node_penalty_fn, name, info, initial_penalty_fn, normalize,
+                                  vector_penalty_fn)
+
+    def place_at_min_penalty(self, node_penalty_fn, name, info=None, initial_penalty_fn=None,
+                             normalize=None, vector_penalty_fn=None):
+        "add_at_min_penalty without its stats event."
         if self.root is None:
             # add node at center
-            # p "adding initial node"
             return self.add(self.center, name, info)
-        index = 0
-        index_to_node = {0: self.root}
-        for level in range(self.levels):
-            # expand any adjacent nodes at this level
-            for node_index in index_to_node.keys():
-                # p "looking for nodes to expand for", self.qs(index)
-                node = index_to_node[node_index]
-                if (isinstance(node, gqnodes.QtInteriorNode) and
-                    node.level<=level and
-                    self.adjacent(index, node_index, node.level)):
-                    # p "    expanding", node.level, self.qs(node.prefix)
-                    del index_to_node[node_index]
-                    children = node.children
-                    for quadrant in children:
-                        child = children[quadrant]
-                        # p "   expand child", child.level, self.qs(child.prefix)
-                        index_to_node[child.prefix] = child
-            # find index of best quadrant
-            best_penalty = None
-            best_corner = None
-            for qindex in self.quadrant_indices(index, level):
-                voxels = int_index_inverse(qindex, self.levels, self.dimensions)
-                corner = self.index_corner(qindex)
-                # p "    qindex", self.qs(qindex), voxels, corner, "at level", level
-                total_penalty = 0
-                if initial_penalty_fn is not None:
-                    total_penalty = initial_penalty_fn(qindex, voxels, corner)
-                for node_index in index_to_node:
-                    node = index_to_node[node_index]
-                    node_penalty = node_penalty_fn(node, qindex, voxels, corner)
-                    total_penalty += node_penalty
-                    # p "        penalty", self.qs(node.prefix), node_penalty, total_penalty, node.get_names()
-                penalty = total_penalty
-                if normalize:
-                    penalty = normalize(total_penalty)
-                # p "    total penalty", penalty
-                if best_penalty is None or penalty < best_penalty:
-                    # p "    choosing", self.qs(qindex)
-                    best_penalty = penalty
-                    best_corner = corner
-                    index = qindex
-                elif penalty == best_penalty:
-                    # prefer nearer to the center, deterministic choice (for testing)
-                    new_norm = norm(self.center - corner)
-                    best_norm = norm(self.center - best_corner)
-                    if new_norm < best_norm or (new_norm == best_norm and qindex < index):
-                        # p "    preferring", self.qs(qindex)
-                        best_penalty = penalty
-                        best_corner = corner
-                        index = qindex
+        index = self.min_penalty_index(node_penalty_fn, initial_penalty_fn, normalize,
+                                       vector_penalty_fn)
         position = self.index_corner(index)
-        # p "final position", self.qs(index), position
-        self.add(position, name, info)
+        with self.phase("insert"):
+            self.add(position, name, info)
+
+    def min_penalty_index(self, node_penalty_fn, initial_penalty_fn=None, normalize=None,
+                          vector_penalty_fn=None):
+        """
+        Voxel index chosen by add_at_min_penalty in a non-empty tree.
+
+        At each level every quadrant below the current choice is scored with
+        initial_penalty_fn(qindex, voxels, corner) plus the sum over the frontier
+        of node_penalty_fn(node, qindex, voxels, corner).  The frontier starts at
+        the root; interior nodes adjacent to the chosen quadrant at their own
+        level are replaced by their children.  Ties go to the corner nearest the
+        tree center, then to the lowest index.
+
+        vector_penalty_fn(nodes, node_positions, qindices, voxels, corners), if
+        given, replaces node_penalty_fn and scores all quadrants at once: it gets
+        the frontier nodes, their (nnodes, dimensions) int positions, and the
+        quadrant indices, (nquadrants, dimensions) int positions and corners.  It
+        returns a (nquadrants, nnodes) array of penalties or a (nquadrants,)
+        array of totals.
+        """
+        placement = PenaltyPlacement(self, node_penalty_fn, initial_penalty_fn, normalize,
+                                     vector_penalty_fn)
+        return placement.choose()
+
+    def add_many_at_min_penalty(self, node_penalty_fn, names, infos=None, initial_penalty_fn=None,
+                                normalize=None, vector_penalty_fn=None):
+        """
+        add_at_min_penalty for each name in order, returning the (N, dimensions)
+        array of chosen positions.  Frontiers and node penalties are kept between
+        insertions and recomputed only where the previous insertion changed the
+        tree (see PenaltyPlacement), so penalties must depend only on the node
+        and the quadrant, not on the name being placed.
+        """
+        placement = PenaltyPlacement(self, node_penalty_fn, initial_penalty_fn, normalize,
+                                     vector_penalty_fn, reuse=True)
+        positions = []
+        for (i, name) in enumerate(names):
+            info = None
+            if infos is not None:
+                info = infos[i]
+            positions.append(placement.add(name, info))
+        return np.array(positions, dtype=float).reshape((len(positions), self.dimensions))
+
+    def containing_path(self, index):
+        "List of the nodes from the root down whose quadrants contain index."
+        path = []
+        node = self.root
+        dimensions = self.dimensions
+        levels = self.levels
+        while node is not None:
+            if node.level is None:
+                if node.prefix == index:
+                    path.append(node)
+                break
+            shift = dimensions * (levels - node.level)
+            if (index >> shift) << shift != node.prefix:
+                break
+            path.append(node)
+            (prefix, quadrant) = self.quadrant(index, node.level + 1)
+            node = node.children.get(quadrant)
+        return path
+
+    def best_quadrant(self, penalties, corners):
+        "Position of the least penalty, breaking ties by distance of corners to the center."
+        best = 0
+        best_norm = None
+        for i in range(1, len(penalties)):
+            penalty = penalties[i]
+            if penalty < penalties[best]:
+                best = i
+                best_norm = None
+            elif penalty == penalties[best]:
+                # prefer nearer to the center, deterministic choice (for testing)
+                if best_norm is None:
+                    best_norm = norm(self.center - corners[best])
+                new_norm = norm(self.center - corners[i])
+                if new_norm < best_norm:
+                    best = i
+                    best_norm = new_norm
+        return best
+
+    def quadrant_offsets(self, level):
+        "(nquadrants, dimensions) int position offsets of the quadrants at level + 1."
+        offsets = self._quadrant_offsets.get(level)
+        if offsets is None:
+            dimensions = self.dimensions
+            step = 1 << (self.levels - level - 1)
+            bits = [[(quadrant >> d) & 1 for d in range(dimensions)]
+                    for quadrant in range(self.nquadrants)]
+            offsets = np.array(bits, dtype=int_position_dtype(self.levels)) * step
+            self._quadrant_offsets[level] = offsets
+        return offsets
+
+    def node_int_position(self, node):
+        "Int position of the lower corner of node, cached on interior nodes."
+        if node.level is None:
+            return self.index_to_index_position(node.prefix)
+        ipos = node._int_position
+        if ipos is None:
+            ipos = self.index_to_index_position(node.prefix)
+            node._int_position = ipos
+        return ipos
 
     def quadrant(self, index, at_level):
         assert at_level >= 0
@@ -235,26 +859,32 @@ class GeneralizedQuadtree:
         nprefix = node.prefix
         lprefix = leaf.prefix
         levels = self.levels
-        if isinstance(node, gqnodes.QtLeafNode):
+        if node.level is None:
             (cprefix, clevel) = self.common_prefix_level(nprefix, lprefix)
             if clevel == levels:
                 # Leaf collision: extend leaf data at node.
+                indexed = leaf
+                if self.persistent:
+                    # the names already there move to the copy too
+                    node = indexed = node.copy()
                 node.add_leaf(leaf)
+                self.relink(lprefix, node, indexed.entries())
                 return node
             # Otherwise create a new parent for the leaves
-            result = gqnodes.QtInteriorNode(cprefix, clevel)
+            result = self.new_interior(cprefix, clevel)
             result.add_new_child(node, self)
             result.add_new_child(leaf, self)
             return result
-        assert isinstance(node, gqnodes.QtInteriorNode)
         nlevel = node.level
         (cprefix, clevel) = self.common_prefix_level(nprefix, lprefix)
         if clevel >= nlevel:
             # insert below node
+            if self.persistent:
+                node = node.copy()
             node.add_leaf(leaf, self)
             return node
         # otherwise create a new parent for the leaf and node
-        result = gqnodes.QtInteriorNode(cprefix, clevel)
+        result = self.new_interior(cprefix, clevel)
         result.add_new_child(node, self)
         result.add_new_child(leaf, self)
         return result
@@ -278,8 +908,28 @@ class GeneralizedQuadtree:
         """
         int_position = self.int_position(position)
         index = int_index(int_position, self.levels)
+        if self.stats_recorder is not None:
+            self.stats_recorder.count("int_index")
         return (index, int_position)
 
+    def int_positions(self, positions):
+        "Vectorized int_position for an (N, dimensions) array of positions."
+        positions = np.asarray(positions, dtype=float)
+        assert positions.ndim == 2 and positions.shape[1] == self.dimensions, (
+            "Bad dimensions in positions " + repr(positions.shape)
+        )
+        return ((positions - self.origin) / self.min_side).astype(np.int64)
+
+    def index_positions(self, positions):
+        """
+        Vectorized index_position: (indices, int_positions) for an (N, dimensions) array.
+        """
+        int_positions = self.int_positions(positions)
+        indices = int_index_array(int_positions, self.levels)
+        if self.stats_recorder is not None:
+            self.stats_recorder.count("int_index", len(indices))
+        return (indices, int_positions)
+
     def index(self, position):
         return self.index_position(position)[0]
 
@@ -309,34 +959,418 @@ class GeneralizedQuadtree:
                 raise ValueError, ("too many levels "
                     + repr((levels, index1, index2)))
 
+class PenaltyFrontier(object):
+    """
+    Nodes scored against candidate quadrants by min_penalty_index, with their
+    int positions, kept in index order (an expanded node is replaced in place
+    by its children).  An interior node is tested for expansion once, at the
+    first level at or below its own: after that the chosen quadrant is fixed
+    at the node's level, so its adjacency cannot change.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        root = tree.root
+        ipos = tree.node_int_position(root)
+        self.nodes = [root]
+        self.prefixes = [root.prefix]
+        self.positions = [ipos]
+        self._position_array = None
+        # interior nodes not yet tested, as level: [(node, int position)]
+        self.waiting = {}
+        if root.level is not None:
+            self.waiting[root.level] = [(root, ipos)]
+
+    def copy(self):
+        "Frontier with the same state, to be expanded independently."
+        other = PenaltyFrontier.__new__(PenaltyFrontier)
+        other.tree = self.tree
+        other.nodes = list(self.nodes)
+        other.prefixes = list(self.prefixes)
+        other.positions = list(self.positions)
+        other._position_array = self._position_array
+        other.waiting = dict((level, list(due)) for (level, due) in self.waiting.items())
+        return other
+
+    def zero_position(self):
+        "Int position of the origin voxel."
+        return np.zeros(self.tree.dimensions, dtype=int_position_dtype(self.tree.levels))
+
+    def position_array(self):
+        "(nnodes, dimensions) int positions of the nodes."
+        positions = self._position_array
+        if positions is None:
+            tree = self.tree
+            positions = np.array(self.positions, dtype=int_position_dtype(tree.levels))
+            positions = positions.reshape((len(self.nodes), tree.dimensions))
+            self._position_array = positions
+        return positions
+
+    def expand(self, iposition, level):
+        """
+        Replace waiting nodes at or above level that are adjacent to the quadrant
+        at iposition (at their level) by their children.  Children are tested
+        from the next level on.
+        """
+        waiting = self.waiting
+        tree = self.tree
+        expanded = set()
+        for node_level in sorted(waiting):
+            if node_level > level:
+                break
+            due = waiting.pop(node_level)
+            if tree.stats_recorder is not None:
+                tree.stats_recorder.count("expansion_tests", len(due))
+            shift = tree.levels - node_level
+            positions = np.array([ipos for (node, ipos) in due], dtype=int_position_dtype(tree.levels))
+            offsets = (positions >> shift) - (iposition >> shift)
+            for i in np.flatnonzero(np.abs(offsets).max(axis=1) <= 1):
+                expanded.add(id(due[i][0]))
+        if not expanded:
+            return
+        nodes = []
+        node_positions = []
+        for (node, ipos) in zip(self.nodes, self.positions):
+            if id(node) not in expanded:
+                nodes.append(node)
+                node_positions.append(ipos)
+                continue
+            for child in sorted(node.child_nodes(), key=operator.attrgetter("prefix")):
+                ipos = tree.node_int_position(child)
+                nodes.append(child)
+                node_positions.append(ipos)
+                if child.level is not None:
+                    waiting.setdefault(child.level, []).append((child, ipos))
+        self.nodes = nodes
+        self.prefixes = [node.prefix for node in nodes]
+        self.positions = node_positions
+        self._position_array = None
+
+    def containing(self, index):
+        "The node whose quadrant contains index, or None."
+        i = bisect.bisect_right(self.prefixes, index) - 1
+        if i < 0:
+            return None
+        node = self.nodes[i]
+        if node.level is None:
+            if node.prefix == index:
+                return node
+            return None
+        shift = self.tree.dimensions * (self.tree.levels - node.level)
+        if (index >> shift) << shift == node.prefix:
+            return node
+        return None
+
+    def insert_leaf(self, leaf):
+        "Add a leaf created below an expanded node, keeping index order."
+        i = bisect.bisect_left(self.prefixes, leaf.prefix)
+        self.nodes.insert(i, leaf)
+        self.prefixes.insert(i, leaf.prefix)
+        self.positions.insert(i, self.tree.node_int_position(leaf))
+        self._position_array = None
+
+class PenaltyPlacement(object):
+    """
+    Greedy descent of add_at_min_penalty, optionally keeping state between
+    insertions for add_many_at_min_penalty.
+
+    With reuse, the frontier after expansion at each level and the penalties
+    of frontier nodes against that level's quadrants are kept, keyed by the
+    level and the quadrant chosen so far, for the max_kept most recently used
+    keys.  A later descent through the same quadrant starts from them.
+
+    Adding a leaf changes only the old nodes on the path to it.  A kept
+    frontier holding one of them stays valid; otherwise the new leaf is added
+    to the kept frontier when its parent is an old node, and the frontier is
+    recomputed when the insertion split a quadrant with a new interior node.
+    Kept penalties of a node are used only if computed after its last change.
+    """
+
+    def __init__(self, tree, node_penalty_fn, initial_penalty_fn=None, normalize=None,
+                 vector_penalty_fn=None, reuse=False, max_kept=256):
+        self.tree = tree
+        self.node_penalty_fn = node_penalty_fn
+        self.initial_penalty_fn = initial_penalty_fn
+        self.normalize = normalize
+        self.vector_penalty_fn = vector_penalty_fn
+        self.reuse = reuse
+        self.max_kept = max_kept
+        # (level, index): [frontier or None, {id(node): (node, penalties, insertion)}]
+        self.kept = collections.OrderedDict()
+        # number of insertions so far, and id(node): insertion that last changed it
+        self.insertions = 0
+        self.changed = {}
+
+    def add(self, name, info=None):
+        "Add name at the chosen voxel corner (the center for an empty tree); return the position."
+        recorder = self.tree.stats_recorder
+        if recorder is not None:
+            with recorder.operation("add_at_min_penalty"):
+                return self.place(name, info)
+        return self.place(name, info)
+
+    def place(self, name, info=None):
+        "add without its stats event."
+        tree = self.tree
+        if tree.root is None:
+            position = tree.center
+            tree.add(position, name, info)
+            return position
+        index = self.choose()
+        position = tree.index_corner(index)
+        old_root = tree.root
+        old_path = tree.containing_path(index)
+        with tree.phase("insert"):
+            tree.add(position, name, info)
+        self.added(index, old_root, old_path, tree.containing_path(index))
+        return position
+
+    def added(self, index, old_root, old_path, path):
+        """
+        Update kept state after adding a leaf at index: old_path holds the nodes
+        that contained it before, and path the nodes that contain it now.
+        """
+        kept = self.kept
+        if self.tree.root is not old_root:
+            # new root, or nodes derived afresh (as in LinearQuadtree).
+            kept.clear()
+            self.changed.clear()
+            return
+        insertion = self.insertions
+        self.insertions += 1
+        old_ids = set()
+        for node in old_path:
+            old_ids.add(id(node))
+            self.changed[id(node)] = insertion
+        leaf = path[-1]
+        # a new leaf directly below an old node joins frontiers that expanded it.
+        new_leaf = id(leaf) not in old_ids and len(path) > 1 and id(path[-2]) in old_ids
+        for entry in kept.values():
+            frontier = entry[0]
+            if frontier is None:
+                continue
+            # the frontier is in index order, so only one node can contain index.
+            node = frontier.containing(index)
+            if node is not None and id(node) in old_ids:
+                continue
+            if new_leaf:
+                frontier.insert_leaf(leaf)
+            else:
+                entry[0] = None
+
+    def choose(self):
+        "Index of the voxel reached by descending into the least penalty quadrants."
+        tree = self.tree
+        recorder = tree.stats_recorder
+        phase = tree.phase
+        kept = self.kept
+        frontier = None
+        index = 0
+        iposition = None
+        for level in range(tree.levels):
+            key = (level, index)
+            entry = kept.pop(key, None)
+            if entry is None:
+                entry = [None, {}]
+            if self.reuse:
+                # most recently used last.
+                kept[key] = entry
+                if len(kept) > self.max_kept:
+                    kept.popitem(last=False)
+            if entry[0] is not None:
+                frontier = entry[0].copy()
+            else:
+                if frontier is None:
+                    frontier = PenaltyFrontier(tree)
+                if iposition is None:
+                    iposition = frontier.zero_position()
+                with phase("expand"):
+                    frontier.expand(iposition, level)
+                if self.reuse:
+                    entry[0] = frontier.copy()
+            if iposition is None:
+                iposition = frontier.zero_position()
+            qindices = list(tree.quadrant_indices(index, level))
+            voxels = iposition + tree.quadrant_offsets(level)
+            corners = voxels * tree.min_side + tree.origin
+            if recorder is not None:
+                recorder.observe("frontier_size", len(frontier.nodes))
+                recorder.observe("frontier_size.%s" % level, len(frontier.nodes))
+            with phase("penalties"):
+                penalties = self.penalties(frontier, entry[1], qindices, voxels, corners)
+            best = tree.best_quadrant(penalties, corners)
+            index = qindices[best]
+            iposition = voxels[best]
+        return index
+
+    def penalties(self, frontier, rows, qindices, voxels, corners):
+        "Total penalty for each quadrant, using and filling rows of node penalties."
+        nodes = frontier.nodes
+        changed = self.changed
+        missing = []
+        for (j, node) in enumerate(nodes):
+            row = rows.get(id(node))
+            if row is None or row[0] is not node or row[2] <= changed.get(id(node), -1):
+                missing.append(j)
+        insertion = self.insertions
+        initial_penalty_fn = self.initial_penalty_fn
+        recorder = self.tree.stats_recorder
+        if recorder is not None:
+            recorder.count("penalty_evaluations", len(missing) * len(qindices))
+            recorder.count("penalty_reused", (len(nodes) - len(missing)) * len(qindices))
+            if self.vector_penalty_fn is not None:
+                recorder.count("vector_penalty_fn_calls", 1 if missing else 0)
+            else:
+                recorder.count("node_penalty_fn_calls", len(missing) * len(qindices))
+            if initial_penalty_fn is not None:
+                recorder.count("initial_penalty_fn_calls", len(qindices))
+        if self.vector_penalty_fn is not None:
+            penalties = self.vector_penalties(frontier, rows, missing, qindices, voxels, corners)
+            if initial_penalty_fn is not None:
+                for (i, qindex) in enumerate(qindices):
+                    penalties[i] += initial_penalty_fn(qindex, voxels[i].tolist(), corners[i])
+        else:
+            node_penalty_fn = self.node_penalty_fn
+            qvoxels = [quadrant_voxels.tolist() for quadrant_voxels in voxels]
+            for j in missing:
+                node = nodes[j]
+                rows[id(node)] = (node, [node_penalty_fn(node, qindex, qvoxels[i], corners[i])
+                                         for (i, qindex) in enumerate(qindices)], insertion)
+            node_rows = [rows[id(node)][1] for node in nodes]
+            penalties = []
+            for (i, qindex) in enumerate(qindices):
+                total_penalty = 0
+                if initial_penalty_fn is not None:
+                    total_penalty = initial_penalty_fn(qindex, qvoxels[i], corners[i])
+                for row in node_rows:
+                    total_penalty += row[i]
+                penalties.append(total_penalty)
+        normalize = self.normalize
+        if normalize:
+            penalties = [normalize(penalty) for penalty in penalties]
+        return penalties
+
+    def vector_penalties(self, frontier, rows, missing, qindices, voxels, corners):
+        "List of node penalty totals from vector_penalty_fn, called for the missing nodes."
+        nodes = frontier.nodes
+        if len(missing) == len(nodes):
+            result = np.asarray(self.vector_penalty_fn(
+                nodes, frontier.position_array(), qindices, voxels, corners))
+            if result.ndim == 1:
+                return result.tolist()
+            if not self.reuse:
+                return result.sum(axis=1).tolist()
+            columns = result.T
+        else:
+            result = np.asarray(self.vector_penalty_fn(
+                [nodes[j] for j in missing], frontier.position_array()[missing],
+                qindices, voxels, corners))
+            missing_set = set(missing)
+            columns = [None if j in missing_set else rows[id(node)][1]
+                       for (j, node) in enumerate(nodes)]
+            if result.ndim == 1:
+                # totals cannot be split between nodes: add the known columns.
+                known = [column for column in columns if column is not None]
+                return (result + np.array(known).sum(axis=0)).tolist()
+            for (k, j) in enumerate(missing):
+                columns[j] = result[:, k]
+        for j in missing:
+            node = nodes[j]
+            rows[id(node)] = (node, columns[j], self.insertions)
+        # same layout as a single call for the whole frontier, so sums agree.
+        return np.ascontiguousarray(np.array(columns).T).sum(axis=1).tolist()
+
+def index_dtype(levels, dimensions):
+    "dtype for arrays of indices: uint64 when levels * dimensions bits fit, else Python ints."
+    if levels * dimensions <= 64:
+        return np.dtype(np.uint64)
+    return np.dtype(object)
+
+def int_position_dtype(levels):
+    "dtype for arrays of int positions: int64 while coordinates fit, else Python ints."
+    if levels >= 63:
+        return np.dtype(object)
+    return np.dtype(np.int64)
+
+def common_prefix_levels(indices1, indices2, levels, dimensions):
+    "Vectorized common_prefix_level: deepest levels at which paired indices agree."
+    indices1 = np.asarray(indices1)
+    indices2 = np.asarray(indices2)
+    if indices1.dtype == object or indices2.dtype == object:
+        return np.array([
+            levels - (((int(i1) ^ int(i2)).bit_length() + dimensions - 1) // dimensions)
+            for (i1, i2) in zip(indices1, indices2)], dtype=int)
+    diff = indices1.astype(np.uint64) ^ indices2.astype(np.uint64)
+    result = np.zeros(len(diff), dtype=int)
+    for level in range(1, levels + 1):
+        result += (diff >> np.uint64(dimensions * (levels - level))) == 0
+    return result
+
 def int_index_inverse(index, levels, dimensions):
     index0 = index  # for diagnositics only
-    result = [0] * dimensions
-    d_order = range(dimensions)
-    #pr "start index {0:b}".format(index)
-    for level in range(levels):
-        for dim in d_order:
-            bit = index & 1
-            #property "level, dim, bit, before", level, dim, bit, "{0:b}".format(result[dim])
-            index = index >> 1
-            result[dim] = result[dim] | (bit << level)
-            #pr "after {0:b} {1:b}".format(index, result[dim])
-    assert index == 0, "too many bits " + repr((index0, levels, dimensions))
-    return np.array(result)
+    index = int(operator.index(index))
+    assert index >> (levels * dimensions) == 0, "too many bits " + repr((index0, levels, dimensions))
+    return np.array(gqmorton.coordinates(index, levels, dimensions))
 
 def int_index(position_ints, levels):
-    result = 0
-    shift = 0
-    p = list(position_ints)
+    p = [int(operator.index(p_d)) for p_d in position_ints]
     assert min(p) >= 0, "negative entries " + repr(p)
-    dimensions = list(range(len(p)))
-    shift = 0
-    for level in range(levels):
-        for d in dimensions:
-            p_d = p[d]
-            bit = p_d & 1
-            p[d] = p_d >> 1
-            result = result | (bit << shift)
-            shift += 1
-    assert max(p) == 0, "unshifted bits " + repr((p, position_ints))
+    dimensions = len(p)
+    dilate = dilation_tables(dimensions)[0]
+    result = 0
+    for (d, p_d) in enumerate(p):
+        assert p_d >> levels == 0, "unshifted bits " + repr((p, position_ints))
+        shift = d
+        while p_d:
+            result |= dilate[p_d & 0xff] << shift
+            p_d >>= 8
+            shift += 8 * dimensions
+    return result
+
+def int_index_array(positions_ints, levels):
+    """
+    Vectorized int_index: indices for an (N, dimensions) array of integer positions.
+    The result has dtype index_dtype(levels, dimensions).
+    """
+    p = np.asarray(positions_ints)
+    assert p.ndim == 2, "expected (N, dimensions) positions " + repr(p.shape)
+    (npoints, dimensions) = p.shape
+    dtype = index_dtype(levels, dimensions)
+    if dtype == object or npoints == 0:
+        return np.array([int_index(row, levels) for row in p], dtype=dtype)
+    assert p.min() >= 0, "negative entries " + repr(p[p.min(axis=1) < 0][:5])
+    p = p.astype(np.uint64)
+    if levels < 64:
+        assert (p >> np.uint64(levels)).max() == 0, "unshifted bits " + repr(p.max())
+    array_dilate = dilation_tables(dimensions)[2]
+    result = np.zeros(npoints, dtype=np.uint64)
+    for d in range(dimensions):
+        coordinates = p[:, d]
+        for start in range(0, levels, 8):
+            byte = (coordinates >> np.uint64(start)) & np.uint64(0xff)
+            result |= array_dilate[byte] << np.uint64(start * dimensions + d)
+    return result
+
+def int_index_inverse_array(indices, levels, dimensions):
+    """
+    Vectorized int_index_inverse: (N, dimensions) integer positions for N indices.
+    """
+    indices = np.asarray(indices)
+    assert indices.ndim == 1, "expected a vector of indices " + repr(indices.shape)
+    if index_dtype(levels, dimensions) == object or indices.dtype == object or len(indices) == 0:
+        result = [int_index_inverse(index, levels, dimensions) for index in indices]
+        return np.array(result, dtype=int_position_dtype(levels)).reshape(
+            (len(indices), dimensions))
+    indices = indices.astype(np.uint64)
+    nbits = levels * dimensions
+    if nbits < 64:
+        assert (indices >> np.uint64(nbits)).max() == 0, "too many bits " + repr(indices.max())
+    (dilate, _, array_dilate) = dilation_tables(dimensions)
+    mask = np.uint64(dilate[0xff] & ((1 << 64) - 1))
+    result = np.zeros((len(indices), dimensions), dtype=np.int64 if levels < 63 else np.uint64)
+    for dim in range(dimensions):
+        for start in range(0, levels, 8):
+            chunk = (indices >> np.uint64(start * dimensions + dim)) & mask
+            byte = np.searchsorted(array_dilate, chunk).astype(result.dtype)
+            result[:, dim] |= byte << result.dtype.type(start)
     return result
@@ -0,0 +1,31 @@
+"""
+Sample points and trees shared by the tests.
+"""
+
+from .. import gqtree
+from .. import gqlinear
+import numpy as np
+
+def sample_points(npoints, dims=2, seed=0, side=8.0, cluster=False, collisions=None, prefix="p"):
+    """
+    (positions, names) of npoints drawn uniformly in [0, side) ** dims by
+    RandomState(seed).  With cluster the first quarter is redrawn in
+    [3.0, 3.5) ** dims, for deep nodes beside coarse ones; the points in
+    the slice collisions take the position of the first, sharing its leaf.
+    """
+    rng = np.random.RandomState(seed)
+    positions = rng.uniform(0.0, side, size=(npoints, dims))
+    if cluster:
+        positions[:npoints // 4] = rng.uniform(3.0, 3.5, size=(npoints // 4, dims))
+    if collisions is not None:
+        positions[collisions] = positions[0]
+    return (positions, ["%s%s" % (prefix, i) for i in range(npoints)])
+
+def sample_trees(origin, sidelength, levels, positions, names, infos=None):
+    "Pointer, compact and linear trees built by from_points."
+    return [
+        gqtree.GeneralizedQuadtree.from_points(origin, sidelength, levels, positions, names, infos),
+        gqtree.GeneralizedQuadtree.from_points(origin, sidelength, levels, positions, names, infos,
+                                               compact=True),
+        gqlinear.LinearQuadtree.from_points(origin, sidelength, levels, positions, names, infos),
+    ]
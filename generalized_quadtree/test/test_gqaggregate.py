@@ -0,0 +1,68 @@
+import unittest
+from .. import gqtree
+from .. import gqaggregate
+from .samples import sample_points, sample_trees
+import numpy as np
+
+def add_reducers(tree):
+    tree.add_reducer(gqaggregate.count_reducer())
+    tree.add_reducer(gqaggregate.weight_reducer())
+    tree.add_reducer(gqaggregate.centroid_reducer("weighted", key="weight"))
+    tree.add_reducer(gqaggregate.bounds_reducer())
+    return tree
+
+class TestAggregate(unittest.TestCase):
+
+    def points(self, npoints=200, dims=2):
+        (positions, names) = sample_points(npoints, dims, seed=dims, side=10.0)
+        weights = np.random.RandomState(dims + 1).uniform(0.5, 2.0, size=npoints)
+        infos = [{"weight": w} for w in weights]
+        return (positions, names, infos)
+
+    def check_aggregates(self, tree, positions, infos):
+        weights = np.array([info["weight"] for info in infos])
+        self.assertEqual(tree.get_aggregate("count"), len(positions))
+        self.assertAlmostEqual(tree.get_aggregate("weight"), weights.sum())
+        (total, centroid) = tree.get_aggregate("weighted")
+        self.assertAlmostEqual(total, weights.sum())
+        self.assertTrue(np.allclose(centroid, weights.dot(positions) / weights.sum()))
+        (lower, upper) = tree.get_aggregate("bounds")
+        self.assertTrue(np.allclose(lower, positions.min(axis=0)))
+        self.assertTrue(np.allclose(upper, positions.max(axis=0)))
+
+    def test_aggregates(self):
+        (positions, names, infos) = self.points()
+        for tree in sample_trees([0.0, 0.0], 10.0, 8, positions, names, infos):
+            self.check_aggregates(add_reducers(tree), positions, infos)
+
+    def test_incremental(self):
+        (positions, names, infos) = self.points()
+        for compact in (False, True):
+            tree = add_reducers(gqtree.GeneralizedQuadtree([0.0, 0.0], 10.0, 8, compact=compact))
+            half = len(names) // 2
+            for i in range(half):
+                tree.add(positions[i], names[i], infos[i])
+            self.check_aggregates(tree, positions[:half], infos[:half])
+            # cached aggregates are merged as leaves are added
+            for i in range(half, len(names)):
+                tree.add(positions[i], names[i], infos[i])
+            self.check_aggregates(tree, positions, infos)
+            # replacing a name at the same voxel drops cached aggregates
+            tree.add(positions[0], names[0], {"weight": infos[0]["weight"] + 1.0})
+            self.assertEqual(tree.get_aggregate("count"), len(names))
+            self.assertAlmostEqual(tree.get_aggregate("weight"),
+                                   sum(info["weight"] for info in infos) + 1.0)
+
+    def test_field(self):
+        (positions, names, infos) = self.points(npoints=400, dims=3)
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0] * 3, 10.0, 8, positions, names)
+        queries = np.random.RandomState(5).uniform(-5.0, 15.0, size=(10, 3))
+        for query in queries:
+            exact = gqaggregate.inverse_square(positions - query, np.ones(len(positions)))
+            self.assertTrue(np.allclose(tree.field(query, theta=0.0), exact))
+            approximate = tree.field(query, theta=0.5)
+            self.assertTrue(np.linalg.norm(approximate - exact) < 0.05 * np.linalg.norm(exact))
+        exact = gqaggregate.potential(positions - positions[0], np.ones(len(positions)))
+        self.assertAlmostEqual(tree.field(positions[0], gqaggregate.potential, theta=0.0), exact)
+        many = tree.field_many(queries, theta=0.5)
+        self.assertEqual(many.shape, (10, 3))
@@ -0,0 +1,140 @@
+import unittest
+from .. import gqtree
+from .. import gqlinear
+from .. import gqneighbors
+from .. import gqmorton
+from .samples import sample_points
+import numpy as np
+
+def visited_keys(tree, position):
+    found = []
+    tree.adjacency_walk(position, lambda position, node, tree, data: found.append(
+        gqneighbors.node_key(tree, node)))
+    return found
+
+class TestQueryCache(unittest.TestCase):
+
+    def check(self, cached, plain, queries, boxes):
+        for query in queries:
+            self.assertEqual(visited_keys(cached, query), visited_keys(plain, query))
+            for level in (0, 2, 4, 5):
+                names = plain.quadrant_names(query, level)
+                self.assertEqual(cached.quadrant_names(query, level), names)
+                prefix = gqmorton.ancestor(plain.index(query), plain.levels, plain.dimensions,
+                                           level)
+                self.assertEqual(names, set(
+                    name for (name, (index, leaf)) in plain.name_index.items()
+                    if gqmorton.ancestor(index, plain.levels, plain.dimensions, level) == prefix))
+        for (lower, upper) in boxes:
+            self.assertEqual(cached.query_box(lower, upper), plain.query_box(lower, upper))
+
+    def test_updates(self):
+        for (dims, compact, neighbors) in ((2, False, False), (2, True, True), (3, False, False)):
+            (positions, names) = sample_points(80, dims, cluster=True)
+            rng = np.random.RandomState(1)
+            queries = rng.uniform(0.0, 8.0, size=(6, dims))
+            lowers = rng.uniform(0.0, 6.0, size=(6, dims))
+            boxes = [(lower, lower + rng.uniform(0.1, 3.0)) for lower in lowers]
+            trees = []
+            for cache in (True, False):
+                tree = gqtree.GeneralizedQuadtree([0.0] * dims, 8.0, 5, compact=compact)
+                if cache:
+                    tree.enable_query_cache()
+                if neighbors:
+                    tree.enable_neighbor_index()
+                trees.append(tree)
+            (cached, plain) = trees
+            self.check(cached, plain, queries, boxes)
+            for (i, (position, name)) in enumerate(zip(positions, names)):
+                cached.add(position, name)
+                plain.add(position, name)
+                if i % 5 == 0:
+                    self.check(cached, plain, queries, boxes)
+            self.check(cached, plain, queries, boxes)
+            for name in names[::3]:
+                cached.remove(name)
+                plain.remove(name)
+                self.check(cached, plain, queries, boxes)
+            for (name, position) in zip(names[1::3], positions[2::3]):
+                cached.move(name, position)
+                plain.move(name, position)
+                self.check(cached, plain, queries, boxes)
+            cached.move_many(names[1::3], positions[1::3])
+            plain.move_many(names[1::3], positions[1::3])
+            self.check(cached, plain, queries, boxes)
+            stats = cached.query_cache.stats()
+            self.assertTrue(stats["hits"] > 0)
+            self.assertTrue(stats["invalidations"] > 0)
+
+    def test_invalidation(self):
+        (positions, names) = sample_points(60, cluster=True)
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 5, positions, names)
+        cache = tree.enable_query_cache()
+        tree.add([7.9, 7.9], "corner")
+        # a box and a quadrant far from the next insert stay cached
+        tree.query_box([0.1, 0.1], [1.0, 1.0])
+        tree.quadrant_names([0.5, 0.5], 2)
+        tree.query_box([7.0, 7.0], [8.0, 8.0])
+        self.assertEqual(cache.stats()["misses"], 3)
+        tree.add([7.5, 7.5], "new")
+        self.assertEqual(cache.stats()["invalidations"], 1)
+        self.assertIn("new", tree.query_box([7.0, 7.0], [8.0, 8.0]))
+        tree.query_box([0.1, 0.1], [1.0, 1.0])
+        tree.quadrant_names([0.5, 0.5], 2)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 4))
+        # the cache returns the result it keeps
+        self.assertIs(tree.quadrant_names([0.5, 0.5], 2), tree.quadrant_names([0.1, 0.2], 2))
+        tree.disable_query_cache()
+        self.assertIsNone(tree.query_cache)
+
+    def test_limits(self):
+        (positions, names) = sample_points(60, cluster=True)
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 5, positions, names)
+        cache = tree.enable_query_cache(max_entries=3)
+        for x in range(5):
+            tree.query_box([x, 0.0], [x + 1.0, 1.0])
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (3, 2))
+        # the least recently used goes first
+        tree.query_box([2.0, 0.0], [3.0, 1.0])
+        tree.query_box([5.0, 0.0], [6.0, 1.0])
+        self.assertEqual(sorted(key[1][0] for key in cache.entries), [2.0, 4.0, 5.0])
+        cache = tree.enable_query_cache(max_entries=None, max_bytes=2000)
+        for x in range(20):
+            tree.query_box([x * 0.3, 0.0], [x * 0.3 + 1.0, 1.0])
+        stats = cache.stats()
+        self.assertTrue(0 < stats["bytes"] <= 2000)
+        self.assertTrue(stats["evictions"] > 0)
+        self.assertEqual(stats["entries"] + stats["evictions"], 20)
+        self.assertTrue(cache.regions)
+        cache.clear()
+        self.assertEqual((cache.nbytes, cache.regions, cache.expanded), (0, {}, {}))
+
+    def test_linear(self):
+        (positions, names) = sample_points(80, cluster=True)
+        rng = np.random.RandomState(1)
+        queries = rng.uniform(0.0, 8.0, size=(6, 2))
+        lowers = rng.uniform(0.0, 6.0, size=(6, 2))
+        boxes = [(lower, lower + rng.uniform(0.1, 3.0)) for lower in lowers]
+        (cached, plain) = [gqlinear.LinearQuadtree([0.0, 0.0], 8.0, 5) for i in range(2)]
+        cached.enable_query_cache()
+        for (i, (position, name)) in enumerate(zip(positions, names)):
+            cached.add(position, name)
+            plain.add(position, name)
+            if i % 10 == 0:
+                self.check(cached, plain, queries, boxes)
+        for name in names[::3]:
+            cached.remove(name)
+            plain.remove(name)
+            self.check(cached, plain, queries, boxes)
+        # a name added again in its voxel replaces its row
+        for tree in (cached, plain):
+            tree.add(positions[2] + 0.01, names[2])
+        self.check(cached, plain, queries, boxes)
+        for tree in (cached, plain):
+            tree.move_many(names[1::3], positions[2::3])
+        self.check(cached, plain, queries, boxes)
+        stats = cached.query_cache.stats()
+        self.assertTrue(stats["hits"] > 0)
+        self.assertTrue(stats["invalidations"] > 0)
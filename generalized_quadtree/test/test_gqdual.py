@@ -0,0 +1,74 @@
+import unittest
+from .. import gqdual
+from .. import gqquery
+from .samples import sample_points, sample_trees
+import numpy as np
+
+def trees(positions, names):
+    return sample_trees([0.0] * positions.shape[1], 10.0, 8, positions, names)
+
+def brute_distances(positions1, positions2, metric):
+    offsets = positions1[:, None, :] - positions2[None, :, :]
+    return gqquery.norms(offsets, gqquery.metric_order(metric))
+
+class TestDual(unittest.TestCase):
+
+    def points(self, npoints, dims, seed):
+        # names differ between the trees of a join
+        return sample_points(npoints, dims, seed, side=10.0, prefix="p%s_" % seed)
+
+    def test_flat_tree(self):
+        (positions, names) = self.points(300, 2, 0)
+        for tree in trees(positions, names):
+            flat = gqdual.FlatTree(tree)
+            self.assertEqual(sorted(flat.names), sorted(names))
+            self.assertEqual(flat.rows(tree.root), (0, 300))
+            # rows of a node are the entries below it, inside its box
+            for node in tree.root.child_nodes():
+                (start, stop) = flat.rows(node)
+                self.assertEqual(set(flat.names[start:stop]), node.get_names())
+                (lower, upper) = flat.box(node)
+                self.assertTrue(np.all(flat.positions[start:stop] >= lower))
+                self.assertTrue(np.all(flat.positions[start:stop] <= upper))
+
+    def test_all_nearest(self):
+        (positions, names) = self.points(300, 2, 1)
+        (others, other_names) = self.points(200, 2, 2)
+        for metric in ("l1", "l2", "linf"):
+            distances = brute_distances(positions, positions, metric)
+            np.fill_diagonal(distances, np.inf)
+            cross = brute_distances(positions, others, metric)
+            for (tree, other) in zip(trees(positions, names), trees(others, other_names)):
+                result = tree.all_nearest(3, metric=metric)
+                for (i, name) in enumerate(names):
+                    (found, found_distances) = result[name]
+                    self.assertEqual(len(found), 3)
+                    self.assertTrue(np.allclose(found_distances, np.sort(distances[i])[:3]))
+                    self.assertTrue(name not in found)
+                result = tree.all_nearest(2, other, metric)
+                for (i, name) in enumerate(names):
+                    self.assertTrue(np.allclose(result[name][1], np.sort(cross[i])[:2]))
+
+    def test_within_pairs(self):
+        (positions, names) = self.points(250, 3, 3)
+        (others, other_names) = self.points(150, 3, 4)
+        radius = 1.5
+        for metric in ("l1", "l2", "linf"):
+            distances = brute_distances(positions, positions, metric)
+            (rows1, rows2) = np.nonzero(distances <= radius)
+            expected = set(tuple(sorted((names[i], names[j]))) for (i, j) in zip(rows1, rows2)
+                           if i < j)
+            cross = brute_distances(positions, others, metric)
+            for (tree, other) in zip(trees(positions, names), trees(others, other_names)):
+                pairs = tree.within_pairs(radius, metric=metric)
+                self.assertEqual(len(pairs), len(expected))
+                self.assertEqual(set(tuple(sorted((a, b))) for (a, b, d) in pairs), expected)
+                join = tree.spatial_join(other, radius, metric)
+                for (i, name) in enumerate(names):
+                    inside = np.nonzero(cross[i] <= radius)[0]
+                    matches = join.get(name, [])
+                    self.assertEqual(sorted(m for (m, d) in matches),
+                                     sorted(other_names[j] for j in inside))
+                    self.assertEqual([d for (m, d) in matches], sorted(cross[i][inside].tolist()))
+        # a radius covering everything accepts whole node pairs
+        self.assertEqual(len(gqdual.within_pairs(tree, 100.0)), 250 * 249 // 2)
@@ -0,0 +1,120 @@
+import unittest
+import os
+import shutil
+import tempfile
+from .. import gqtree
+from .. import gqlinear
+from .. import gqfile
+from .samples import sample_points, sample_trees
+import numpy as np
+
+class TestFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tree.gqt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def points(self, npoints=150, dims=2):
+        (positions, names) = sample_points(npoints, dims, seed=dims, collisions=slice(5, 8))
+        infos = [{"w": i} if i % 3 else None for i in range(npoints)]
+        return (positions, names, infos)
+
+    def test_round_trip(self):
+        for dims in (2, 3):
+            (positions, names, infos) = self.points(dims=dims)
+            for tree in sample_trees([0.0] * dims, 8.0, 6, positions, names, infos):
+                tree.save(self.path)
+                loaded = gqfile.load(self.path)
+                self.assertEqual(loaded.__class__, tree.__class__)
+                self.assertEqual(loaded.list_dump(), tree.list_dump())
+                self.assertEqual(loaded.locate(names[6])[0], tree.locate(names[6])[0])
+                mapped = gqfile.load(self.path, mmap=True)
+                self.assertEqual(mapped.list_dump(), tree.list_dump())
+                self.assertEqual((mapped.size(), loaded.size()), (tree.size(), tree.size()))
+
+    def test_mapped_queries(self):
+        (positions, names, infos) = self.points(300)
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 8, positions, names, infos)
+        gqfile.save(tree, self.path)
+        mapped = gqfile.load(self.path, mmap=True)
+        self.assertTrue(isinstance(mapped.indices, np.memmap))
+        for query in positions[::30]:
+            (found, found_positions, distances) = mapped.nearest(query, 5)
+            (expected, expected_positions, expected_distances) = tree.nearest(query, 5)
+            self.assertEqual(found, expected)
+            self.assertTrue(np.allclose(distances, expected_distances))
+            self.assertEqual(mapped.within(query, 1.0)[0], tree.within(query, 1.0)[0])
+        self.assertEqual(mapped.query_box([1.0, 2.0], [4.0, 5.0]), tree.query_box([1.0, 2.0], [4.0, 5.0]))
+        for (position, name) in zip(positions, names):
+            self.assertTrue(name in mapped)
+            self.assertEqual(list(mapped.position_of(name)), list(position))
+        self.assertFalse("missing" in mapped)
+        self.assertRaises(ValueError, mapped.locate, "missing")
+        self.assertRaises(NotImplementedError, mapped.add, positions[0], "new")
+
+    def test_names(self):
+        rng = np.random.RandomState(1)
+        positions = rng.uniform(0.0, 1.0, size=(20, 2))
+        for names in (list(range(20)), [u"n\xe9%s" % i for i in range(20)],
+                      [(i, "tuple") for i in range(20)], []):
+            tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 1.0, 5, positions[:len(names)], names)
+            tree.save(self.path)
+            for mmap in (False, True):
+                loaded = gqfile.load(self.path, mmap, allow_pickle=True)
+                self.assertEqual(loaded.list_dump(), tree.list_dump())
+                for name in names:
+                    self.assertTrue(name in loaded)
+        with open(self.path, "wb") as f:
+            f.write(b"not a tree")
+        self.assertRaises(ValueError, gqfile.load, self.path)
+
+    def test_pickle(self):
+        rng = np.random.RandomState(1)
+        positions = rng.uniform(0.0, 1.0, size=(20, 2))
+        names = ["p%s" % i for i in range(20)]
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 1.0, 5, positions, names)
+        tree.save(self.path)
+        # files without pickles load by default
+        for mmap in (False, True):
+            self.assertEqual(gqfile.load(self.path, mmap).list_dump(), tree.list_dump())
+        for (names, infos) in (([(i, "tuple") for i in range(20)], None),
+                               (names, [{"w": (i, i)} for i in range(20)])):
+            tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 1.0, 5, positions, names, infos)
+            tree.save(self.path)
+            for mmap in (False, True):
+                self.assertRaises(ValueError, gqfile.load, self.path, mmap)
+                self.assertEqual(gqfile.load(self.path, mmap, allow_pickle=True).list_dump(),
+                                 tree.list_dump())
+
+    def test_json_infos(self):
+        rng = np.random.RandomState(1)
+        positions = rng.uniform(0.0, 1.0, size=(4, 2))
+        names = ["a", "b", "c", "d"]
+        infos = [{"w": 1, "tag": "x\xc3\xa9", "values": [1.5, None, True, 2 ** 70]},
+                 None, {"nested": {"k": ["v"]}}, {}]
+        for tree_class in (gqtree.GeneralizedQuadtree, gqlinear.LinearQuadtree):
+            tree = tree_class.from_points([0.0, 0.0], 1.0, 5, positions, names, infos)
+            tree.save(self.path)
+            # no pickles, so the default loads them
+            for mmap in (False, True):
+                loaded = gqfile.load(self.path, mmap)
+                self.assertEqual(loaded.list_dump(), tree.list_dump())
+                (rows, loaded_names, loaded_infos) = gqfile.tree_rows(loaded)[1:]
+                tag = loaded_infos[loaded_names.index("a")]["tag"]
+                self.assertEqual((type(tag), tag), (str, "x\xc3\xa9"))
+        self.assertTrue(gqfile.json_value(infos))
+        for info in ({"w": (1, 2)}, {1: "int key"}, {"w": float("nan")}, {"w": u"text"}):
+            self.assertFalse(gqfile.json_value(info))
+
+    def test_index_bits(self):
+        # 3 * 22 index bits do not fit in the uint64 column
+        tree = gqtree.GeneralizedQuadtree([0.0, 0.0, 0.0], 1.0, 22)
+        self.assertRaises(ValueError, tree.save, self.path)
+        self.assertFalse(os.path.exists(self.path))
+        tree = gqlinear.LinearQuadtree([0.0, 0.0], 1.0, 32)
+        tree.add([0.5, 0.5], "p")
+        tree.save(self.path)
+        self.assertEqual(gqfile.load(self.path).list_dump(), tree.list_dump())
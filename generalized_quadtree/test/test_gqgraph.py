@@ -0,0 +1,87 @@
+import unittest
+from .. import gqgraph
+import numpy as np
+
+def grid_edges(side):
+    edges = []
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side:
+                edges.append(((i, j), (i + 1, j)))
+            if j + 1 < side:
+                edges.append(((i, j), (i, j + 1)))
+    return edges
+
+def brute_summary(tree, name):
+    neighbours = [n for n in tree.neighbours(name) if n in tree.placed]
+    total = sum((tree.placed[n] for n in neighbours), np.zeros(tree.dimensions))
+    return (len(neighbours), total)
+
+class TestGraph(unittest.TestCase):
+
+    def test_endpoint_summary(self):
+        rng = np.random.RandomState(0)
+        names = range(60)
+        edges = [(int(a), int(b)) for (a, b) in rng.randint(0, 60, size=(150, 2))]
+        tree = gqgraph.GraphQuadTree([0.0, 0.0], 8.0, 6)
+        tree.add_edges(edges[:100])
+        positions = rng.uniform(0.0, 8.0, size=(60, 2))
+        for name in names[:30]:
+            tree.add(positions[name], name)
+            # compute and cache summaries as placement would
+            tree.endpoint_summary(names[-1])
+        # edges added after placement update cached summaries
+        tree.add_edges(edges[100:])
+        for name in names[30:45]:
+            tree.add(positions[name], name)
+        for name in names[45:]:
+            (count, total) = tree.endpoint_summary(name)
+            (expected_count, expected_total) = brute_summary(tree, name)
+            self.assertEqual(count, expected_count)
+            self.assertTrue(np.allclose(total, expected_total))
+        fresh = gqgraph.GraphQuadTree.from_points([0.0, 0.0], 8.0, 6, positions[:45], names[:45],
+                                                  edges=edges)
+        for name in names[45:]:
+            self.assertEqual(fresh.endpoint_summary(name)[0], tree.endpoint_summary(name)[0])
+        with self.assertRaises(ValueError):
+            tree.add(positions[0], names[0])
+        # removed names are counted again above their placed neighbours
+        for name in names[:10]:
+            tree.remove(name)
+        tree.move(names[10], positions[59])
+        for name in names[:10] + names[45:]:
+            (count, total) = tree.endpoint_summary(name)
+            (expected_count, expected_total) = brute_summary(tree, name)
+            self.assertEqual(count, expected_count)
+            self.assertTrue(np.allclose(total, expected_total))
+
+    def test_layout(self):
+        side = 12
+        edges = grid_edges(side)
+        tree = gqgraph.GraphQuadTree([0.0, 0.0], 1.0, 8)
+        tree.add_edges(edges)
+        (order, positions) = tree.layout()
+        self.assertEqual(sorted(order), sorted(tree.adjacency))
+        self.assertEqual(positions.shape, (side * side, 2))
+        # one name per voxel
+        self.assertEqual(len(set(tree.index(p) for p in positions)), side * side)
+        edge_length = np.mean([np.linalg.norm(tree.placed[a] - tree.placed[b]) for (a, b) in edges])
+        pair_length = np.mean([np.linalg.norm(p - q) for p in positions[::7] for q in positions[::5]])
+        self.assertTrue(edge_length < 0.25 * pair_length)
+
+    def test_graph_penalty(self):
+        tree = gqgraph.GraphQuadTree([0.0, 0.0], 1.0, 6)
+        tree.add_edges(grid_edges(5))
+        for name in gqgraph.breadth_first_order(tree.adjacency):
+            tree.add_at_min_penalty(None, name, vector_penalty_fn=tree.graph_penalty(name))
+        self.assertEqual(len(tree.placed), 25)
+        edge_length = np.mean([np.linalg.norm(tree.placed[a] - tree.placed[b])
+                               for (a, b) in grid_edges(5)])
+        self.assertTrue(edge_length < 0.5)
+
+    def test_breadth_first_order(self):
+        adjacency = {1: set([2]), 2: set([1, 3]), 3: set([2]), 4: set()}
+        order = gqgraph.breadth_first_order(adjacency)
+        self.assertEqual(order[0], 2)
+        self.assertEqual(sorted(order), [1, 2, 3, 4])
+        self.assertEqual(gqgraph.breadth_first_order(adjacency, [3, 4]), [3, 4])
@@ -0,0 +1,75 @@
+import unittest
+from .. import gqtree
+from .. import gqlinear
+from . import samples
+
+def sample_points(npoints, dims=2):
+    "Shared sample points with leaf collisions, and infos."
+    (positions, names) = samples.sample_points(npoints, dims, seed=3, collisions=slice(5, 8))
+    infos = [{"w": i} for i in range(npoints)]
+    return (positions, names, infos)
+
+class TestLinear(unittest.TestCase):
+
+    def test_list_dump_matches_object_tree(self):
+        for (dims, levels) in [(2, 2), (2, 6), (3, 4)]:
+            (positions, names, infos) = sample_points(60, dims)
+            origin = [0.0] * dims
+            gq = gqtree.GeneralizedQuadtree.from_points(origin, 8.0, levels, positions, names, infos)
+            bulk = gqlinear.LinearQuadtree.from_points(origin, 8.0, levels, positions, names, infos)
+            lq = gqlinear.LinearQuadtree(origin, 8.0, levels)
+            for i in range(len(names)):
+                lq.add(positions[i], names[i], infos[i])
+            self.assertEqual(bulk.list_dump(), gq.list_dump())
+            self.assertEqual(lq.list_dump(), gq.list_dump())
+            self.assertEqual(lq.get_names(), gq.root.get_names())
+
+    def test_walks(self):
+        (positions, names, infos) = sample_points(40)
+        gq = gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 5, positions, names, infos)
+        lq = gqlinear.LinearQuadtree.from_points([0, 0], 8.0, 5, positions, names, infos)
+        def visits(tree):
+            D = {}
+            def callback(node, tree, data):
+                D[(node.level, node.prefix)] = node.get_names()
+            tree.walk(callback)
+            return D
+        self.assertEqual(visits(lq), visits(gq))
+        def adjacent(tree):
+            D = {}
+            def callback(p, node, t, d):
+                D[(node.level, node.prefix)] = node.get_names()
+            tree.adjacency_walk((7.1, 1.1), callback)
+            return D
+        self.assertEqual(adjacent(lq), adjacent(gq))
+        def keys(nodes):
+            return [(node.level, node.prefix) for node in nodes]
+        for order in ("post", "pre", "bfs"):
+            self.assertEqual(keys(lq.iter_nodes(order)), keys(gq.iter_nodes(order)))
+        self.assertEqual(keys(lq.iter_leaves()), keys(gq.iter_leaves()))
+        self.assertEqual(keys(lq.iter_adjacent((7.1, 1.1))), keys(gq.iter_adjacent((7.1, 1.1))))
+        self.assertEqual(list(gqlinear.LinearQuadtree([0, 0], 8.0, 5).iter_leaves()), [])
+        # walks below a node, and indices of 64 bits with the root at level 0
+        for child in gq.root.child_nodes():
+            (found, expected) = ([], [])
+            lq.lookup_range(child.prefix, child.level).walk(
+                lq, lambda node, tree, data: found.append(node), None)
+            child.walk(gq, lambda node, tree, data: expected.append(node), None)
+            self.assertEqual(keys(found), keys(expected))
+        (positions, names, infos) = sample_points(40)
+        positions[:2] = [[0.0, 0.0], [7.99, 7.99]]
+        trees = [tree_class.from_points([0, 0], 8.0, 32, positions, names)
+                 for tree_class in (gqtree.GeneralizedQuadtree, gqlinear.LinearQuadtree)]
+        for order in ("post", "pre"):
+            self.assertEqual(keys(trees[1].iter_nodes(order)), keys(trees[0].iter_nodes(order)))
+
+    def test_lookup(self):
+        (positions, names, infos) = sample_points(40)
+        lq = gqlinear.LinearQuadtree.from_points([0, 0], 8.0, 5, positions, names, infos)
+        leaf = lq.lookup(positions[0])
+        self.assertEqual(leaf.get_names(), set(["p0", "p5", "p6", "p7"]))
+        self.assertEqual(leaf.data["p5"]["w"], 5)
+        self.assertEqual(lq.lookup((8.0 - 1e-9, 8.0 - 1e-9)), None)
+        node = lq.lookup_range(0, 1)
+        expected = set(name for (name, p) in zip(names, positions) if max(p) < 4.0)
+        self.assertEqual(node.get_names(), expected)
@@ -0,0 +1,90 @@
+import itertools
+import unittest
+from .. import gqtree
+from .. import gqmorton
+import numpy as np
+
+def decoded_neighbor(index, offsets, levels, dimensions, level):
+    "neighbor by decoding to int positions, offsetting and encoding."
+    shift = levels - level
+    ipos = (gqtree.int_index_inverse(index, levels, dimensions) >> shift) + offsets
+    if ipos.min() < 0 or ipos.max() >= 2 ** level:
+        return None
+    return gqtree.int_index(ipos << shift, levels)
+
+class TestMorton(unittest.TestCase):
+
+    def test_adjacent_prefixes(self):
+        (levels, dims) = (5, 3)
+        masks = gqmorton.dimension_masks(levels, dims)
+        tree = gqtree.GeneralizedQuadtree([0.0] * dims, 32.0, levels)
+        units = gqmorton.level_units(levels, dims, levels)
+        for (a, b, expected) in (([1, 2, 3], [2, 3, 4], True), ([1, 2, 3], [1, 2, 3], True),
+                                 ([0, 0, 0], [31, 0, 0], False), ([1, 2, 3], [1, 4, 3], False)):
+            self.assertEqual(gqmorton.adjacent_prefixes(tree.index(a), tree.index(b), masks, units),
+                             expected)
+
+    def test_neighbor(self):
+        rng = np.random.RandomState(0)
+        for (levels, dims) in ((6, 2), (4, 3), (3, 4), (40, 2), (21, 3), (32, 2), (64, 1)):
+            ipositions = rng.randint(0, 2 ** min(levels, 30), size=(30, dims))
+            indices = [gqtree.int_index(ipos, levels) for ipos in ipositions]
+            dtype = gqtree.index_dtype(levels, dims)
+            array = np.array(indices, dtype=dtype)
+            for level in (0, 1, levels // 2, levels):
+                for offsets in list(itertools.product((-1, 0, 1), repeat=dims))[::3]:
+                    expected = [decoded_neighbor(index, offsets, levels, dims, level)
+                                for index in indices]
+                    found = [gqmorton.neighbor(index, offsets, levels, dims, level)
+                             for index in indices]
+                    self.assertEqual(found, expected)
+                    (prefixes, inside) = gqmorton.neighbor_array(array, offsets, levels, dims, level)
+                    self.assertEqual(prefixes.dtype, dtype)
+                    self.assertEqual([int(prefix) if ok else None
+                                      for (prefix, ok) in zip(prefixes, inside)], expected)
+                    adjacent = [gqmorton.adjacent(index, other, levels, dims, level)
+                                for (index, other) in zip(indices, indices[1:] + indices[:1])]
+                    # numpy shifts int64 by the width modulo 64
+                    shift = min(levels - level, 63)
+                    self.assertEqual(adjacent, [
+                        np.abs((ipos >> shift) - (other >> shift)).max() <= 1 for (ipos, other)
+                        in zip(ipositions, np.roll(ipositions, -1, axis=0))])
+                    self.assertEqual(list(gqmorton.adjacent_array(
+                        array, np.roll(array, -1), levels, dims, level)), adjacent)
+                for dimension in range(dims):
+                    offsets = [0] * dims
+                    offsets[dimension] = -1
+                    self.assertEqual(
+                        [gqmorton.step(index, dimension, -1, levels, dims, level) for index in indices],
+                        [decoded_neighbor(index, offsets, levels, dims, level) for index in indices])
+
+    def test_hierarchy(self):
+        (levels, dims) = (6, 3)
+        tree = gqtree.GeneralizedQuadtree([0.0] * dims, 64.0, levels)
+        index = tree.index([37.0, 5.0, 62.0])
+        for level in range(levels + 1):
+            prefix = gqmorton.ancestor(index, levels, dims, level)
+            if level < levels:
+                self.assertEqual(prefix, tree.quadrant(index, level + 1)[0])
+            self.assertEqual(list(gqmorton.ancestor_array(np.array([index], dtype=np.uint64),
+                                                          levels, dims, level)), [prefix])
+            corner = gqmorton.coordinates(index, levels, dims, level)
+            self.assertEqual(corner, list((np.array([37, 5, 62]) >> (levels - level)) << (levels - level)))
+            self.assertEqual(list(tree.index_corner(prefix)), corner)
+            if level:
+                parent = gqmorton.parent(prefix, levels, dims, level)
+                self.assertEqual(parent, gqmorton.ancestor(index, levels, dims, level - 1))
+                below = list(gqmorton.children(parent, levels, dims, level - 1))
+                self.assertEqual(len(below), 2 ** dims)
+                self.assertTrue(prefix in below)
+                self.assertEqual(set(gqmorton.parent(child, levels, dims, level) for child in below),
+                                 set([parent]))
+        self.assertEqual(list(tree.index_corner(index, 1)), [32.0, 0.0, 32.0])
+        self.assertRaises(AssertionError, gqmorton.parent, 0, levels, dims, 0)
+        self.assertRaises(AssertionError, gqmorton.children, 0, levels, dims, levels)
+        # prefixes beyond a C long
+        (levels, dims) = (12, 6)
+        prefix = (2 ** (levels * dims) - 1) >> dims << dims
+        below = list(gqmorton.children(prefix >> 2 * dims << 2 * dims, levels, dims, levels - 2))
+        self.assertEqual(len(below), 2 ** dims)
+        self.assertEqual(below[-1], prefix)
@@ -0,0 +1,115 @@
+import unittest
+from .. import gqtree
+from .. import gqlinear
+from .. import gqneighbors
+from .samples import sample_points
+import numpy as np
+
+def brute_neighbors(tree, node):
+    "Keys of the neighbours of node, from the int positions of all nodes."
+    nodes = list(tree.iter_nodes())
+    level = gqneighbors.node_level(tree, node)
+    ipos = tree.node_int_position(node)
+    ancestors = set(id(ancestor) for ancestor in gqneighbors.ancestors(tree, node))
+    found = []
+    for other in nodes:
+        other_level = gqneighbors.node_level(tree, other)
+        if other is node or id(other) in ancestors or other_level > level:
+            continue
+        shift = tree.levels - other_level
+        offsets = (tree.node_int_position(other) >> shift) - (ipos >> shift)
+        if np.abs(offsets).max() <= 1:
+            found.append(gqneighbors.node_key(tree, other))
+    return sorted(found)
+
+def index_state(index):
+    return (sorted(index.nodes), index.neighbors, index.listed_by)
+
+class TestNeighbors(unittest.TestCase):
+
+    def test_neighbors(self):
+        for (dims, compact) in ((2, False), (2, True), (3, False)):
+            (positions, names) = sample_points(120, dims, cluster=True)
+            tree = gqtree.GeneralizedQuadtree.from_points([0.0] * dims, 8.0, 5, positions, names,
+                                                          compact=compact)
+            searched = dict((id(node), tree.neighbors(node)) for node in tree.iter_nodes())
+            index = tree.enable_neighbor_index()
+            for node in tree.iter_nodes():
+                expected = brute_neighbors(tree, node)
+                found = tree.neighbors(node)
+                self.assertEqual([gqneighbors.node_key(tree, other) for other in found], expected)
+                self.assertEqual(found, searched[id(node)])
+            self.assertRaises(ValueError, tree.neighbors, gqtree.GeneralizedQuadtree(
+                [0.0] * dims, 8.0, 5).new_leaf(0, [0.0] * dims, "x"))
+            # adjacent answers from the index match the int position test
+            keys = sorted(index.nodes)
+            for (level, prefix) in keys[::7]:
+                for (other_level, other_prefix) in keys[::5]:
+                    found = tree.adjacent(prefix, other_prefix, level)
+                    tree.neighbor_index = None
+                    self.assertEqual(found, tree.adjacent(prefix, other_prefix, level))
+                    tree.neighbor_index = index
+
+    def test_maintained(self):
+        (positions, names) = sample_points(150, cluster=True)
+        tree = gqtree.GeneralizedQuadtree([0.0, 0.0], 8.0, 5)
+        index = tree.enable_neighbor_index()
+        for (position, name) in zip(positions, names):
+            tree.add(position, name)
+        self.assertEqual(index_state(index), index_state(gqneighbors.NeighborIndex(tree)))
+        for name in names[::3]:
+            tree.remove(name)
+        for name in names[1::6]:
+            tree.move(name, np.array([7.9, 0.1]))
+        self.assertEqual(index_state(index), index_state(gqneighbors.NeighborIndex(tree)))
+        for node in tree.iter_nodes():
+            self.assertEqual([gqneighbors.node_key(tree, other) for other in tree.neighbors(node)],
+                             brute_neighbors(tree, node))
+        tree.move_many(names[2::3], np.minimum(positions[2::3] + 0.01, 7.99))
+        self.assertEqual(index_state(index), index_state(gqneighbors.NeighborIndex(tree)))
+        for name in list(tree.name_index):
+            tree.remove(name)
+        self.assertEqual(index.nodes, {})
+
+    def test_linear(self):
+        # the index of a linear quadtree is rebuilt as its nodes are derived again
+        (positions, names) = sample_points(150, cluster=True)
+        trees = [gqtree.GeneralizedQuadtree([0.0, 0.0], 8.0, 5),
+                 gqlinear.LinearQuadtree([0.0, 0.0], 8.0, 5)]
+        index = trees[1].enable_neighbor_index()
+        for tree in trees:
+            for (position, name) in zip(positions, names):
+                tree.add(position, name)
+            for name in names[::3]:
+                tree.remove(name)
+        self.assertEqual(index_state(index), index_state(gqneighbors.NeighborIndex(trees[1])))
+        # nodes from a walk are views, looked up by level and prefix
+        (expected, found) = [dict(
+            (gqneighbors.node_key(tree, node),
+             [gqneighbors.node_key(tree, other) for other in tree.neighbors(node)])
+            for node in tree.iter_nodes()) for tree in trees]
+        self.assertEqual(found, expected)
+        for query in positions[::11]:
+            self.assertEqual([gqneighbors.node_key(trees[1], node)
+                              for node in trees[1].iter_adjacent(query)],
+                             [gqneighbors.node_key(trees[0], node)
+                              for node in trees[0].iter_adjacent(query)])
+
+    def test_adjacency_walk(self):
+        (positions, names) = sample_points(200, cluster=True)
+        queries = list(positions[::17]) + [[0.1, 7.9], [3.2, 3.3], [7.99, 7.99]]
+        for compact in (False, True):
+            tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions, names,
+                                                          compact=compact)
+            expected = [list(tree.iter_adjacent(query)) for query in queries]
+            tree.enable_neighbor_index()
+            self.assertEqual([list(tree.iter_adjacent(query)) for query in queries], expected)
+            visited = []
+            tree.adjacency_walk(queries[0], lambda position, node, tree, data: visited.append(node))
+            self.assertEqual(visited, expected[0])
+        # a root below the top level need not hold the position
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions[:50] / 8 + 6,
+                                                      names[:50])
+        expected = list(tree.iter_adjacent([0.5, 0.5]))
+        tree.enable_neighbor_index()
+        self.assertEqual(list(tree.iter_adjacent([0.5, 0.5])), expected)
@@ -0,0 +1,70 @@
+import unittest
+from .. import gqtree
+from .. import gqparallel
+from .samples import sample_points
+import numpy as np
+
+class TestParallel(unittest.TestCase):
+
+    def points(self, npoints=400, dims=2):
+        # leaf collisions, and a name repeated in two quadrants
+        (positions, names) = sample_points(npoints, dims, seed=dims, collisions=slice(10, 15))
+        positions[20] = [7.5] * dims
+        positions[21] = [0.5] * dims
+        names[21] = names[20]
+        infos = [{"w": i} for i in range(npoints)]
+        return (positions, names, infos)
+
+    def assertSameTree(self, tree, expected):
+        self.assertEqual(tree.list_dump(), expected.list_dump())
+        self.assertEqual(sorted(tree.name_index), sorted(expected.name_index))
+        for (name, (index, leaf)) in expected.name_index.items():
+            self.assertEqual(tree.locate(name)[0], index)
+            self.assertEqual(tree.locate(name)[1].list_dump(tree), leaf.list_dump(expected))
+
+    def test_from_points(self):
+        for (dims, compact) in ((2, False), (2, True), (3, False)):
+            (positions, names, infos) = self.points(dims=dims)
+            origin = [0.0] * dims
+            expected = gqtree.GeneralizedQuadtree.from_points(origin, 8.0, 6, positions, names, infos,
+                                                              compact)
+            # workers beyond the top level quadrants split deeper
+            for workers in (1, 3, 2 ** dims + 1):
+                tree = gqtree.GeneralizedQuadtree.from_points(origin, 8.0, 6, positions, names, infos,
+                                                              compact, workers=workers)
+                self.assertSameTree(tree, expected)
+        self.assertEqual(gqparallel.split_level(tree, 9), 2)
+        # points in one quadrant, and none
+        (positions, names, infos) = self.points(50)
+        positions = positions / 4.0
+        for count in (50, 0):
+            expected = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions[:count],
+                                                              names[:count])
+            tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions[:count],
+                                                          names[:count], workers=2)
+            self.assertSameTree(tree, expected)
+
+    def test_query_pool(self):
+        (positions, names, infos) = self.points(300)
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions, names)
+        rng = np.random.RandomState(5)
+        queries = rng.uniform(0.0, 8.0, size=(37, 2))
+        lowers = queries - 1.0
+        uppers = queries + 1.5
+        for share in ("fork", "file"):
+            with tree.query_pool(workers=2, share=share) as pool:
+                found = pool.nearest_many(queries, 3)
+                expected = tree.nearest_many(queries, 3)
+                self.assertEqual([result[0] for result in found], [result[0] for result in expected])
+                for (result, expected_result) in zip(found, expected):
+                    self.assertTrue(np.allclose(result[2], expected_result[2]))
+                found = pool.within_many(queries, 1.2, "linf")
+                expected = tree.within_many(queries, 1.2, "linf")
+                self.assertEqual([sorted(result[0]) for result in found],
+                                 [sorted(result[0]) for result in expected])
+                self.assertEqual(pool.query_boxes(lowers, uppers), tree.query_boxes(lowers, uppers))
+                self.assertEqual(pool.nearest_many(np.zeros((0, 2))), [])
+        pool = gqparallel.QueryPool(tree, 3, shard_rows=5)
+        self.assertEqual([result[0] for result in pool.nearest_many(queries)],
+                         [result[0] for result in tree.nearest_many(queries)])
+        pool.close()
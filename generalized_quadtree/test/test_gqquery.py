@@ -0,0 +1,76 @@
+import unittest
+from .. import gqtree
+from .. import gqquery
+from .samples import sample_points, sample_trees
+import numpy as np
+
+def brute_force(positions, names, query, metric):
+    order = gqquery.metric_order(metric)
+    distances = gqquery.norms(positions - query, order)
+    return sorted(zip(distances, names))
+
+class TestQuery(unittest.TestCase):
+
+    def trees(self, dims, npoints=150):
+        (positions, names) = sample_points(npoints, dims, seed=dims, side=10.0)
+        trees = sample_trees([0.0] * dims, 10.0, 7, positions, names)
+        queries = np.random.RandomState(dims + 1).uniform(-2.0, 12.0, size=(10, dims))
+        return (positions, names, trees, queries)
+
+    def test_nearest(self):
+        for dims in (2, 3):
+            (positions, names, trees, queries) = self.trees(dims)
+            for metric in ("l1", "l2", "linf"):
+                for tree in trees:
+                    for query in queries:
+                        expected = brute_force(positions, names, query, metric)[:5]
+                        (found, found_positions, distances) = tree.nearest(query, 5, metric)
+                        self.assertEqual(found, [name for (d, name) in expected])
+                        np.testing.assert_allclose(distances, [d for (d, name) in expected])
+                        self.assertEqual(found_positions.shape, (5, dims))
+
+    def test_within(self):
+        for dims in (2, 3):
+            (positions, names, trees, queries) = self.trees(dims)
+            for metric in ("l1", "l2", "linf"):
+                for tree in trees:
+                    for query in queries:
+                        expected = [(d, name) for (d, name) in
+                                    brute_force(positions, names, query, metric) if d <= 2.5]
+                        (found, found_positions, distances) = tree.within(query, 2.5, metric)
+                        self.assertEqual(found, [name for (d, name) in expected])
+
+    def test_batched(self):
+        (positions, names, trees, queries) = self.trees(2)
+        tree = trees[0]
+        for (query, result) in zip(queries, tree.nearest_many(queries, 3, "l1")):
+            self.assertEqual(result[0], tree.nearest(query, 3, "l1")[0])
+        for (query, result) in zip(queries, tree.within_many(queries, 1.5)):
+            self.assertEqual(result[0], tree.within(query, 1.5)[0])
+        empty = gqtree.GeneralizedQuadtree([0, 0], 1.0, 3)
+        (found, found_positions, distances) = empty.nearest((0.5, 0.5), 2)
+        self.assertEqual((found, found_positions.shape, len(distances)), ([], (0, 2), 0))
+        with self.assertRaises(ValueError):
+            tree.nearest((0, 0), 1, "l3")
+
+    def test_query_box(self):
+        for dims in (2, 3):
+            (positions, names, trees, queries) = self.trees(dims, npoints=300)
+            rng = np.random.RandomState(7)
+            corners = rng.uniform(-1.0, 11.0, size=(20, 2, dims))
+            boxes = [(c.min(axis=0), c.max(axis=0)) for c in corners]
+            boxes.append(([-1.0] * dims, [11.0] * dims))
+            boxes.append(([20.0] * dims, [30.0] * dims))
+            # corners exactly on voxel boundaries
+            boxes.append(([2.5] * dims, [7.5] * dims))
+            for tree in trees:
+                for (lower, upper) in boxes:
+                    inside = ((positions >= lower) & (positions <= upper)).all(axis=1)
+                    expected = set(name for (name, ok) in zip(names, inside) if ok)
+                    self.assertEqual(tree.query_box(lower, upper), expected)
+            lowers = [lower for (lower, upper) in boxes]
+            uppers = [upper for (lower, upper) in boxes]
+            for tree in trees:
+                self.assertEqual(tree.query_boxes(lowers, uppers),
+                                 [tree.query_box(l, u) for (l, u) in boxes])
+            self.assertEqual(trees[0].query_boxes(lowers[:0], uppers[:0]), [])
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from .. import gqtree
+from .. import gqserver
+from .. import gqneighbors
+import numpy as np
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.positions = rng.uniform(0.0, 8.0, size=(200, 2))
+        self.names = ["p%s" % i for i in range(200)]
+        self.tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, self.positions,
+                                                           self.names)
+        self.directory = tempfile.mkdtemp()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+        shutil.rmtree(self.directory)
+
+    def start(self, tree, address=None, **options):
+        if address is None:
+            address = os.path.join(self.directory, "socket%s" % len(self.servers))
+        server = gqserver.serve(tree, address, **options)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return server.server_address
+
+    def test_queries(self):
+        tree = self.tree
+        for address in (self.start(tree), self.start(tree, ("127.0.0.1", 0))):
+            client = gqserver.QueryClient(address)
+            position = [3.0, 4.0]
+            response = client.nearest(position, k=3)
+            (names, positions, distances) = tree.nearest(position, 3)
+            self.assertEqual(response["names"], names)
+            self.assertEqual(response["positions"], positions.tolist())
+            self.assertEqual(response["distances"], distances.tolist())
+            response = client.box([1.0, 1.0], [4.0, 3.0])
+            self.assertEqual(response["names"], sorted(tree.query_box([1.0, 1.0], [4.0, 3.0])))
+            found = []
+            tree.adjacency_walk(position, lambda position, node, tree, data: found.append(
+                list(gqneighbors.node_key(tree, node))))
+            self.assertEqual(client.adjacent(position)["nodes"], found)
+            info = client.info()
+            self.assertEqual((info["origin"], info["sidelength"], info["size"]),
+                             ([0.0, 0.0], 8.0, 200))
+            self.assertIn("error", client.request({"op": "nearest", "position": [1.0]}))
+            self.assertIn("error", client.request({"op": "unknown"}))
+            self.assertIn("error", client.request({"op": "nearest", "position": [1.0, 1.0],
+                                                   "metric": "l3"}))
+            # the connection is still usable after errors
+            self.assertEqual(client.nearest(position)["names"], names[:1])
+            client.close()
+
+    def test_load(self):
+        # small queues and batches, for backpressure
+        address = self.start(self.tree, window=0.001, max_batch=4, max_pending=2)
+        client = gqserver.QueryClient(address)
+        info = client.info()
+        client.close()
+        requests = []
+        for op in ("nearest", "box", "adjacent"):
+            requests.extend(gqserver.random_requests(info, op, 40, box_side=0.1))
+        summary = gqserver.load(address, requests, clients=6)
+        self.assertEqual((summary["requests"], summary["errors"]), (120, 0))
+        self.assertTrue(0 < summary["p50"] <= summary["p99"])
+        batcher = self.servers[0].batcher
+        self.assertEqual(batcher.requests, 121)
+        self.assertTrue(batcher.batches < batcher.requests)
+
+    def test_batch(self):
+        # batched responses match the requests they answer
+        batcher = gqserver.Batcher(self.tree)
+        replies = []
+        requests = [{"id": i, "op": ("nearest", "box")[i % 2], "position": position.tolist(),
+                     "lower": (position - 1.0).tolist(), "upper": (position + 1.0).tolist()}
+                    for (i, position) in enumerate(self.positions[:20])]
+        requests.append({"id": "bad", "op": "box"})
+        batcher.execute([(request, replies.append) for request in requests])
+        by_id = dict((response["id"], response) for response in replies)
+        self.assertEqual(len(by_id), 21)
+        self.assertIn("error", by_id["bad"])
+        for (i, position) in enumerate(self.positions[:20]):
+            if i % 2:
+                self.assertEqual(by_id[i]["names"],
+                                 sorted(self.tree.query_box(position - 1.0, position + 1.0)))
+            else:
+                self.assertEqual(by_id[i]["names"], [self.names[i]])
+
+    def test_failures(self):
+        # failing requests are answered and the batcher goes on serving
+        tree = self.tree
+        tree.add([7.9, 7.9], "\xff")
+        address = self.start(tree)
+        client = gqserver.QueryClient(address)
+        self.assertIn("error", client.box([7.5, 7.5], [8.0, 8.0]))
+        self.assertEqual(client.info()["size"], 201)
+        def fail(*args):
+            raise RuntimeError("changed during the batch")
+        tree.nearest_many = fail
+        self.assertIn("RuntimeError", client.nearest([1.0, 1.0])["error"])
+        self.assertEqual(client.box([0.0, 0.0], [0.1, 0.1])["names"],
+                         sorted(tree.query_box([0.0, 0.0], [0.1, 0.1])))
+        self.assertTrue(self.servers[0].batcher.thread.is_alive())
+        client.close()
+
+    def test_snapshots(self):
+        tree = self.tree
+        tree.enable_snapshots()
+        address = self.start(tree)
+        client = gqserver.QueryClient(address)
+        tree.add([7.9, 7.9], "new")
+        self.assertEqual(client.nearest([7.9, 7.9])["names"], ["new"])
+        self.assertEqual(client.info()["size"], 201)
+        client.close()
@@ -0,0 +1,150 @@
+import threading
+import unittest
+from .. import gqtree
+from .. import gqlinear
+from .. import gqgraph
+from .. import gqaggregate
+from .samples import sample_points
+
+class TestSnapshots(unittest.TestCase):
+
+    def points(self, npoints):
+        (positions, names) = sample_points(npoints, cluster=True)
+        # some names sharing voxels
+        positions[npoints // 4:npoints // 2] = positions[:npoints // 4]
+        return (positions, names)
+
+    def test_updates(self):
+        for (compact, extras) in ((False, False), (True, False), (False, True)):
+            (positions, names) = self.points(80)
+            trees = []
+            for persistent in (True, False):
+                tree = gqtree.GeneralizedQuadtree([0.0, 0.0], 8.0, 5, compact=compact)
+                tree.add_reducer(gqaggregate.count_reducer())
+                if persistent:
+                    tree.enable_snapshots()
+                if extras:
+                    tree.enable_neighbor_index()
+                    tree.enable_query_cache()
+                trees.append(tree)
+            (persistent, plain) = trees
+            snapshots = []
+            def step():
+                self.assertEqual(persistent.list_dump(), plain.list_dump())
+                for tree in trees:
+                    if tree.root is not None:
+                        self.assertEqual(tree.root.get_names(), set(tree.name_index))
+                        self.assertEqual(tree.get_aggregate("count"), len(tree.name_index))
+                if extras:
+                    self.assertEqual(persistent.neighbor_index.neighbors,
+                                     plain.neighbor_index.neighbors)
+                snapshot = persistent.snapshot()
+                snapshots.append((snapshot, plain.list_dump(), dict(
+                    (name, list(plain.position_of(name))) for name in plain.name_index)))
+                # queries leave the caches the next update copies from filled
+                for tree in trees:
+                    tree.query_box([3.0, 3.0], [5.0, 5.0])
+                    if tree.root is not None:
+                        tree.root.get_names()
+                        tree.get_aggregate("count")
+            for (position, name) in zip(positions, names):
+                persistent.add(position, name)
+                plain.add(position, name)
+                step()
+            for name in names[::3]:
+                self.assertEqual(repr(persistent.remove(name)), repr(plain.remove(name)))
+                step()
+            for (name, position) in zip(names[1::3], positions[::3]):
+                persistent.move(name, position)
+                plain.move(name, position)
+                step()
+            for (snapshot, dump, located) in snapshots:
+                self.assertEqual(snapshot.list_dump(), dump)
+                self.assertEqual(snapshot.size(), len(located))
+                self.assertEqual(dict((name, list(snapshot.position_of(name))) for name in located),
+                                 located)
+                for name in names[:5]:
+                    self.assertEqual(name in snapshot, name in located)
+
+    def test_read_only(self):
+        (positions, names) = self.points(20)
+        tree = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 5, positions, names)
+        self.assertRaises(ValueError, tree.snapshot)
+        tree.enable_snapshots()
+        snapshot = tree.snapshot()
+        self.assertIs(snapshot.snapshot(), snapshot)
+        self.assertRaises(NotImplementedError, snapshot.add, [1.0, 1.0], "new")
+        self.assertRaises(NotImplementedError, snapshot.remove, names[0])
+        self.assertRaises(NotImplementedError, snapshot.move, names[0], [1.0, 1.0])
+        self.assertRaises(NotImplementedError, snapshot.move_many, names, positions)
+        tree.remove(names[0])
+        self.assertEqual(snapshot.nearest(positions[0])[0], [names[0]])
+        self.assertNotIn(names[0], tree)
+        self.assertRaises(NotImplementedError, gqgraph.GraphQuadTree([0.0, 0.0], 8.0, 5)
+                          .enable_snapshots)
+
+    def test_linear(self):
+        (positions, names) = self.points(60)
+        tree = gqlinear.LinearQuadtree([0.0, 0.0], 8.0, 5)
+        self.assertRaises(ValueError, tree.snapshot)
+        tree.enable_snapshots()
+        snapshots = []
+        def step():
+            snapshots.append((tree.snapshot(), tree.list_dump(),
+                              dict((name, list(tree.position_of(name))) for name in tree.name_index)))
+        for (position, name) in zip(positions, names):
+            tree.add(position, name)
+            step()
+        for name in names[::3]:
+            tree.remove(name)
+            step()
+        for (name, position) in zip(names[1::3], positions[::3]):
+            tree.move(name, position)
+            step()
+        # a name added again in its voxel replaces its row
+        tree.add(positions[2] + 0.01, names[2], {"w": 2})
+        step()
+        tree.move_many(names[2::3], positions[1::3])
+        step()
+        for (snapshot, dump, located) in snapshots:
+            self.assertEqual(snapshot.list_dump(), dump)
+            self.assertEqual(dict((name, list(snapshot.position_of(name))) for name in located),
+                             located)
+            self.assertEqual(snapshot.query_box([0.0, 0.0], [8.0, 8.0]), set(located))
+        snapshot = snapshots[-1][0]
+        self.assertIs(snapshot.snapshot(), snapshot)
+        self.assertRaises(NotImplementedError, snapshot.add, [1.0, 1.0], "new")
+        self.assertRaises(NotImplementedError, snapshot.remove, names[1])
+        self.assertRaises(NotImplementedError, snapshot.add_points, positions[:2], ["a", "b"])
+
+    def test_threads(self):
+        for tree_class in (gqtree.GeneralizedQuadtree, gqlinear.LinearQuadtree):
+            self.check_threads(tree_class([0.0, 0.0], 8.0, 8))
+
+    def check_threads(self, tree):
+        (positions, names) = self.points(400)
+        tree.enable_snapshots()
+        order = dict((name, i) for (i, name) in enumerate(names))
+        errors = []
+        def writer():
+            for (position, name) in zip(positions, names):
+                tree.add(position, name)
+        def reader():
+            while writer_thread.is_alive():
+                snapshot = tree.snapshot()
+                if snapshot.root is None:
+                    continue
+                found = sorted(order[name] for name in snapshot.query_box([0.0, 0.0], [8.0, 8.0]))
+                # a snapshot holds the names added before it was taken
+                if found != list(range(len(found))):
+                    errors.append(found)
+        writer_thread = threading.Thread(target=writer)
+        readers = [threading.Thread(target=reader) for i in range(3)]
+        writer_thread.start()
+        for thread in readers:
+            thread.start()
+        writer_thread.join()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(tree.snapshot().query_box([0.0, 0.0], [8.0, 8.0])), len(names))
@@ -0,0 +1,108 @@
+import unittest
+from .. import gqtree
+from .. import gqlinear
+import numpy as np
+
+def node_penalty_fn(node, qindex, voxels, corner):
+    if qindex == node.prefix:
+        return len(node.get_names())
+    return 0
+
+class TestStats(unittest.TestCase):
+
+    def tree(self, npoints=50):
+        rng = np.random.RandomState(0)
+        positions = rng.uniform(0.0, 8.0, size=(npoints, 2))
+        names = ["p%s" % i for i in range(npoints)]
+        return (gqtree.GeneralizedQuadtree([0.0, 0.0], 8.0, 4), positions, names)
+
+    def test_disabled(self):
+        (tree, positions, names) = self.tree()
+        for (position, name) in zip(positions, names):
+            tree.add(position, name)
+        self.assertIsNone(tree.stats_recorder)
+        self.assertIsNone(tree.stats())
+
+    def test_counters(self):
+        (tree, positions, names) = self.tree()
+        events = []
+        tree.enable_stats(lambda operation, event: events.append((operation, event)))
+        for (position, name) in zip(positions, names):
+            tree.add(position, name)
+        stats = tree.stats()
+        self.assertEqual(stats["counters"]["int_index"], len(names))
+        self.assertEqual(stats["calls"]["add"], len(names))
+        depth = stats["distributions"]["combine_depth"]
+        self.assertEqual(depth["count"], len(names))
+        self.assertTrue(1 <= depth["max"] <= tree.levels + 1)
+        self.assertEqual(len(events), len(names))
+        self.assertEqual([operation for (operation, event) in events], ["add"] * len(names))
+        self.assertEqual(events[0][1]["int_index"], 1)
+        self.assertTrue(events[0][1]["seconds"] >= 0)
+        # walks count the nodes visited
+        tree.walk(lambda node, tree, data: None)
+        self.assertEqual(tree.stats()["counters"]["walk_nodes"], len(list(tree.iter_nodes())))
+        self.assertEqual(events[-1][0], "walk")
+        visited = []
+        tree.adjacency_walk(positions[0], lambda position, node, tree, data: visited.append(node))
+        self.assertEqual(tree.stats()["counters"]["adjacency_walk_nodes"], len(visited))
+        tree.stats_recorder.reset()
+        self.assertEqual(tree.stats()["counters"], {})
+        tree.disable_stats()
+        self.assertIsNone(tree.stats())
+
+    def test_linear(self):
+        # the linear tree records through the inherited add
+        (plain, positions, names) = self.tree()
+        tree = gqlinear.LinearQuadtree([0.0, 0.0], 8.0, 4)
+        tree.enable_stats()
+        for (position, name) in zip(positions, names):
+            tree.add(position, name)
+            plain.add(position, name)
+        self.assertEqual(tree.list_dump(), plain.list_dump())
+        stats = tree.stats()
+        self.assertEqual(stats["calls"]["add"], len(names))
+        self.assertEqual(stats["counters"]["int_index"], len(names))
+        depth = stats["distributions"]["combine_depth"]
+        self.assertEqual(depth["count"], len(names))
+        self.assertTrue(1 <= depth["max"] <= tree.levels + 1)
+        tree.walk(lambda node, tree, data: None)
+        self.assertEqual(tree.stats()["counters"]["walk_nodes"], len(list(tree.iter_nodes())))
+        visited = []
+        tree.adjacency_walk(positions[0], lambda position, node, tree, data: visited.append(node))
+        self.assertEqual(tree.stats()["counters"]["adjacency_walk_nodes"], len(visited))
+
+    def test_min_penalty(self):
+        tree = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=2)
+        plain = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=2)
+        events = []
+        tree.enable_stats(lambda operation, event: events.append((operation, event)))
+        for name in (str(i) for i in range(16)):
+            tree.add_at_min_penalty(node_penalty_fn, name)
+            plain.add_at_min_penalty(node_penalty_fn, name)
+        # recording does not change the placements
+        self.assertEqual(tree.list_dump(), plain.list_dump())
+        stats = tree.stats()
+        self.assertEqual(stats["calls"]["add_at_min_penalty"], 16)
+        self.assertEqual(stats["calls"]["add"], 16)
+        self.assertTrue(stats["counters"]["node_penalty_fn_calls"] > 0)
+        self.assertEqual(stats["counters"]["node_penalty_fn_calls"],
+                         stats["counters"]["penalty_evaluations"])
+        self.assertIn("frontier_size.0", stats["distributions"])
+        self.assertIn("penalties", stats["seconds"])
+        self.assertIn("insert", stats["seconds"])
+        # the nested add reports its own event and adds to the outer one
+        outer = [event for (operation, event) in events if operation == "add_at_min_penalty"]
+        self.assertEqual(len(outer), 16)
+        self.assertTrue(outer[-1]["add_seconds"] <= outer[-1]["seconds"])
+        self.assertEqual(outer[-1]["int_index"], 1)
+
+    def test_placement(self):
+        tree = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=2)
+        tree.enable_stats()
+        placement = gqtree.PenaltyPlacement(tree, node_penalty_fn, reuse=True)
+        for name in (str(i) for i in range(8)):
+            placement.add(name)
+        stats = tree.stats()
+        self.assertEqual(stats["calls"]["add_at_min_penalty"], 8)
+        self.assertTrue(stats["counters"]["penalty_reused"] > 0)
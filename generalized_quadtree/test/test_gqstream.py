@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+from .. import gqtree
+from .. import gqfile
+from .. import gqstream
+from .samples import sample_points
+import numpy as np
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tree.gqt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def points(self, npoints=500):
+        # leaf collisions, and a name repeated at one index in another chunk
+        (positions, names) = sample_points(npoints, seed=3, collisions=slice(10, 20))
+        positions[npoints - 1] = positions[1]
+        names[npoints - 1] = names[1]
+        return (positions, names)
+
+    def chunks(self, positions, names, size):
+        return [(positions[i:i + size], names[i:i + size]) for i in range(0, len(names), size)]
+
+    def test_build_file(self):
+        (positions, names) = self.points()
+        expected = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions, names)
+        reports = []
+        # a small budget spills many runs
+        for budget in (2000, 1 << 20):
+            rows = gqstream.build_file(self.chunks(positions, names, 70), self.path, [0.0, 0.0], 8.0, 6,
+                                       budget=budget, directory=self.directory, progress=reports.append)
+            self.assertEqual(rows, len(positions) - 1)
+            self.assertEqual(gqfile.load(self.path).list_dump(), expected.list_dump())
+            mapped = gqfile.load(self.path, mmap=True)
+            for name in names:
+                self.assertTrue(name in mapped)
+            self.assertFalse("missing" in mapped)
+        self.assertEqual([report["chunk"] for report in reports], range(1, 9) * 2)
+        self.assertEqual(reports[-1]["total"], len(names))
+        self.assertTrue(reports[7]["runs"] > 5)
+        # only the temporary directory of the builder is removed
+        self.assertEqual(os.listdir(self.directory), ["tree.gqt"])
+
+    def test_names(self):
+        (positions, names) = self.points(100)
+        for names in (range(100), [u"n\xe9%s" % i for i in range(100)]):
+            gqstream.build_file(self.chunks(positions, names, 30), self.path, [0.0, 0.0], 8.0, 6,
+                                budget=1000)
+            expected = gqtree.GeneralizedQuadtree.from_points([0.0, 0.0], 8.0, 6, positions, names)
+            self.assertEqual(gqfile.load(self.path).list_dump(), expected.list_dump())
+        with self.assertRaises(ValueError):
+            gqstream.build_file([(positions[:2], ["a", "b"]), (positions[2:4], [1, 2])], self.path,
+                                [0.0, 0.0], 8.0, 6)
+        gqstream.build_file([], self.path, [0.0, 0.0], 8.0, 6)
+        self.assertEqual(gqfile.load(self.path).root, None)
+
+    def test_chunk_readers(self):
+        (positions, names) = self.points(50)
+        npy_path = os.path.join(self.directory, "points.npy")
+        np.save(npy_path, positions)
+        chunks = list(gqstream.npy_chunks([npy_path, npy_path], rows=20))
+        self.assertEqual([len(chunk[1]) for chunk in chunks], [20, 20, 10] * 2)
+        self.assertEqual(chunks[-1][1][-1], 99)
+        self.assertTrue(np.array_equal(chunks[1][0], positions[20:40]))
+        csv_path = os.path.join(self.directory, "points.csv")
+        with open(csv_path, "w") as f:
+            for (name, position) in zip(names, positions):
+                f.write("%s,%r,%r\n" % (name, position[0], position[1]))
+        chunks = list(gqstream.csv_chunks(csv_path, rows=20, name_column=0))
+        self.assertEqual([name for chunk in chunks for name in chunk[1]], names)
+        self.assertTrue(np.array_equal(np.vstack([chunk[0] for chunk in chunks]), positions))
@@ -1,7 +1,10 @@
 import unittest
 from .. import gqtree
+from .. import gqlinear
+from .. import gqaggregate
 from ..gqtree import qs
 import pprint
+import numpy as np
 
 class TestDR(unittest.TestCase):
 
@@ -22,6 +25,35 @@ class TestDR(unittest.TestCase):
         with self.assertRaises(AssertionError):
             test = gqtree.int_index([-0b011, 0b01], 2)
 
+    def test_int_index_array(self):
+        rng = np.random.RandomState(1)
+        for (dims, levels) in [(2, 4), (3, 5), (2, 20), (6, 10), (1, 64), (3, 30), (5, 13)]:
+            positions = rng.randint(0, 2 ** min(levels, 62), size=(50, dims))
+            positions[0] = 0
+            positions[1] = 2 ** min(levels, 62) - 1
+            indices = gqtree.int_index_array(positions, levels)
+            self.assertEqual(indices.dtype, gqtree.index_dtype(levels, dims))
+            expected = [gqtree.int_index(p, levels) for p in positions]
+            self.assertEqual([int(i) for i in indices], expected)
+            back = gqtree.int_index_inverse_array(indices, levels, dims)
+            self.assertEqual(back.tolist(), positions.tolist())
+        self.assertEqual(gqtree.index_dtype(30, 3), np.dtype(object))
+        self.assertEqual(gqtree.index_dtype(32, 2), np.dtype(np.uint64))
+        with self.assertRaises(AssertionError):
+            gqtree.int_index_array([[0b0111, 0b01]], 2)
+        with self.assertRaises(AssertionError):
+            gqtree.int_index_array([[-0b011, 0b01]], 2)
+        with self.assertRaises(AssertionError):
+            gqtree.int_index_inverse_array([0b101010], 2, 2)
+
+    def test_index_positions(self):
+        gq = gqtree.GeneralizedQuadtree(origin=[1.0, 2.0], sidelength=8.0, levels=2)
+        positions = [[1.0, 2.0], [8, 9], [7.1, 4.2], [1.5, 2.25]]
+        (indices, int_positions) = gq.index_positions(positions)
+        for (position, index, int_position) in zip(positions, indices, int_positions):
+            self.assertEqual(gq.index_position(position)[0], index)
+            self.assertEqual(list(gq.int_position(position)), list(int_position))
+
     def test_int_position(self):
         gq = gqtree.GeneralizedQuadtree(origin=[1.0, 2.0], sidelength=8.0, levels=2)
         self.assertEqual(list(gq.int_position([1.0, 2.0])), [0, 0])
@@ -259,9 +291,51 @@ class TestDR(unittest.TestCase):
         def callback(p, node, t, d):
             D[(node.level, node.prefix)] = node.data
         gq.adjacency_walk((7.1, 7.1), callback)
-        expectD = {(None, 864): {'t': {'position': [7, 7], 'w': 1000}}, 
+        expectD = {(None, 864): {'t': {'position': [7, 7], 'w': 1000}},
                    (2, 0): {}}
         self.assertEqual(D, expectD)
+        self.assertEqual([(node.level, node.prefix) for node in gq.iter_adjacent((7.1, 7.1))],
+                         [(2, 0), (None, 864)])
+
+    def test_iterators(self):
+        rng = np.random.RandomState(4)
+        positions = rng.uniform(0.0, 8.0, size=(60, 2))
+        names = ["n%s" % i for i in range(60)]
+        for compact in (False, True):
+            gq = gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, positions, names, compact=compact)
+            walked = []
+            gq.walk(lambda node, tree, data: walked.append(node))
+            post = list(gq.iter_nodes())
+            self.assertEqual(post, walked)
+            pre = list(gq.iter_nodes("pre"))
+            bfs = list(gq.iter_nodes("bfs"))
+            self.assertEqual(set(pre), set(post))
+            self.assertEqual(set(bfs), set(post))
+            self.assertEqual(pre[0], gq.root)
+            self.assertEqual(post[-1], gq.root)
+            # parents precede children in pre and bfs order, and follow them in post order
+            for (order, nodes) in (("pre", pre), ("bfs", bfs), ("post", post[::-1])):
+                number = dict((id(node), i) for (i, node) in enumerate(nodes))
+                for node in nodes:
+                    for child in node.child_nodes():
+                        self.assertTrue(number[id(child)] > number[id(node)], order)
+            depth = {id(gq.root): 0}
+            for node in pre:
+                for child in node.child_nodes():
+                    depth[id(child)] = depth[id(node)] + 1
+            self.assertEqual([depth[id(node)] for node in bfs], sorted(depth.values()))
+            leaves = list(gq.iter_leaves())
+            self.assertEqual(leaves, [node for node in post if node.level is None])
+            self.assertEqual([leaf.prefix for leaf in leaves], sorted(leaf.prefix for leaf in leaves))
+            # lazy: stop after the first leaf
+            first = next(gq.iter_leaves())
+            self.assertEqual(first, leaves[0])
+        empty = gqtree.GeneralizedQuadtree([0, 0], 8.0, 6)
+        self.assertEqual(list(empty.iter_nodes("bfs")), [])
+        self.assertEqual(list(empty.iter_leaves()), [])
+        self.assertEqual(list(empty.iter_adjacent((1.0, 1.0))), [])
+        self.assertRaises(ValueError, gq.iter_nodes, "in")
+        self.assertRaises(ValueError, empty.iter_nodes, "in")
 
     def test_get_names(self):
         gq = gqtree.GeneralizedQuadtree(origin=[1.0, 2.0], sidelength=8.0, levels=5)
@@ -352,6 +426,45 @@ class TestDR(unittest.TestCase):
             ('0b1111', 1.0)]
         self.assertEqual(L, eL)
 
+    def test_geometry(self):
+        rng = np.random.RandomState(3)
+        for dims in (2, 3):
+            positions = rng.uniform(1.0, 5.0, size=(200, dims))
+            names = ["n%s" % i for i in range(200)]
+            for tree in (gqtree.GeneralizedQuadtree.from_points([1.0] * dims, 4.0, 6, positions, names),
+                         gqtree.GeneralizedQuadtree.from_points([1.0] * dims, 4.0, 6, positions, names,
+                                                                compact=True),
+                         gqlinear.LinearQuadtree.from_points([1.0] * dims, 4.0, 6, positions, names)):
+                self.assertEqual(tree.level_sides, [4.0 / 2 ** level for level in range(7)])
+                nodes = list(tree.iter_nodes())
+                for node in nodes:
+                    level = node.level if node.level is not None else tree.levels
+                    (lower, upper, center) = tree.node_geometry(node)
+                    np.testing.assert_allclose(lower, tree.index_corner(node.prefix))
+                    np.testing.assert_allclose(upper - lower, tree.level_side(level))
+                    np.testing.assert_allclose(center, (lower + upper) / 2)
+                    if node.level is not None:
+                        self.assertTrue(tree.node_geometry(node) is tree.node_geometry(node))
+                prefixes = [node.prefix for node in nodes]
+                levels = [node.level if node.level is not None else tree.levels for node in nodes]
+                locations = rng.uniform(0.0, 6.0, size=(len(nodes), dims))
+                self.assertEqual(
+                    list(tree.avg_dists_to_quadrant_points(np.array(prefixes, dtype=np.uint64),
+                                                           levels, locations)),
+                    [tree.avg_dist_to_quadrant_point(prefix, level, location)
+                     for (prefix, level, location) in zip(prefixes, levels, locations)])
+                others = prefixes[3:] + prefixes[:3]
+                other_levels = levels[3:] + levels[:3]
+                self.assertEqual(
+                    list(tree.avg_dists_between_quadrants(prefixes, levels, others, other_levels)),
+                    [tree.avg_dist_between_quadrants(*args)
+                     for args in zip(prefixes, levels, others, other_levels)])
+        # every dimension counts, not only the first two
+        gq = gqtree.GeneralizedQuadtree(origin=[0.0, 0.0, 0.0], sidelength=4.0, levels=2)
+        far = gq.index([0.0, 0.0, 3.0])
+        self.assertEqual(gq.avg_dist_between_quadrants(0, 2, far, 2), 3.0)
+        self.assertEqual(gq.avg_dist_to_quadrant_point(far, 2, [0.5, 0.5, 0.5]), 3.0)
+
     def test_quadrant_indices(self):
         gq = gqtree.GeneralizedQuadtree(origin=[1.0, 2.0], sidelength=2.0, levels=2)
         L = list(gq.quadrant_indices(0b0100, 1))
@@ -439,3 +552,286 @@ class TestDR(unittest.TestCase):
                 ('0b10', ('Leaf 0b1110', {'8': {'position': [4.0, 6.0]}})),
                 ('0b11', ('Leaf 0b1111', {'12': {'position': [6.0, 6.0]}}))]])]]
         self.assertEqual(expect, dump)
+
+    def test_from_points(self):
+        rng = np.random.RandomState(2)
+        for (dims, levels, npoints) in [(2, 3, 40), (3, 5, 200), (2, 40, 100), (2, 2, 1)]:
+            origin = [-1.0] * dims
+            positions = rng.uniform(-1.0, 3.0, size=(npoints, dims))
+            # force some leaf collisions, including a repeated name.
+            positions[npoints // 2:npoints // 2 + 3] = positions[0]
+            names = ["n%s" % (i % (npoints - 1) if npoints > 1 else i) for i in range(npoints)]
+            infos = [{"i": i} for i in range(npoints)]
+            gq = gqtree.GeneralizedQuadtree(origin, 4.0, levels)
+            for i in range(npoints):
+                gq.add(positions[i], names[i], infos[i])
+            bulk = gqtree.GeneralizedQuadtree.from_points(origin, 4.0, levels, positions, names, infos)
+            self.assertEqual(bulk.list_dump(), gq.list_dump())
+        empty = gqtree.GeneralizedQuadtree.from_points([0, 0], 1.0, 2, [], [])
+        self.assertEqual(empty.list_dump(), None)
+
+    def test_compact(self):
+        rng = np.random.RandomState(4)
+        positions = rng.uniform(0.0, 8.0, size=(80, 2))
+        positions[10:13] = positions[0]
+        names = ["n%s" % (i % 79) for i in range(80)]
+        infos = [{"w": i} if i % 2 else None for i in range(80)]
+        gq = gqtree.GeneralizedQuadtree([0, 0], 8.0, 6)
+        cq = gqtree.GeneralizedQuadtree([0, 0], 8.0, 6, compact=True)
+        for i in range(80):
+            gq.add(positions[i], names[i], infos[i])
+            cq.add(positions[i], names[i], infos[i])
+        bulk = gqtree.GeneralizedQuadtree.from_points(
+            [0, 0], 8.0, 6, positions, names, infos, compact=True)
+        self.assertEqual(cq.list_dump(), gq.list_dump())
+        self.assertEqual(bulk.list_dump(), gq.list_dump())
+        self.assertEqual(cq.root.get_names(), gq.root.get_names())
+        def shapes(tree):
+            D = {}
+            def callback(node, tree, data):
+                D[(node.level, node.prefix)] = (sorted(node.children), node.get_names())
+            tree.walk(callback)
+            return D
+        self.assertEqual(shapes(cq), shapes(gq))
+        with self.assertRaises(AttributeError):
+            cq.root.__dict__
+
+    def test_compact_add_min(self):
+        def node_penalty_fn(node, qindex, voxels, corner):
+            if qindex == node.prefix:
+                return len(node.get_names())
+            return 0
+        gq = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=2)
+        cq = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=2, compact=True)
+        for name in (str(i) for i in range(16)):
+            gq.add_at_min_penalty(node_penalty_fn, name)
+            cq.add_at_min_penalty(node_penalty_fn, name)
+        self.assertEqual(cq.list_dump(), gq.list_dump())
+
+    def test_min_penalty_frontier(self):
+        # integer penalties so that sums do not depend on frontier order
+        def node_penalty_fn(node, qindex, voxels, corner):
+            ipos = gq.node_int_position(node)
+            return len(node.get_names()) * (20 - int(np.abs(ipos - voxels).max()))
+        def vector_penalty_fn(nodes, node_positions, qindices, voxels, corners):
+            counts = np.array([len(node.get_names()) for node in nodes])
+            distances = np.abs(voxels[:, None, :] - node_positions[None, :, :]).max(axis=2)
+            return counts * (20 - distances)
+        def initial_penalty_fn(qindex, voxels, corner):
+            return int(voxels[0]) % 3
+        for compact in (False, True):
+            gq = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=4, compact=compact)
+            vq = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=4, compact=compact)
+            for name in range(40):
+                if name:
+                    expected = reference_min_penalty_index(gq, node_penalty_fn, initial_penalty_fn)
+                    self.assertEqual(gq.min_penalty_index(node_penalty_fn, initial_penalty_fn), expected)
+                gq.add_at_min_penalty(node_penalty_fn, name, initial_penalty_fn=initial_penalty_fn)
+                vq.add_at_min_penalty(None, name, initial_penalty_fn=initial_penalty_fn,
+                                      vector_penalty_fn=vector_penalty_fn)
+            self.assertEqual(vq.list_dump(), gq.list_dump())
+
+    def test_add_many_at_min_penalty(self):
+        def node_penalty_fn(node, qindex, voxels, corner):
+            ipos = gq.node_int_position(node)
+            return len(node.get_names()) * (20 - int(np.abs(ipos - voxels).max()))
+        def vector_penalty_fn(nodes, node_positions, qindices, voxels, corners):
+            counts = np.array([len(node.get_names()) for node in nodes])
+            distances = np.abs(voxels[:, None, :] - node_positions[None, :, :]).max(axis=2)
+            return counts * (20 - distances)
+        names = range(60)
+        for compact in (False, True):
+            gq = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=4, compact=compact)
+            for name in names:
+                gq.add_at_min_penalty(node_penalty_fn, name)
+            many = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=4, compact=compact)
+            positions = many.add_many_at_min_penalty(node_penalty_fn, names)
+            self.assertEqual(many.list_dump(), gq.list_dump())
+            self.assertEqual(positions.shape, (len(names), 2))
+            placed = {}
+            def collect(node, tree, data):
+                if node.level is None:
+                    placed.update(node.entries())
+            gq.walk(collect)
+            self.assertEqual(positions.tolist(), [list(placed[name]) for name in names])
+            vq = gqtree.GeneralizedQuadtree(origin=[0, 0], sidelength=8.0, levels=4, compact=compact)
+            vpositions = vq.add_many_at_min_penalty(None, names, vector_penalty_fn=vector_penalty_fn)
+            self.assertEqual(vq.list_dump(), gq.list_dump())
+            self.assertEqual(vpositions.tolist(), positions.tolist())
+
+    def test_remove_and_move(self):
+        rng = np.random.RandomState(6)
+        positions = rng.uniform(0.0, 8.0, size=(120, 2))
+        positions[20:23] = positions[0]
+        names = ["n%s" % i for i in range(120)]
+        infos = [{"w": i} for i in range(120)]
+        for compact in (False, True):
+            gq = gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, positions, names, infos,
+                                                       compact=compact)
+            gq.root.get_names()
+            gq.add_reducer(gqaggregate.count_reducer())
+            gq.get_aggregate("count")
+            current = dict((name, (positions[i], infos[i])) for (i, name) in enumerate(names))
+            for i in rng.permutation(120)[:50]:
+                (position, info) = gq.remove(names[i])
+                self.assertEqual(list(position), list(positions[i]))
+                self.assertEqual(info, infos[i])
+                del current[names[i]]
+            for name in sorted(current)[:30]:
+                moved = np.clip(current[name][0] + rng.uniform(-0.2, 0.2, size=2), 0.1, 7.9)
+                gq.move(name, moved)
+                current[name] = (moved, current[name][1])
+            self.assertRaises(ValueError, gq.remove, "missing")
+            remaining = sorted(current)
+            expected = gqtree.GeneralizedQuadtree.from_points(
+                [0, 0], 8.0, 6, [current[name][0] for name in remaining], remaining,
+                [current[name][1] for name in remaining], compact=compact)
+            self.assertEqual(gq.list_dump(), expected.list_dump())
+            self.assertEqual(gq.get_aggregate("count"), len(remaining))
+            # interior nodes keep at least two children, and cached names stay exact.
+            def check(node, tree, data):
+                if node.level is not None:
+                    self.assertTrue(len(node.child_nodes()) >= 2)
+                    names_below = set()
+                    for child in node.child_nodes():
+                        names_below.update(child.get_names())
+                    self.assertEqual(node.get_names(), names_below)
+            gq.walk(check)
+            for name in remaining:
+                gq.remove(name)
+            self.assertEqual(gq.root, None)
+            self.assertEqual(gq.name_index, {})
+        lq = gqlinear.LinearQuadtree.from_points([0, 0], 8.0, 6, positions, names, infos)
+        gq = gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, positions, names, infos)
+        for tree in (lq, gq):
+            for name in names[::3]:
+                tree.remove(name)
+            tree.move(names[1], [7.5, 7.5])
+        self.assertEqual(lq.list_dump(), gq.list_dump())
+
+    def test_move_many(self):
+        rng = np.random.RandomState(7)
+        positions = rng.uniform(0.0, 8.0, size=(100, 2))
+        names = ["n%s" % i for i in range(100)]
+        infos = [{"w": i} for i in range(100)]
+        moved = rng.uniform(0.0, 8.0, size=(100, 2))
+        for count in (10, 60):
+            # few names move one at a time, many by rebuilding
+            final = positions.copy()
+            final[:count] = moved[:count]
+            expected = gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, final, names, infos)
+            trees = [gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, positions, names, infos,
+                                                           compact=compact)
+                     for compact in (False, True)]
+            trees.append(gqlinear.LinearQuadtree.from_points([0, 0], 8.0, 6, positions, names, infos))
+            for tree in trees:
+                tree.move_many(names[:count], moved[:count])
+                self.assertEqual(tree.list_dump(), expected.list_dump())
+                self.assertEqual(dict((name, tree.locate(name)[0]) for name in names),
+                                 dict((name, expected.locate(name)[0]) for name in names))
+
+    def test_locate(self):
+        rng = np.random.RandomState(8)
+        positions = rng.uniform(0.0, 8.0, size=(60, 2))
+        positions[10:13] = positions[0]
+        names = ["n%s" % i for i in range(60)]
+        trees = [gqtree.GeneralizedQuadtree([0, 0], 8.0, 6, compact=compact) for compact in (False, True)]
+        trees.append(gqlinear.LinearQuadtree([0, 0], 8.0, 6))
+        trees.append(gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, positions, names))
+        for tree in trees[:3]:
+            for (position, name) in zip(positions, names):
+                tree.add(position, name)
+        for tree in trees:
+            for (position, name) in zip(positions, names):
+                self.assertTrue(name in tree)
+                (index, leaf) = tree.locate(name)
+                self.assertEqual(index, tree.index(position))
+                self.assertEqual(leaf.prefix, index)
+                self.assertTrue(name in leaf.get_names())
+                self.assertEqual(list(tree.position_of(name)), list(position))
+            self.assertFalse("missing" in tree)
+            self.assertRaises(ValueError, tree.locate, "missing")
+        # leaves merged by combine are indexed where the names ended up
+        gq = trees[0]
+        self.assertTrue(gq.locate("n10")[1] is gq.locate("n0")[1])
+        gq.add_at_min_penalty(lambda node, qindex, voxels, corner: len(node.get_names()), "placed")
+        self.assertTrue("placed" in gq.locate("placed")[1].get_names())
+        self.assertEqual(gq.root.get_names(), set(names + ["placed"]))
+        # names are cached only on the nodes asked
+        cq = trees[1]
+        self.assertEqual(cq.root.get_names(), set(names))
+        self.assertTrue(all(child.level is None or child._names is None
+                            for child in cq.root.child_nodes()))
+
+    def test_copies(self):
+        # a name added at two voxels stays in the tree until both copies are removed
+        rng = np.random.RandomState(9)
+        positions = rng.uniform(0.0, 8.0, size=(30, 2))
+        names = ["n%s" % i for i in range(30)]
+        (first, second) = ([0.5, 0.5], [0.9, 0.9])
+        trees = []
+        for (compact, persistent) in ((False, False), (True, False), (False, True)):
+            tree = gqtree.GeneralizedQuadtree([0, 0], 8.0, 6, compact=compact)
+            if persistent:
+                tree.enable_snapshots()
+            trees.append(tree)
+        trees.append(gqlinear.LinearQuadtree([0, 0], 8.0, 6))
+        for tree in trees:
+            for (position, name) in zip(positions, names):
+                tree.add(position, name)
+            tree.add(first, "dup")
+            tree.add(second, "dup")
+            # cache names on the root and on the node holding both copies
+            path = tree.containing_path(tree.index(first))
+            for node in path[:-1]:
+                node.get_names()
+            self.assertEqual(tree.locate("dup")[0], tree.index(second))
+            tree.remove("dup")
+            self.assertTrue("dup" in tree)
+            self.assertEqual(tree.locate("dup")[0], tree.index(first))
+            self.assertEqual(list(tree.position_of("dup")), first)
+            self.assertTrue("dup" in tree.root.get_names())
+            self.assertTrue(all("dup" in node.get_names() for node in
+                                tree.containing_path(tree.index(first))))
+            tree.remove("dup")
+            self.assertFalse("dup" in tree)
+            self.assertEqual(tree.root.get_names(), set(names))
+            self.assertEqual(tree.name_copies, {})
+        # bulk builds index a repeated name at its last voxel in index order
+        gq = gqtree.GeneralizedQuadtree.from_points([0, 0], 8.0, 6, [second, first], ["dup", "dup"])
+        self.assertEqual(gq.locate("dup")[0], gq.index(second))
+        gq.remove("dup")
+        self.assertEqual(gq.locate("dup")[0], gq.index(first))
+        gq.remove("dup")
+        self.assertEqual(gq.root, None)
+
+def reference_min_penalty_index(tree, node_penalty_fn, initial_penalty_fn=None):
+    "Voxel index from the original add_at_min_penalty, rescanning the frontier per level."
+    index = 0
+    index_to_node = {0: tree.root}
+    for level in range(tree.levels):
+        for node_index in list(index_to_node.keys()):
+            node = index_to_node[node_index]
+            if (node.level is not None and node.level <= level and
+                    tree.adjacent(index, node_index, node.level)):
+                del index_to_node[node_index]
+                for child in node.children.values():
+                    index_to_node[child.prefix] = child
+        best_penalty = None
+        best_corner = None
+        for qindex in tree.quadrant_indices(index, level):
+            voxels = gqtree.int_index_inverse(qindex, tree.levels, tree.dimensions)
+            corner = tree.index_corner(qindex)
+            penalty = 0
+            if initial_penalty_fn is not None:
+                penalty = initial_penalty_fn(qindex, voxels, corner)
+            for node in index_to_node.values():
+                penalty += node_penalty_fn(node, qindex, voxels, corner)
+            if best_penalty is None or penalty < best_penalty:
+                (best_penalty, best_corner, index) = (penalty, corner, qindex)
+            elif penalty == best_penalty:
+                new_norm = np.linalg.norm(tree.center - corner)
+                best_norm = np.linalg.norm(tree.center - best_corner)
+                if new_norm < best_norm:
+                    (best_penalty, best_corner, index) = (penalty, corner, qindex)
+    return index